@@ -26,7 +26,7 @@ import urllib2
 from distutils.version import LooseVersion
 from operator import attrgetter
 
-from brkt_cli import brkt_jwt, util
+from brkt_cli import brkt_jwt, progress, trace, util
 from brkt_cli.config import CLIConfig, CONFIG_PATH
 from brkt_cli.proxy import Proxy, generate_proxy_config, validate_proxy_config
 from brkt_cli.util import validate_dns_name_ip_address
@@ -466,6 +466,24 @@ def main():
         default=True,
         help="Don't check whether this version of brkt-cli is supported"
     )
+    parser.add_argument(
+        '--trace-file',
+        metavar='PATH',
+        dest='trace_file',
+        help=(
+            'Write the duration, API call count and retry count of each '
+            'phase to this file, in JSON format'
+        )
+    )
+    parser.add_argument(
+        '--progress-file',
+        metavar='PATH',
+        dest='progress_file',
+        help=(
+            'Write encryption progress events to this file, one JSON '
+            'document per line.  Specify - to write to stdout.'
+        )
+    )
 
     # Batch up messages that are logged while loading modules.  We don't know
     # whether to log them yet, since we haven't parsed arguments.  argparse
@@ -590,10 +608,29 @@ def main():
 
     result = 1
 
+    if values.trace_file:
+        trace.enable()
+
+    progress_writer = None
+    progress_f = None
+    if values.progress_file:
+        if values.progress_file == '-':
+            progress_f = sys.stdout
+        else:
+            try:
+                progress_f = open(values.progress_file, 'w')
+            except IOError as e:
+                log.error('Unable to open %s: %s', values.progress_file, e)
+                return 1
+        progress_writer = progress.JSONLinesWriter(progress_f)
+        progress.add_listener(progress_writer)
+
     # Run the subcommand.
     allow_debug_log = True
     try:
-        result = subcommand.run(values)
+        with trace.span(
+                'brkt ' + subcommand.name(), brkt_cli_version=VERSION):
+            result = subcommand.run(values)
         if not isinstance(result, (int, long)):
             raise Exception(
                 '%s did not return an integer result' % subcommand.name())
@@ -609,6 +646,17 @@ def main():
         log.debug('', exc_info=1)
         log.error('Interrupted by user')
     finally:
+        if util.retry_stats.calls:
+            log.debug('Retried API calls: %s', util.retry_stats)
+        if progress_writer:
+            progress.remove_listener(progress_writer)
+            if progress_f is not sys.stdout:
+                progress_f.close()
+        if values.trace_file:
+            try:
+                trace.write(values.trace_file)
+            except IOError as e:
+                log.error('Unable to write %s: %s', values.trace_file, e)
         if debug_handler:
             logging.root.removeHandler(debug_handler)
             debug_handler.close()
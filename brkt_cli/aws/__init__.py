@@ -21,15 +21,21 @@ import boto
 from boto.exception import EC2ResponseError, NoAuthHandlerFound
 
 import brkt_cli
-from brkt_cli import encryptor_service, util
+from brkt_cli import encryptor_service, journal, util
 from brkt_cli.aws import (
     aws_service,
+    copy_ami,
     diag,
     diag_args,
     encrypt_ami,
     encrypt_ami_args,
+    encrypt_batch,
+    rate_limiter,
+    share_ami,
+    share_ami_args,
     share_logs,
     share_logs_args,
+    snapshot_cache,
     update_encrypted_ami_args
 )
 from brkt_cli.aws.encrypt_ami import (
@@ -186,14 +192,145 @@ def run_share_logs(values):
     return 0
 
 
+def _get_role_arns(values):
+    """ Return the IAM role ARNs that were specified on the command line
+    or in the file specified by --role-arn-file.
+
+    :raise ValidationError if no ARNs were specified, the file can't be
+        read, or an ARN is malformed
+    """
+    role_arns = list(values.role_arns or [])
+    if values.role_arn_file:
+        try:
+            with open(values.role_arn_file) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        role_arns.append(line)
+        except IOError as e:
+            log.debug('Unable to read %s: %s', values.role_arn_file, e)
+            raise ValidationError('Unable to read %s' % values.role_arn_file)
+
+    if not role_arns:
+        raise ValidationError('Specify at least one IAM role ARN')
+    for role_arn in role_arns:
+        if not share_ami.get_account_id(role_arn):
+            raise ValidationError('Invalid IAM role ARN: %s' % role_arn)
+    return role_arns
+
+
 @_handle_aws_errors
-def run_encrypt(values, config, verbose=False):
+def run_share_ami(values):
+    role_arns = _get_role_arns(values)
+    nonce = util.make_nonce()
+
+    aws_svc = aws_service.AWSService(
+        nonce,
+        retry_timeout=values.retry_timeout,
+        retry_initial_sleep_seconds=values.retry_initial_sleep_seconds
+    )
+    log.debug(
+        'Retry timeout=%.02f, initial sleep seconds=%.02f',
+        aws_svc.retry_timeout, aws_svc.retry_initial_sleep_seconds)
+
+    _validate_region(aws_svc, values.region)
+    aws_svc.connect(values.region)
+    aws_svc.default_tags = brkt_cli.parse_tags(values.tags)
+
+    results = share_ami.share_ami(
+        aws_svc,
+        values.ami,
+        role_arns,
+        copy=values.copy,
+        max_concurrent_accounts=values.max_concurrent_accounts
+    )
+    # Print one row per account to stdout, so that the caller can
+    # process the output.
+    print(share_ami.render_results(results))
+    if all(r.succeeded for r in results):
+        return 0
+    return 1
+
+
+def _get_guest_image_ids(values):
+    """ Return the guest AMI IDs that were specified on the command line
+    or in the file specified by --ami-file.
+
+    :raise ValidationError if no AMIs were specified or the file can't
+        be read
+    """
+    image_ids = list(values.ami or [])
+    if values.ami_file:
+        try:
+            with open(values.ami_file) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        image_ids.append(line)
+        except IOError as e:
+            log.debug('Unable to read %s: %s', values.ami_file, e)
+            raise ValidationError('Unable to read %s' % values.ami_file)
+
+    if not image_ids:
+        raise ValidationError('Specify at least one guest AMI to encrypt')
+    return image_ids
+
+
+def _load_journal(values, command):
+    """ Load the journal for the session specified by --resume, or create
+    a new one.  A resumed session is kept again if it's interrupted.
+
+    :return a tuple of (session id, Journal)
+    """
+    if values.resume:
+        session_journal = journal.Journal.load(
+            values.resume, command, keep_session=True)
+        return values.resume, session_journal
     session_id = util.make_nonce()
+    return session_id, journal.Journal(
+        session_id, command, keep_session=values.keep_session)
+
+
+@_handle_aws_errors
+def run_encrypt(values, config, verbose=False):
+    session_id, session_journal = _load_journal(values, 'encrypt')
+    if values.resume:
+        # The guest AMI was saved in the journal.
+        image_id = session_journal.get('image_id')
+        if (values.ami or values.ami_file) and \
+                _get_guest_image_ids(values) != [image_id]:
+            raise ValidationError(
+                'Session %s is encrypting %s' % (session_id, image_id))
+        image_ids = [image_id]
+    else:
+        image_ids = _get_guest_image_ids(values)
+
+    if len(image_ids) > 1 and values.encrypted_ami_name:
+        raise ValidationError(
+            '--encrypted-ami-name cannot be used when encrypting more '
+            'than one AMI')
+
+    copy_to_regions = values.copy_to_regions or []
+    if copy_to_regions and len(image_ids) > 1:
+        raise ValidationError(
+            '--copy-to-region cannot be used when encrypting more than '
+            'one AMI')
+    if values.region in copy_to_regions:
+        raise ValidationError(
+            'Cannot copy the encrypted AMI to %s, because it is encrypted '
+            'in that region' % values.region)
+
+    if values.encrypted_volume_iops and \
+            values.encrypted_volume_type != 'io1':
+        raise ValidationError(
+            '--encrypted-volume-iops can only be used with '
+            '--encrypted-volume-type io1')
 
     aws_svc = aws_service.AWSService(
         session_id,
         retry_timeout=values.retry_timeout,
-        retry_initial_sleep_seconds=values.retry_initial_sleep_seconds
+        retry_initial_sleep_seconds=values.retry_initial_sleep_seconds,
+        limiter=rate_limiter.RateLimiter(state_file=values.rate_limit_file)
     )
     log.debug(
         'Retry timeout=%.02f, initial sleep seconds=%.02f',
@@ -207,6 +344,8 @@ def run_encrypt(values, config, verbose=False):
     if values.validate:
         # Validate the region before connecting.
         _validate_region(aws_svc, values.region)
+        for region in copy_to_regions:
+            _validate_region(aws_svc, region)
 
         if values.token:
             brkt_cli.check_jwt_auth(brkt_env, values.token)
@@ -214,11 +353,14 @@ def run_encrypt(values, config, verbose=False):
     aws_svc.connect(values.region, key_name=values.key_name)
 
     if values.validate:
-        guest_image = _validate_guest_ami(aws_svc, values.ami)
-    else:
-        guest_image = aws_svc.get_image(values.ami)
+        for image_id in image_ids:
+            _validate_guest_ami(aws_svc, image_id)
 
-    encryptor_ami = values.encryptor_ami or _get_encryptor_ami(values.region)
+    encryptor_ami = (
+        values.encryptor_ami or
+        session_journal.get('encryptor_ami') or
+        _get_encryptor_ami(values.region)
+    )
     default_tags = encrypt_ami.get_default_tags(session_id, encryptor_ami)
     default_tags.update(brkt_cli.parse_tags(values.tags))
     aws_svc.default_tags = default_tags
@@ -237,10 +379,49 @@ def run_encrypt(values, config, verbose=False):
             log.debug('Writing instance user data to %s', f.name)
             f.write(instance_config.make_userdata())
 
+    cache = None
+    if values.snapshot_cache:
+        cache = snapshot_cache.SnapshotCache(
+            ttl_days=values.snapshot_cache_ttl,
+            max_size_gb=values.snapshot_cache_max_size
+        )
+
+    if len(image_ids) > 1:
+        results = encrypt_batch.encrypt_batch(
+            aws_svc=aws_svc,
+            enc_svc_cls=encryptor_service.EncryptorService,
+            image_ids=image_ids,
+            encryptor_ami=encryptor_ami,
+            subnet_id=values.subnet_id,
+            security_group_ids=values.security_group_ids,
+            guest_instance_type=values.guest_instance_type,
+            instance_config=instance_config,
+            status_port=values.status_port,
+            save_encryptor_logs=values.save_encryptor_logs,
+            terminate_encryptor_on_failure=(
+                values.terminate_encryptor_on_failure),
+            max_concurrent_encryptions=values.max_concurrent_encryptions,
+            snapshot_cache=cache,
+            encrypted_volume_type=values.encrypted_volume_type,
+            encrypted_volume_iops=values.encrypted_volume_iops,
+            fast_snapshot_restore=values.fast_snapshot_restore
+        )
+        # Print one row per image to stdout, so that the caller can
+        # process the output.
+        print(encrypt_batch.render_results(results))
+        if all(r.succeeded for r in results):
+            return 0
+        return 1
+
+    session_journal.record(
+        encrypt_ami.PHASE_STARTED,
+        image_id=image_ids[0],
+        encryptor_ami=encryptor_ami
+    )
     encrypted_image_id = encrypt_ami.encrypt(
         aws_svc=aws_svc,
         enc_svc_cls=encryptor_service.EncryptorService,
-        image_id=guest_image.id,
+        image_id=image_ids[0],
         encryptor_ami=encryptor_ami,
         encrypted_ami_name=values.encrypted_ami_name,
         subnet_id=values.subnet_id,
@@ -250,22 +431,42 @@ def run_encrypt(values, config, verbose=False):
         status_port=values.status_port,
         save_encryptor_logs=values.save_encryptor_logs,
         terminate_encryptor_on_failure=(
-            values.terminate_encryptor_on_failure)
+            values.terminate_encryptor_on_failure),
+        journal=session_journal,
+        snapshot_cache=cache,
+        encrypted_volume_type=values.encrypted_volume_type,
+        encrypted_volume_iops=values.encrypted_volume_iops,
+        fast_snapshot_restore=values.fast_snapshot_restore
     )
-    # Print the AMI ID to stdout, in case the caller wants to process
-    # the output.  Log messages go to stderr.
-    print(encrypted_image_id)
-    return 0
+    if not copy_to_regions:
+        # Print the AMI ID to stdout, in case the caller wants to process
+        # the output.  Log messages go to stderr.
+        print(encrypted_image_id)
+        return 0
+
+    results = copy_ami.copy_to_regions(
+        aws_svc, encrypted_image_id, copy_to_regions)
+    # Print one row per region to stdout.
+    print(copy_ami.render_results(
+        values.region, encrypted_image_id, results))
+    if all(r.succeeded for r in results):
+        return 0
+    return 1
 
 
 @_handle_aws_errors
 def run_update(values, config, verbose=False):
-    nonce = util.make_nonce()
+    nonce, session_journal = _load_journal(values, 'update')
+    if values.resume and session_journal.get('encrypted_ami') != values.ami:
+        raise ValidationError(
+            'Session %s is updating %s' %
+            (nonce, session_journal.get('encrypted_ami')))
 
     aws_svc = aws_service.AWSService(
         nonce,
         retry_timeout=values.retry_timeout,
-        retry_initial_sleep_seconds=values.retry_initial_sleep_seconds
+        retry_initial_sleep_seconds=values.retry_initial_sleep_seconds,
+        limiter=rate_limiter.RateLimiter(state_file=values.rate_limit_file)
     )
     log.debug(
         'Retry timeout=%.02f, initial sleep seconds=%.02f',
@@ -285,7 +486,11 @@ def run_update(values, config, verbose=False):
 
     aws_svc.connect(values.region, key_name=values.key_name)
     encrypted_image = _validate_ami(aws_svc, values.ami)
-    encryptor_ami = values.encryptor_ami or _get_encryptor_ami(values.region)
+    encryptor_ami = (
+        values.encryptor_ami or
+        session_journal.get('encryptor_ami') or
+        _get_encryptor_ami(values.region)
+    )
     default_tags = encrypt_ami.get_default_tags(nonce, encryptor_ami)
     default_tags.update(brkt_cli.parse_tags(values.tags))
     aws_svc.default_tags = default_tags
@@ -312,8 +517,13 @@ def run_update(values, config, verbose=False):
         )
         return 1
 
-    encrypted_ami_name = values.encrypted_ami_name
-    if encrypted_ami_name:
+    encrypted_ami_name = (
+        session_journal.get('encrypted_ami_name') or
+        values.encrypted_ami_name
+    )
+    if values.resume:
+        log.debug('Image name: %s', encrypted_ami_name)
+    elif encrypted_ami_name:
         # Check for name collision.
         filters = {'name': encrypted_ami_name}
         if aws_svc.get_images(filters=filters, owners=['self']):
@@ -341,6 +551,12 @@ def run_update(values, config, verbose=False):
             log.debug('Writing instance user data to %s', f.name)
             f.write(instance_config.make_userdata())
 
+    session_journal.record(
+        encrypt_ami.PHASE_STARTED,
+        encrypted_ami=encrypted_image.id,
+        encryptor_ami=encryptor_ami,
+        encrypted_ami_name=encrypted_ami_name
+    )
     updated_ami_id = update_ami(
         aws_svc, encrypted_image.id, encryptor_ami, encrypted_ami_name,
         subnet_id=values.subnet_id,
@@ -349,6 +565,7 @@ def run_update(values, config, verbose=False):
         updater_instance_type=values.updater_instance_type,
         instance_config=instance_config,
         status_port=values.status_port,
+        journal=session_journal
     )
     print(updated_ami_id)
     return 0
@@ -404,6 +621,17 @@ class AWSSubcommand(Subcommand):
                                    mode=INSTANCE_CREATOR_MODE)
         encrypt_ami_parser.set_defaults(aws_subcommand='encrypt')
 
+        share_ami_parser = aws_subparsers.add_parser(
+            'share-ami',
+            description=(
+                'Share an encrypted AMI with other AWS accounts.'
+            ),
+            help='Share an encrypted AMI with other accounts',
+            formatter_class=brkt_cli.SortingHelpFormatter
+        )
+        share_ami_args.setup_share_ami_args(share_ami_parser)
+        share_ami_parser.set_defaults(aws_subcommand='share-ami')
+
         share_logs_parser = aws_subparsers.add_parser(
             'share-logs',
             description='Share logs from an existing encrypted instance.',
@@ -443,6 +671,8 @@ class AWSSubcommand(Subcommand):
             return run_diag(values)
         if values.aws_subcommand == 'share-logs':
             return run_share_logs(values)
+        if values.aws_subcommand == 'share-ami':
+            return run_share_ami(values)
 
 
 class DiagSubcommand(Subcommand):
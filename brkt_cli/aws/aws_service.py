@@ -13,9 +13,13 @@
 # limitations under the License.
 
 import abc
+import collections
+import copy
 import logging
 import re
 import ssl
+import threading
+from xml.etree import ElementTree
 
 import boto
 import boto.sts
@@ -23,17 +27,43 @@ import boto.vpc
 from boto.exception import EC2ResponseError, BotoServerError
 
 from brkt_cli import util
-from brkt_cli.util import Deadline, BracketError
+from brkt_cli.aws import describe_cache, poller, rate_limiter
+from brkt_cli.util import BracketError
 from brkt_cli.validation import ValidationError
 
 log = logging.getLogger(__name__)
 
+# boto 2 uses an older EC2 API version, which doesn't have the fast
+# snapshot restore calls.  Those calls are made with a separate connection
+# that uses this version.
+FAST_SNAPSHOT_RESTORE_API_VERSION = '2016-11-15'
+
+# Fast snapshot restore states.
+FSR_ENABLING = 'enabling'
+FSR_OPTIMIZING = 'optimizing'
+FSR_ENABLED = 'enabled'
+FSR_DISABLING = 'disabling'
+FSR_DISABLED = 'disabled'
+
 
 class BaseAWSService(object):
     __metaclass__ = abc.ABCMeta
 
     def __init__(self, session_id):
         self.session_id = session_id
+        # Batches describe calls from concurrent waiters.  Shared with
+        # clones.
+        self.poller = poller.ResourcePoller(self)
+
+    def clone(self, session_id):
+        """ Return a copy of this object that has its own session id and
+        default tags, but shares the underlying connection.  Used when
+        several encryption sessions run concurrently in one process.
+        """
+        svc = copy.copy(self)
+        svc.session_id = session_id
+        svc.default_tags = dict(getattr(self, 'default_tags', None) or {})
+        return svc
 
     @abc.abstractmethod
     def get_regions(self):
@@ -43,6 +73,13 @@ class BaseAWSService(object):
     def connect(self, region, key_name=None):
         pass
 
+    @abc.abstractmethod
+    def connect_as(self, role, region, session_name):
+        """ Connect to the given region with temporary credentials for
+        the given IAM role.
+        """
+        pass
+
     @abc.abstractmethod
     def run_instance(self,
                      image_id,
@@ -61,7 +98,18 @@ class BaseAWSService(object):
         pass
 
     @abc.abstractmethod
-    def create_tags(self, resource_id, name=None, description=None):
+    def get_instances(self, *instance_ids):
+        pass
+
+    @abc.abstractmethod
+    def create_tags(self, resource_id, name=None, description=None,
+                    tags=None):
+        """ Tag the given resource with the default tags, the given tags,
+        and the optional Name and Description tags.
+
+        :param resource_id: a resource id, or a list of ids that get the
+            same tags with one call
+        """
         pass
 
     @abc.abstractmethod
@@ -72,12 +120,19 @@ class BaseAWSService(object):
     def terminate_instance(self, instance_id):
         pass
 
+    def terminate_instances(self, *instance_ids):
+        """ Terminate the given instances.  Subclasses can override this
+        method to terminate them with a single API call.
+        """
+        for instance_id in instance_ids:
+            self.terminate_instance(instance_id)
+
     @abc.abstractmethod
     def get_volume(self, volume_id):
         pass
 
     @abc.abstractmethod
-    def get_volumes(self, tag_key=None, tag_value=None):
+    def get_volumes(self, tag_key=None, tag_value=None, volume_ids=None):
         pass
 
     @abc.abstractmethod
@@ -88,6 +143,13 @@ class BaseAWSService(object):
     def get_snapshot(self, snapshot_id):
         pass
 
+    @abc.abstractmethod
+    def find_snapshots(self, tags):
+        """ Return the snapshots owned by this account that have the given
+        tags.  A tag value of None matches any value.
+        """
+        pass
+
     @abc.abstractmethod
     def create_snapshot(self, volume_id, name=None, description=None):
         pass
@@ -157,6 +219,22 @@ class BaseAWSService(object):
                      block_device_mapping=None):
         pass
 
+    @abc.abstractmethod
+    def copy_image(self, source_region, source_image_id, name=None,
+                   description=None):
+        """ Copy an image from another region into this service's region.
+
+        :return the id of the new image
+        """
+        pass
+
+    @abc.abstractmethod
+    def share_image(self, image_id, account_ids):
+        """ Allow the given AWS accounts to launch the image and to create
+        volumes from its snapshots.
+        """
+        pass
+
     @abc.abstractmethod
     def detach_volume(self, vol_id, instance_id=None, force=True):
         pass
@@ -173,6 +251,27 @@ class BaseAWSService(object):
     def get_instance_attribute(self, instance_id, attribute, dry_run=False):
         pass
 
+    @abc.abstractmethod
+    def enable_fast_snapshot_restore(self, snapshot_id, zone):
+        """ Enable fast snapshot restore for the snapshot in the given
+        availability zone.
+
+        :return the fast snapshot restore state, or None if it can't be
+            enabled for this snapshot or zone
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_fast_snapshot_restore_state(self, snapshot_id, zone):
+        """ Return the fast snapshot restore state of the snapshot in the
+        given availability zone, or None if it isn't enabled.
+        """
+        pass
+
+    @abc.abstractmethod
+    def disable_fast_snapshot_restore(self, snapshot_id, zone):
+        pass
+
     @abc.abstractmethod
     def retry(self, function, error_code_regexp=None, timeout=None):
         pass
@@ -189,8 +288,8 @@ class BotoRetryExceptionChecker(util.RetryExceptionChecker):
             return True
         if not isinstance(exception, BotoServerError):
             return False
-        if exception.status == 503:
-            # This can happen when the AWS request limit has been exceeded.
+        if is_throttle_error(exception):
+            # The AWS request limit has been exceeded.
             return True
         if self.error_code_regexp:
             m = re.match(self.error_code_regexp, exception.error_code)
@@ -198,6 +297,18 @@ class BotoRetryExceptionChecker(util.RetryExceptionChecker):
         return False
 
 
+def is_throttle_error(exception):
+    """ Return True if the exception indicates that AWS throttled the
+    call.
+    """
+    if not isinstance(exception, BotoServerError):
+        return False
+    return (
+        exception.status == 503 or
+        exception.error_code in ('RequestLimitExceeded', 'Throttling')
+    )
+
+
 def retry_boto(function, error_code_regexp=None, timeout=10.0,
                initial_sleep_seconds=0.25):
     """ Retry an AWS API call.  Handle known intermittent errors and expected
@@ -224,6 +335,172 @@ def _get_first_element(list, error_status):
             error_status, 'AWS API returned an empty response')
 
 
+def _find_text(element, name):
+    """ Return the text of the first descendant of the element that has
+    the given name, ignoring the XML namespace.
+    """
+    for e in element.iter():
+        if e.tag == name or e.tag.endswith('}' + name):
+            return e.text
+    return None
+
+
+def _to_list(resource_id):
+    """ Return the given id or list of ids as a list. """
+    if isinstance(resource_id, (list, tuple)):
+        return list(resource_id)
+    return [resource_id]
+
+
+class TagBatch(object):
+    """ Collects tags for several resources and applies them with as few
+    CreateTags calls as possible.  Resources that get the same tags are
+    tagged with one call.  Use as a context manager to apply the tags at
+    the end of a phase:
+
+        with TagBatch(aws_svc) as batch:
+            for snapshot_id, tags in copied_snapshots:
+                batch.add(snapshot_id, tags=tags)
+
+    Only resources that share a tag set are merged, so TagBatch is only
+    worth using when several resources get the same tags.
+
+    If the block raises an exception, the tags that were collected are
+    still applied, so that the resources can be identified later.
+    """
+
+    def __init__(self, aws_svc):
+        self.aws_svc = aws_svc
+        # Resource ids, keyed by (name, description, tags), in the order
+        # that they were added.
+        self._groups = collections.OrderedDict()
+
+    def add(self, resource_id, name=None, description=None, tags=None):
+        key = (name, description, frozenset((tags or {}).items()))
+        self._groups.setdefault(key, []).extend(_to_list(resource_id))
+
+    def flush(self):
+        """ Apply all collected tags.
+
+        :return the number of CreateTags calls that were made
+        """
+        groups = self._groups
+        self._groups = collections.OrderedDict()
+        for (name, description, tags), resource_ids in groups.iteritems():
+            self.aws_svc.create_tags(
+                resource_ids,
+                name=name,
+                description=description,
+                tags=dict(tags)
+            )
+        return len(groups)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not exc_type:
+            self.flush()
+            return
+        # Don't hide the original exception.
+        try:
+            self.flush()
+        except Exception:
+            log.debug('Unable to apply tags', exc_info=1)
+
+
+class ConnectionManager(object):
+    """ Keeps one boto connection per service, region and set of
+    credentials.
+
+    A boto connection keeps a pool of HTTP connections that are reused for
+    later requests, so sharing it avoids a TLS handshake per request.  The
+    pool is thread-safe: each request checks out its own HTTP connection
+    and returns it when the response has been read.  AWSService objects
+    don't modify the connection, so their methods can be called from
+    worker threads.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get(self, connect_to_region, region, aws_access_key_id=None,
+            aws_secret_access_key=None, security_token=None,
+            api_version=None):
+        """ Return the connection for the given region and credentials,
+        creating it if necessary.  If no credentials are specified, boto
+        reads them from the environment or config file.
+
+        :param connect_to_region: the connect_to_region() function from
+            the boto service module, e.g. boto.vpc.connect_to_region
+        :param api_version: overrides boto's default API version
+        :raise ValidationError if the region is unknown
+        """
+        key = (
+            connect_to_region, region, aws_access_key_id, security_token,
+            api_version)
+        with self._lock:
+            conn = self._connections.get(key)
+            if not conn:
+                kwargs = {}
+                if api_version:
+                    kwargs['api_version'] = api_version
+                # Creating a connection doesn't make any network calls.
+                conn = connect_to_region(
+                    region,
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    security_token=security_token,
+                    **kwargs
+                )
+                if not conn:
+                    raise ValidationError('Unknown region %s' % region)
+                self._connections[key] = conn
+            return conn
+
+    def clear(self):
+        with self._lock:
+            self._connections.clear()
+
+
+# Connections for this process.
+connections = ConnectionManager()
+
+
+# Temporary credentials returned by AssumeRole, keyed by (role, session
+# name).  Shared by all AWSService objects in the process, so that
+# concurrent sessions that use the same role only call STS once.
+_sts_credentials = {}
+_sts_credentials_lock = threading.Lock()
+
+# Assume the role again when the credentials expire in less than this
+# many seconds.
+STS_CREDENTIALS_MIN_LIFETIME = 5 * 60
+
+
+def _assume_role(role, region, session_name):
+    """ Return temporary credentials for the given role.  Reuse cached
+    credentials until they are about to expire.
+    """
+    key = (role, session_name)
+    with _sts_credentials_lock:
+        creds = _sts_credentials.get(key)
+    if creds and not creds.is_expired(
+            time_offset_seconds=STS_CREDENTIALS_MIN_LIFETIME):
+        return creds
+
+    # Don't hold the lock while calling STS, so that different roles can
+    # be assumed concurrently.
+    log.debug('Assuming role %s', role)
+    sts_conn = connections.get(boto.sts.connect_to_region, region)
+    assume_role = retry_boto(sts_conn.assume_role)
+    creds = assume_role(role, session_name).credentials
+    with _sts_credentials_lock:
+        _sts_credentials[key] = creds
+    return creds
+
+
 class AWSService(BaseAWSService):
 
     def __init__(
@@ -231,17 +508,30 @@ class AWSService(BaseAWSService):
             encryptor_session_id,
             default_tags=None,
             retry_timeout=10.0,
-            retry_initial_sleep_seconds=0.25):
+            retry_initial_sleep_seconds=0.25,
+            cache_describes=True,
+            limiter=None):
+        """
+        :param cache_describes: if True, cache the results of describe
+            calls, as described in the describe_cache module
+        :param limiter: the RateLimiter for API calls.  Every EC2 call
+            goes through retry(), which takes a token from the limiter.
+            Clones share it.
+        """
         super(AWSService, self).__init__(encryptor_session_id)
 
         self.default_tags = default_tags or {}
         self.retry_timeout = retry_timeout
         self.retry_initial_sleep_seconds = retry_initial_sleep_seconds
+        self.cache_describes = cache_describes
+        self.cache = None
+        self.limiter = limiter or rate_limiter.RateLimiter()
 
         # These will be initialized by connect().
         self.key_name = None
         self.region = None
         self.conn = None
+        self.credentials = {}
 
     def get_regions(self):
         return boto.vpc.regions()
@@ -249,18 +539,45 @@ class AWSService(BaseAWSService):
     def connect(self, region, key_name=None):
         self.region = region
         self.key_name = key_name
-        self.conn = boto.vpc.connect_to_region(region)
+        self.credentials = {}
+        self.conn = connections.get(boto.vpc.connect_to_region, region)
+        # A clone that connects to another region can't share the
+        # poller or cache, which hold resources in the original region.
+        self.poller = poller.ResourcePoller(self)
+        self._reset_cache()
 
     def connect_as(self, role, region, session_name):
-        sts_conn = boto.sts.connect_to_region(region)
-        creds = sts_conn.assume_role(role, session_name)
-        conn = boto.vpc.connect_to_region(
-            region,
-            aws_access_key_id=creds.credentials.access_key,
-            aws_secret_access_key=creds.credentials.secret_key,
-            security_token=creds.credentials.session_token)
+        creds = _assume_role(role, region, session_name)
+        self.credentials = {
+            'aws_access_key_id': creds.access_key,
+            'aws_secret_access_key': creds.secret_key,
+            'security_token': creds.session_token
+        }
+        conn = connections.get(
+            boto.vpc.connect_to_region, region, **self.credentials)
         self.region = region
         self.conn = conn
+        self.poller = poller.ResourcePoller(self)
+        self._reset_cache()
+
+    def _reset_cache(self):
+        if self.cache_describes:
+            self.cache = describe_cache.DescribeCache()
+        else:
+            self.cache = None
+
+    def _get_cached(self, resource_id):
+        if self.cache:
+            return self.cache.get(resource_id)
+        return None
+
+    def _cache(self, *resources):
+        if self.cache:
+            self.cache.put(*resources)
+
+    def _invalidate(self, *resource_ids):
+        if self.cache:
+            self.cache.invalidate(*resource_ids)
 
     def retry(self, function, error_code_regexp=None, timeout=None):
         """ Call the retry_boto function with this object's timeout and
@@ -268,7 +585,7 @@ class AWSService(BaseAWSService):
         """
         timeout = timeout or self.retry_timeout
         return retry_boto(
-            function,
+            self.limiter.wrap(function, is_throttle_error),
             error_code_regexp,
             timeout=timeout,
             initial_sleep_seconds=self.retry_initial_sleep_seconds
@@ -314,31 +631,58 @@ class AWSService(BaseAWSService):
             raise
 
     def get_instance(self, instance_id):
+        instance = self._get_cached(instance_id)
+        if instance:
+            return instance
         get_only_instances = self.retry(
             self.conn.get_only_instances, r'InvalidInstanceID\.NotFound')
         instances = get_only_instances([instance_id])
-        return _get_first_element(instances, 'InvalidInstanceID.NotFound')
-
-    def create_tags(self, resource_id, name=None, description=None):
-        tags = dict(self.default_tags)
+        instance = _get_first_element(
+            instances, 'InvalidInstanceID.NotFound')
+        self._cache(instance)
+        return instance
+
+    def get_instances(self, *instance_ids):
+        # Don't retry NotFound.  ResourcePoller looks up the instances one
+        # at a time when one of them is missing.
+        get_only_instances = self.retry(self.conn.get_only_instances)
+        instances = get_only_instances(list(instance_ids))
+        self._cache(*instances)
+        return instances
+
+    def create_tags(self, resource_id, name=None, description=None,
+                    tags=None):
+        all_tags = dict(self.default_tags)
+        if tags:
+            all_tags.update(tags)
         if name:
-            tags['Name'] = name
+            all_tags['Name'] = name
         if description:
-            tags['Description'] = description
-        log.debug('Tagging %s with %s', resource_id, tags)
+            all_tags['Description'] = description
+        resource_ids = _to_list(resource_id)
+        log.debug('Tagging %s with %s', resource_ids, all_tags)
         create_tags = self.retry(self.conn.create_tags, r'.*\.NotFound')
-        create_tags([resource_id], tags)
+        create_tags(resource_ids, all_tags)
+        self._invalidate(*resource_ids)
 
     def stop_instance(self, instance_id):
         log.debug('Stopping instance %s', instance_id)
         stop_instances = self.retry(self.conn.stop_instances)
         instances = stop_instances([instance_id])
+        self._invalidate(instance_id)
         return instances[0]
 
     def terminate_instance(self, instance_id):
         log.debug('Terminating instance %s', instance_id)
         terminate_instances = self.retry(self.conn.terminate_instances)
         terminate_instances([instance_id])
+        self._invalidate(instance_id)
+
+    def terminate_instances(self, *instance_ids):
+        log.debug('Terminating instances %s', instance_ids)
+        terminate_instances = self.retry(self.conn.terminate_instances)
+        terminate_instances(list(instance_ids))
+        self._invalidate(*instance_ids)
 
     def get_volume(self, volume_id):
         get_all_volumes = self.retry(
@@ -346,23 +690,40 @@ class AWSService(BaseAWSService):
         volumes = get_all_volumes(volume_ids=[volume_id])
         return _get_first_element(volumes, 'InvalidVolume.NotFound')
 
-    def get_volumes(self, tag_key=None, tag_value=None):
+    def get_volumes(self, tag_key=None, tag_value=None, volume_ids=None):
         filters = {}
         if tag_key and tag_value:
             filters['tag:%s' % tag_key] = tag_value
 
         get_all_volumes = self.retry(self.conn.get_all_volumes)
-        return get_all_volumes(filters=filters)
+        return get_all_volumes(volume_ids=volume_ids, filters=filters)
 
     def get_snapshots(self, *snapshot_ids):
-        get_all_snapshots = self.retry(
-            self.conn.get_all_snapshots, r'InvalidSnapshot\.NotFound')
-        return get_all_snapshots(snapshot_ids)
+        get_all_snapshots = self.retry(self.conn.get_all_snapshots)
+        snapshots = get_all_snapshots(snapshot_ids)
+        self._cache(*snapshots)
+        return snapshots
 
     def get_snapshot(self, snapshot_id):
-        snapshots = self.get_snapshots(snapshot_id)
+        snapshot = self._get_cached(snapshot_id)
+        if snapshot:
+            return snapshot
+        get_all_snapshots = self.retry(
+            self.conn.get_all_snapshots, r'InvalidSnapshot\.NotFound')
+        snapshots = get_all_snapshots([snapshot_id])
+        self._cache(*snapshots)
         return _get_first_element(snapshots, 'InvalidSnapshot.NotFound')
 
+    def find_snapshots(self, tags):
+        filters = {}
+        for key, value in tags.iteritems():
+            if value is None:
+                filters['tag-key'] = key
+            else:
+                filters['tag:%s' % key] = value
+        get_all_snapshots = self.retry(self.conn.get_all_snapshots)
+        return get_all_snapshots(owner='self', filters=filters)
+
     def create_snapshot(self, volume_id, name=None, description=None):
         log.debug('Creating snapshot of %s', volume_id)
         create_snapshot = self.retry(self.conn.create_snapshot)
@@ -400,16 +761,24 @@ class AWSService(BaseAWSService):
         return get_all_images(filters=filters, owners=owners)
 
     def get_image(self, image_id, retry=False):
-        get_image = self.conn.get_image
+        image = self._get_cached(image_id)
+        if image:
+            return image
+        get_image = self.retry(self.conn.get_image)
         if retry:
             get_image = self.retry(
                 self.conn.get_image, r'InvalidAMIID\.NotFound')
 
-        return get_image(image_id)
+        image = get_image(image_id)
+        if image:
+            self._cache(image)
+        return image
 
     def delete_snapshot(self, snapshot_id):
         delete_snapshot = self.retry(self.conn.delete_snapshot)
-        return delete_snapshot(snapshot_id)
+        result = delete_snapshot(snapshot_id)
+        self._invalidate(snapshot_id)
+        return result
 
     def create_security_group(self, name, description, vpc_id=None):
         log.debug(
@@ -425,7 +794,8 @@ class AWSService(BaseAWSService):
         )
 
     def get_security_group(self, sg_id, retry=True):
-        get_all_security_groups = self.conn.get_all_security_groups
+        get_all_security_groups = self.retry(
+            self.conn.get_all_security_groups)
         if retry:
             get_all_security_groups = self.retry(
                 self.conn.get_all_security_groups, r'InvalidGroup\.NotFound')
@@ -456,10 +826,12 @@ class AWSService(BaseAWSService):
         return _get_first_element(key_pairs, 'InvalidKeyPair.NotFound')
 
     def get_console_output(self, instance_id):
-        return self.conn.get_console_output(instance_id)
+        get_console_output = self.retry(self.conn.get_console_output)
+        return get_console_output(instance_id)
 
     def get_subnet(self, subnet_id):
-        subnets = self.conn.get_all_subnets(subnet_ids=[subnet_id])
+        get_all_subnets = self.retry(self.conn.get_all_subnets)
+        subnets = get_all_subnets(subnet_ids=[subnet_id])
         return _get_first_element(subnets, 'InvalidSubnetID.NotFound')
 
     def create_image(self,
@@ -479,14 +851,54 @@ class AWSService(BaseAWSService):
             block_device_mapping=block_device_mapping
         )
 
+    def copy_image(self, source_region, source_image_id, name=None,
+                   description=None):
+        log.debug(
+            'Copying %s from %s to %s',
+            source_image_id, source_region, self.region)
+        copy_image = self.retry(self.conn.copy_image)
+        result = copy_image(
+            source_region,
+            source_image_id,
+            name=name,
+            description=description
+        )
+        return result.image_id
+
+    def share_image(self, image_id, account_ids):
+        log.debug('Sharing %s with %s', image_id, ', '.join(account_ids))
+        image = self.get_image(image_id, retry=True)
+        modify_image_attribute = self.retry(self.conn.modify_image_attribute)
+        modify_image_attribute(
+            image_id,
+            attribute='launchPermission',
+            operation='add',
+            user_ids=account_ids
+        )
+        modify_snapshot_attribute = self.retry(
+            self.conn.modify_snapshot_attribute)
+        for bdt in image.block_device_mapping.values():
+            if bdt.snapshot_id:
+                modify_snapshot_attribute(
+                    bdt.snapshot_id,
+                    attribute='createVolumePermission',
+                    operation='add',
+                    user_ids=account_ids
+                )
+
     def detach_volume(self, vol_id, instance_id=None, force=True):
         detach_volume = self.retry(self.conn.detach_volume)
-        return detach_volume(
+        result = detach_volume(
             vol_id, instance_id=instance_id, force=force)
+        if instance_id:
+            self._invalidate(instance_id)
+        return result
 
     def attach_volume(self, vol_id, instance_id, device):
         attach_volume = self.retry(self.conn.attach_volume, r'VolumeInUse')
-        return attach_volume(vol_id, instance_id, device)
+        result = attach_volume(vol_id, instance_id, device)
+        self._invalidate(instance_id)
+        return result
 
     def get_default_vpc(self):
         get_all_vpcs = self.retry(self.conn.get_all_vpcs)
@@ -503,6 +915,66 @@ class AWSService(BaseAWSService):
             dry_run=dry_run
         )
 
+    def _query_connection(self):
+        return connections.get(
+            boto.vpc.connect_to_region,
+            self.region,
+            api_version=FAST_SNAPSHOT_RESTORE_API_VERSION,
+            **self.credentials
+        )
+
+    def _query(self, action, params):
+        """ Make an EC2 API call that boto doesn't support, and return the
+        parsed XML response.
+
+        :raise EC2ResponseError if the call fails
+        """
+        conn = self._query_connection()
+        response = conn.make_request(action, params, verb='POST')
+        body = response.read()
+        if response.status != 200:
+            raise conn.ResponseError(response.status, response.reason, body)
+        return ElementTree.fromstring(body)
+
+    def _fast_snapshot_restore_call(self, action, snapshot_id, zone):
+        params = {
+            'SourceSnapshotId.1': snapshot_id,
+            'AvailabilityZone.1': zone
+        }
+        root = self.retry(self._query)(action, params)
+        for element in root.iter():
+            if element.tag.endswith('unsuccessful'):
+                message = _find_text(element, 'message')
+                if message:
+                    log.debug(
+                        '%s failed for %s in %s: %s',
+                        action, snapshot_id, zone, message)
+                    return None
+        return _find_text(root, 'state')
+
+    def enable_fast_snapshot_restore(self, snapshot_id, zone):
+        log.debug(
+            'Enabling fast snapshot restore for %s in %s', snapshot_id, zone)
+        return self._fast_snapshot_restore_call(
+            'EnableFastSnapshotRestores', snapshot_id, zone)
+
+    def get_fast_snapshot_restore_state(self, snapshot_id, zone):
+        params = {
+            'Filter.1.Name': 'snapshot-id',
+            'Filter.1.Value.1': snapshot_id,
+            'Filter.2.Name': 'availability-zone',
+            'Filter.2.Value.1': zone
+        }
+        root = self.retry(self._query)(
+            'DescribeFastSnapshotRestores', params)
+        return _find_text(root, 'state')
+
+    def disable_fast_snapshot_restore(self, snapshot_id, zone):
+        log.debug(
+            'Disabling fast snapshot restore for %s in %s', snapshot_id, zone)
+        return self._fast_snapshot_restore_call(
+            'DisableFastSnapshotRestores', snapshot_id, zone)
+
 
 def validate_image_name(name):
     """ Verify that the name is a valid EC2 image name.  Return the name
@@ -561,6 +1033,30 @@ class VolumeError(BracketError):
     pass
 
 
+# Polling policies for EC2 resources.  The intervals are tuned to how long
+# each state change usually takes, and the timeouts are the latency budget
+# for that phase.
+INSTANCE_WAIT_POLICY = util.WaitPolicy(
+    initial_sleep_seconds=2, max_sleep_seconds=15, timeout=600)
+VOLUME_WAIT_POLICY = util.WaitPolicy(
+    initial_sleep_seconds=0.5, max_sleep_seconds=10, timeout=600)
+VOLUME_ATTACH_WAIT_POLICY = util.WaitPolicy(
+    initial_sleep_seconds=1, max_sleep_seconds=10, timeout=100)
+# Snapshots take anywhere from seconds to hours, depending on how many
+# blocks changed.  By default, wait as long as it takes.
+SNAPSHOT_WAIT_POLICY = util.WaitPolicy(
+    initial_sleep_seconds=2, max_sleep_seconds=30, timeout=None,
+    multiplier=1.5)
+IMAGE_WAIT_POLICY = util.WaitPolicy(
+    initial_sleep_seconds=5, max_sleep_seconds=30, timeout=900,
+    multiplier=1.5, initial_delay_seconds=2)
+# Fast snapshot restore takes about an hour per TiB of snapshot data to be
+# enabled.  After the timeout, the encryptor is launched without it.
+FAST_SNAPSHOT_RESTORE_WAIT_POLICY = util.WaitPolicy(
+    initial_sleep_seconds=10, max_sleep_seconds=60, timeout=30 * 60,
+    multiplier=1.5)
+
+
 def wait_for_volume(aws_svc, volume_id, timeout=600.0, state='available'):
     """ Wait for the volume to be in the specified state.
 
@@ -571,15 +1067,19 @@ def wait_for_volume(aws_svc, volume_id, timeout=600.0, state='available'):
         'Waiting for %s, timeout=%.02f, state=%s',
         volume_id, timeout, state)
 
-    deadline = Deadline(timeout)
-    sleep_time = 0.5
-    while not deadline.is_expired():
-        volume = aws_svc.get_volume(volume_id)
+    def _check():
+        volume = aws_svc.poller.get_volume(volume_id)
         if volume.status == state:
             return volume
-        util.sleep(sleep_time)
-        sleep_time *= 2
-    raise VolumeError(
-        'Timed out waiting for %s to be in the %s state' %
-        (volume_id, state)
+        return None
+
+    return util.wait_until(
+        _check,
+        VOLUME_WAIT_POLICY,
+        timeout=timeout,
+        timeout_error=lambda: VolumeError(
+            'Timed out waiting for %s to be in the %s state' %
+            (volume_id, state)
+        ),
+        description='%s to be %s' % (volume_id, state)
     )
@@ -0,0 +1,157 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Copy an encrypted AMI to other regions.
+
+Encrypting an AMI once and copying the result is much faster than running
+the encryptor in every region.  Copies run concurrently, one thread per
+region, each with its own connection.  EC2 doesn't copy tags, so the tags
+on the source AMI and its snapshots are applied to the copies.
+"""
+
+import logging
+
+from brkt_cli import trace, util
+from brkt_cli.aws import aws_service, encrypt_ami, rate_limiter
+
+# Cross-region copies of large images can take a long time.
+COPY_IMAGE_TIMEOUT = 60 * 60
+
+log = logging.getLogger(__name__)
+
+
+class CopyResult(object):
+    """ The outcome of copying an AMI to one region. """
+
+    def __init__(self, region):
+        self.region = region
+        self.image_id = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.image_id is not None and self.error is None
+
+
+def get_source_snapshots(aws_svc, image):
+    """ Return a dictionary that maps each device in the image's block
+    device mapping to its Snapshot.
+    """
+    snapshot_ids_by_device = dict(
+        (device, bdt.snapshot_id)
+        for device, bdt in image.block_device_mapping.iteritems()
+        if bdt.snapshot_id
+    )
+    snapshots = aws_svc.get_snapshots(*snapshot_ids_by_device.values())
+    snapshots_by_id = dict((s.id, s) for s in snapshots)
+    return dict(
+        (device, snapshots_by_id.get(snapshot_id))
+        for device, snapshot_id in snapshot_ids_by_device.iteritems()
+    )
+
+
+def copy_tags(aws_svc, source_image, source_snapshots, image_id):
+    """ Apply the tags from the source image and its snapshots to the
+    copy.
+
+    :param source_snapshots: the dictionary returned by
+        get_source_snapshots()
+    """
+    image = aws_svc.get_image(image_id, retry=True)
+    with aws_service.TagBatch(aws_svc) as tag_batch:
+        tag_batch.add(image_id, tags=dict(source_image.tags))
+        for device, bdt in image.block_device_mapping.iteritems():
+            source_snapshot = source_snapshots.get(device)
+            if not bdt.snapshot_id or not source_snapshot:
+                continue
+            tag_batch.add(bdt.snapshot_id, tags=dict(source_snapshot.tags))
+
+
+def _copy_to_region(aws_svc, source_image, source_snapshots, result):
+    svc = aws_svc.clone(aws_svc.session_id)
+    # EC2 throttles API calls per region, so each region gets its own
+    # rate limit.
+    svc.limiter = rate_limiter.RateLimiter()
+    svc.connect(result.region)
+
+    with trace.span('copy_image', region=result.region):
+        try:
+            result.image_id = svc.copy_image(
+                aws_svc.region,
+                source_image.id,
+                name=source_image.name,
+                description=source_image.description
+            )
+            log.info(
+                'Copying %s to %s as %s',
+                source_image.id, result.region, result.image_id)
+            encrypt_ami.wait_for_image(
+                svc, result.image_id, timeout=COPY_IMAGE_TIMEOUT)
+            copy_tags(svc, source_image, source_snapshots, result.image_id)
+            log.info('Copied %s to %s', source_image.id, result.region)
+        except Exception as e:
+            log.debug('', exc_info=1)
+            log.error(
+                'Unable to copy %s to %s: %s',
+                source_image.id, result.region, e)
+            result.error = e
+    return result
+
+
+def copy_to_regions(aws_svc, image_id, regions):
+    """ Copy the given AMI from aws_svc's region to the given regions,
+    and wait for all copies to become available.  A failure to copy to
+    one region does not affect the others.
+
+    :return a list of CopyResult objects, in the same order as regions
+    """
+    source_image = aws_svc.get_image(image_id, retry=True)
+
+    # Look up the source snapshots once, so that each copy can be tagged
+    # to match.
+    source_snapshots = get_source_snapshots(aws_svc, source_image)
+
+    results = [CopyResult(region) for region in regions]
+    pool = util.WorkerPool(len(results))
+    try:
+        futures = [
+            pool.submit(
+                _copy_to_region, aws_svc, source_image, source_snapshots, r)
+            for r in results
+        ]
+        for future in futures:
+            future.wait()
+    finally:
+        pool.shutdown(wait=False)
+
+    succeeded = len([r for r in results if r.succeeded])
+    log.info(
+        'Copied %s to %d of %d regions',
+        image_id, succeeded, len(results))
+    return results
+
+
+def render_results(region, image_id, results):
+    """ Render the source AMI and its copies as a table, with one row per
+    region.
+    """
+    rows = [['REGION', 'AMI', 'STATUS'], [region, image_id, 'OK']]
+    for r in results:
+        if r.succeeded:
+            status = 'OK'
+        else:
+            status = 'FAILED: %s' % (r.error or 'unknown error')
+        rows.append([r.region, r.image_id or '-', status])
+    return util.render_table_rows(rows)
@@ -0,0 +1,130 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache the results of describe calls.
+
+Encryption looks up the same image, instance and snapshots several times.
+AWSService.get_image(), get_instance() and get_snapshot() read through
+this cache, and every describe call writes its results to it.  The
+service's own calls that modify a resource invalidate its entry.
+
+How long an entry lives depends on the resource's state.  Available
+images and completed snapshots don't change unless we change them, so
+they are kept for a few minutes.  Instances and pending snapshots change
+on their own, so they are only kept for a few seconds.  Pending images
+aren't cached, because wait_for_image() polls get_image().  Waiters that
+use ResourcePoller always make a describe call, so they see the current
+state.
+
+Callers modify the objects that describe calls return, for example the
+block device mapping of an instance that is used to create an image.  The
+cache stores and returns copies, so those changes don't leak into later
+lookups.
+"""
+
+import copy
+import logging
+import threading
+import time
+
+from boto.ec2.image import Image
+from boto.ec2.instance import Instance
+from boto.ec2.snapshot import Snapshot
+
+STABLE_TTL_SECONDS = 5 * 60
+TRANSITIONAL_TTL_SECONDS = 5
+
+log = logging.getLogger(__name__)
+
+
+def get_ttl(resource):
+    """ Return the number of seconds that the given resource can be
+    cached, based on its type and state.
+    """
+    if isinstance(resource, Image):
+        if resource.state == 'available':
+            return STABLE_TTL_SECONDS
+        return 0
+    if isinstance(resource, Snapshot):
+        if resource.status == 'completed':
+            return STABLE_TTL_SECONDS
+        return TRANSITIONAL_TTL_SECONDS
+    if isinstance(resource, Instance):
+        return TRANSITIONAL_TTL_SECONDS
+    return 0
+
+
+def _copy(resource):
+    """ Return a deep copy of the resource that shares its boto
+    connection.  The connection holds locks and sockets, which can't be
+    copied.
+    """
+    memo = {}
+    connection = getattr(resource, 'connection', None)
+    if connection is not None:
+        memo[id(connection)] = connection
+    return copy.deepcopy(resource, memo)
+
+
+class DescribeCache(object):
+    """ A thread-safe cache of images, instances and snapshots, keyed by
+    id.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, resource_id):
+        """ Return the cached resource, or None if it isn't cached or has
+        expired.
+        """
+        with self._lock:
+            entry = self._entries.get(resource_id)
+            if entry:
+                resource, expires = entry
+                if self.clock() < expires:
+                    self.hits += 1
+                    return _copy(resource)
+                del self._entries[resource_id]
+            self.misses += 1
+            return None
+
+    def put(self, *resources):
+        """ Cache the given resources, if their state allows it. """
+        now = self.clock()
+        with self._lock:
+            for resource in resources:
+                ttl = get_ttl(resource)
+                if ttl > 0:
+                    self._entries[resource.id] = (_copy(resource), now + ttl)
+                else:
+                    self._entries.pop(resource.id, None)
+
+    def invalidate(self, *resource_ids):
+        """ Remove the given resources from the cache.  Called after a
+        resource is modified.
+        """
+        with self._lock:
+            for resource_id in resource_ids:
+                if self._entries.pop(resource_id, None):
+                    log.debug('Invalidated cached %s', resource_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -40,6 +40,7 @@ running the AWS command line utility.
 import logging
 import os
 import string
+import sys
 import tempfile
 import time
 
@@ -50,15 +51,15 @@ from boto.ec2.blockdevicemapping import (
 from boto.ec2.instance import InstanceAttribute
 from boto.exception import EC2ResponseError
 
-from brkt_cli import encryptor_service
+from brkt_cli import encryptor_service, trace, util
 from brkt_cli.aws import aws_service
 from brkt_cli.instance_config import InstanceConfig
+from brkt_cli.journal import keep_resources, record_phase
 from brkt_cli.user_data import gzip_user_data
 from brkt_cli.util import (
     BracketError,
     Deadline,
     make_nonce,
-    sleep,
     append_suffix)
 from datetime import datetime
 
@@ -111,6 +112,15 @@ TAG_ENCRYPTOR_SESSION_ID = 'BrktEncryptorSessionID'
 TAG_ENCRYPTOR_AMI = 'BrktEncryptorAMI'
 TAG_DESCRIPTION = 'Description'
 
+# Lineage tags on encrypted AMIs.  TAG_SOURCE_AMI is the unencrypted AMI
+# that the image is ultimately based on.  TAG_SOURCE_SNAPSHOT is the
+# snapshot of its root volume that was encrypted, and is only set when the
+# snapshot is kept in the snapshot cache.  TAG_PARENT_AMI is the
+# encrypted AMI that an updated image was created from.
+TAG_SOURCE_AMI = 'BrktSourceAMI'
+TAG_SOURCE_SNAPSHOT = 'BrktSourceSnapshot'
+TAG_PARENT_AMI = 'BrktParentAMI'
+
 NAME_ENCRYPTED_IMAGE = '%(original_image_name)s %(encrypted_suffix)s'
 NAME_ENCRYPTED_IMAGE_SUFFIX = ' (encrypted %(nonce)s)'
 SUFFIX_ENCRYPTED_IMAGE = (
@@ -121,6 +131,27 @@ DEFAULT_DESCRIPTION_ENCRYPTED_IMAGE = \
 
 AMI_NAME_MAX_LENGTH = 128
 
+# Phases of an encryption session, recorded in the session journal.
+PHASE_STARTED = 'started'
+PHASE_GUEST_INSTANCE = 'guest_instance'
+PHASE_GUEST_SNAPSHOT = 'guest_snapshot'
+PHASE_ENCRYPTOR_INSTANCE = 'encryptor_instance'
+PHASE_ENCRYPTED = 'encrypted'
+
+# Volume types for the encrypted root volume that the encryptor writes.
+ENCRYPTED_VOLUME_TYPES = ['gp2', 'io1', 'st1']
+DEFAULT_ENCRYPTED_VOLUME_TYPE = 'gp2'
+
+# EBS limits for the encrypted root volume.
+MIN_IO1_IOPS = 100
+MAX_IO1_IOPS = 20000
+MAX_IO1_IOPS_PER_GB = 50
+MIN_ST1_SIZE_GB = 125
+
+# Network interfaces of terminated instances can take a while to be
+# released.  Until then, deleting their security group fails.
+SECURITY_GROUP_DELETE_TIMEOUT = 120
+
 log = logging.getLogger(__name__)
 
 
@@ -158,7 +189,8 @@ def _get_snapshot_progress_text(snapshots):
 def wait_for_instance(
         aws_svc, instance_id, timeout=600, state='running'):
     """ Wait for up to timeout seconds for an instance to be in the
-    given state.  Sleep for 2 seconds between checks.
+    given state.  Poll with exponential backoff, as described by
+    aws_service.INSTANCE_WAIT_POLICY.
 
     :return: The Instance object
     :raises InstanceError if a timeout occurs or the instance unexpectedly
@@ -169,9 +201,16 @@ def wait_for_instance(
         'Waiting for %s, timeout=%d, state=%s',
         instance_id, timeout, state)
 
-    deadline = Deadline(timeout)
-    while not deadline.is_expired():
-        instance = aws_svc.get_instance(instance_id)
+    def _check():
+        try:
+            instance = aws_svc.poller.get_instance(instance_id)
+        except EC2ResponseError, e:
+            # If we launch and get immediately, AWS may return 400 until
+            # the instance has propagated.
+            if e.error_code == 'InvalidInstanceID.NotFound':
+                log.debug('AWS threw a NotFound, ignoring')
+                return None
+            raise
         log.debug('Instance %s state=%s', instance.id, instance.state)
         if instance.state == state:
             return instance
@@ -184,10 +223,17 @@ def wait_for_instance(
             raise InstanceError(
                 'Instance %s was unexpectedly terminated.' % instance_id
             )
-        sleep(2)
-    raise InstanceError(
-        'Timed out waiting for %s to be in the %s state' %
-        (instance_id, state)
+        return None
+
+    return util.wait_until(
+        _check,
+        aws_service.INSTANCE_WAIT_POLICY,
+        timeout=timeout,
+        timeout_error=lambda: InstanceError(
+            'Timed out waiting for %s to be in the %s state' %
+            (instance_id, state)
+        ),
+        description='%s to be %s' % (instance_id, state)
     )
 
 
@@ -232,43 +278,72 @@ def get_description_from_image(image):
     return description
 
 
-def wait_for_image(aws_svc, image_id):
+def wait_for_image(aws_svc, image_id, timeout=None):
+    """ Wait for the image to become available.  Poll with exponential
+    backoff, as described by aws_service.IMAGE_WAIT_POLICY.
+
+    :return the Image object
+    :raise BracketError if the image state becomes failed or the timeout
+        expires
+    """
     log.debug('Waiting for %s to become available.', image_id)
-    for i in range(180):
-        sleep(5)
+    last_state = []
+
+    def _check():
         try:
             image = aws_svc.get_image(image_id)
         except EC2ResponseError, e:
             if e.error_code == 'InvalidAMIID.NotFound':
                 log.debug('AWS threw a NotFound, ignoring')
-                continue
             else:
                 log.warn('Unknown AWS error: %s', e)
+            return None
         # These two attributes are optional in the response and only
         # show up sometimes. So we have to getattr them.
         reason = repr(getattr(image, 'stateReason', None))
         code = repr(getattr(image, 'code', None))
         log.debug("%s: %s reason: %s code: %s",
                   image.id, image.state, reason, code)
+        last_state[:] = [image.state]
         if image.state == 'available':
-            break
+            return image
         if image.state == 'failed':
             raise BracketError('Image state became failed')
-    else:
-        raise BracketError(
-            'Image failed to become available (%s)' % (image.state,))
+        return None
+
+    return util.wait_until(
+        _check,
+        aws_service.IMAGE_WAIT_POLICY,
+        timeout=timeout,
+        timeout_error=lambda: BracketError(
+            'Image failed to become available (%s)' %
+            (last_state[0] if last_state else 'unknown',)
+        ),
+        description='%s to become available' % image_id
+    )
 
 
-def wait_for_snapshots(aws_svc, *snapshot_ids):
-    log.debug('Waiting for status "completed" for %s', str(snapshot_ids))
-    last_progress_log = time.time()
+def wait_for_snapshots(aws_svc, *snapshot_ids, **kwargs):
+    """ Wait for the given snapshots to be completed.  Poll with
+    exponential backoff, as described by aws_service.SNAPSHOT_WAIT_POLICY.
 
-    # Give AWS some time to propagate the snapshot creation.
-    # If we create and get immediately, AWS may return 400.
-    sleep(20)
+    :param timeout keyword argument that overrides the policy timeout
+    :raise SnapshotError if a snapshot goes into the error state
+    """
+    timeout = kwargs.get('timeout')
+    log.debug('Waiting for status "completed" for %s', str(snapshot_ids))
+    progress_log = {'time': time.time()}
 
-    while True:
-        snapshots = aws_svc.get_snapshots(*snapshot_ids)
+    def _check():
+        try:
+            snapshots = aws_svc.poller.get_snapshots(*snapshot_ids)
+        except EC2ResponseError, e:
+            # If we create and get immediately, AWS may return 400 until
+            # the snapshot creation has propagated.
+            if e.error_code == 'InvalidSnapshot.NotFound':
+                log.debug('AWS threw a NotFound, ignoring')
+                return None
+            raise
         log.debug('%s', {s.id: s.status for s in snapshots})
 
         done = True
@@ -287,15 +362,23 @@ def wait_for_snapshots(aws_svc, *snapshot_ids):
                 str(error_ids)
             )
         if done:
-            return
+            return snapshots
 
         # Log progress if necessary.
         now = time.time()
-        if now - last_progress_log > 60:
+        if now - progress_log['time'] > 60:
             log.info(_get_snapshot_progress_text(snapshots))
-            last_progress_log = now
-
-        sleep(5)
+            progress_log['time'] = now
+        return None
+
+    util.wait_until(
+        _check,
+        aws_service.SNAPSHOT_WAIT_POLICY,
+        timeout=timeout,
+        timeout_error=lambda: SnapshotError(
+            'Timed out waiting for %s to complete' % str(snapshot_ids)),
+        description='snapshots %s' % str(snapshot_ids)
+    )
 
 
 def create_encryptor_security_group(aws_svc, vpc_id=None, status_port=\
@@ -323,16 +406,196 @@ def create_encryptor_security_group(aws_svc, vpc_id=None, status_port=\
     return sg
 
 
+def _prepare_encryptor_launch(
+        aws_svc, instance_config=None, security_group_ids=None,
+        subnet_id=None,
+        status_port=encryptor_service.ENCRYPTOR_STATUS_PORT):
+    """ Do the work that's needed to launch the encryptor instance but
+    doesn't depend on the guest root snapshot: generate the user data, and
+    create a temporary security group if security groups were not
+    specified.  The temporary security group allows us to poll the
+    metavisor for encryption progress.
+
+    :return a tuple of (compressed user data, security group ids,
+        temporary security group id or None)
+    """
+    if instance_config is None:
+        instance_config = InstanceConfig()
+
+    temp_sg_id = None
+    if not security_group_ids:
+        vpc_id = None
+        if subnet_id:
+            subnet = aws_svc.get_subnet(subnet_id)
+            vpc_id = subnet.vpc_id
+        temp_sg_id = create_encryptor_security_group(
+            aws_svc, vpc_id=vpc_id, status_port=status_port).id
+        security_group_ids = [temp_sg_id]
+
+    try:
+        user_data = instance_config.make_userdata()
+        compressed_user_data = gzip_user_data(user_data)
+    except:
+        if temp_sg_id:
+            clean_up(aws_svc, security_group_ids=[temp_sg_id])
+        raise
+
+    return compressed_user_data, security_group_ids, temp_sg_id
+
+
+def get_encrypted_volume_type(volume_type, iops, size):
+    """ Check the volume type and provisioned IOPS of the encrypted root
+    volume against the EBS limits for a volume of the given size.
+
+    :return a tuple of (volume type, iops) that can be used for the volume
+    """
+    if volume_type == 'st1' and size < MIN_ST1_SIZE_GB:
+        log.warn(
+            'Using gp2 for the %d GB encrypted root volume, because st1 '
+            'volumes must be at least %d GB', size, MIN_ST1_SIZE_GB)
+        return 'gp2', None
+    if volume_type != 'io1':
+        return volume_type, None
+    max_iops = min(MAX_IO1_IOPS, size * MAX_IO1_IOPS_PER_GB)
+    if iops is None:
+        return volume_type, max_iops
+    if iops > max_iops:
+        log.warn(
+            'Provisioning %d IOPS for the %d GB encrypted root volume, '
+            'which is the maximum for its size', max_iops, size)
+        iops = max_iops
+    elif iops < MIN_IO1_IOPS:
+        log.warn(
+            'Provisioning %d IOPS for the encrypted root volume, which is '
+            'the minimum for io1 volumes', MIN_IO1_IOPS)
+        iops = MIN_IO1_IOPS
+    return volume_type, iops
+
+
+def _enable_fast_snapshot_restore(aws_svc, snapshot_id, zone):
+    """ Enable fast snapshot restore for the guest root snapshot.
+
+    A volume that is created from a snapshot loads each block from S3
+    the first time that it's read.  The encryptor reads the whole guest
+    root volume once, so the first read of every block is slow.  A volume
+    that is created from a snapshot with fast snapshot restore enabled
+    delivers full performance right away.
+
+    If fast snapshot restore isn't available, log a warning and continue,
+    so that the encryptor reads the volume as it's loaded from S3.
+
+    :return True if fast snapshot restore was enabled by this call, and
+        must be disabled once the volume has been created
+    """
+    try:
+        state = aws_svc.get_fast_snapshot_restore_state(snapshot_id, zone)
+        if state not in (None, aws_service.FSR_DISABLED):
+            # Enabled by someone else.  Leave it alone.
+            return False
+        state = aws_svc.enable_fast_snapshot_restore(snapshot_id, zone)
+    except EC2ResponseError as e:
+        log.warn(
+            'Unable to use fast snapshot restore for %s: %s',
+            snapshot_id, e.error_message or e.error_code)
+        return False
+
+    if not state:
+        log.warn(
+            'Unable to enable fast snapshot restore for %s in %s.  '
+            'The guest root volume will be loaded from S3 while it is '
+            'encrypted.', snapshot_id, zone)
+        return False
+    log.info(
+        'Enabled fast snapshot restore for %s in %s', snapshot_id, zone)
+    return True
+
+
+def _wait_for_fast_snapshot_restore(aws_svc, snapshot_id, zone,
+                                    timeout=None):
+    """ Wait for fast snapshot restore to take effect, as described by
+    aws_service.FAST_SNAPSHOT_RESTORE_WAIT_POLICY.  If it doesn't, log a
+    warning, so that the encryptor is launched without it.
+
+    :return True if fast snapshot restore is enabled
+    """
+    def _check():
+        state = aws_svc.get_fast_snapshot_restore_state(snapshot_id, zone)
+        log.debug('Fast snapshot restore state: %s', state)
+        if state == aws_service.FSR_ENABLED:
+            return True
+        if state in (None, aws_service.FSR_DISABLING,
+                     aws_service.FSR_DISABLED):
+            return False
+        return None
+
+    try:
+        enabled = util.wait_until(
+            _check,
+            aws_service.FAST_SNAPSHOT_RESTORE_WAIT_POLICY,
+            timeout=timeout,
+            description='fast snapshot restore for %s in %s' % (
+                snapshot_id, zone)
+        )
+    except util.CancelledError:
+        raise
+    except (BracketError, EC2ResponseError) as e:
+        log.warn(
+            'Fast snapshot restore for %s is not ready: %s.  Launching the '
+            'encryptor without it.', snapshot_id, e)
+        return False
+    if not enabled:
+        log.warn(
+            'Fast snapshot restore for %s was disabled.  Launching the '
+            'encryptor without it.', snapshot_id)
+    return enabled
+
+
+def _disable_fast_snapshot_restore(aws_svc, snapshot_id, zone):
+    """ Fast snapshot restore is billed by the hour, and only matters
+    when the volume is created, so disable it as soon as the encryptor
+    is running.
+    """
+    try:
+        aws_svc.disable_fast_snapshot_restore(snapshot_id, zone)
+    except Exception:
+        log.debug('', exc_info=1)
+        log.warn(
+            'Unable to disable fast snapshot restore for %s in %s.  Disable '
+            'it with `aws ec2 disable-fast-snapshot-restores '
+            '--source-snapshot-ids %s --availability-zones %s`.',
+            snapshot_id, zone, snapshot_id, zone)
+
+
 def _run_encryptor_instance(
         aws_svc, encryptor_image_id, snapshot, root_size, guest_image_id,
         security_group_ids=None, subnet_id=None, zone=None,
         instance_config=None,
-        status_port=encryptor_service.ENCRYPTOR_STATUS_PORT):
+        status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
+        launch_data=None,
+        encrypted_volume_type=DEFAULT_ENCRYPTED_VOLUME_TYPE,
+        encrypted_volume_iops=None,
+        fast_snapshot_restore=False):
+    """ Launch the encryptor instance with the guest root snapshot
+    attached.
+
+    Every encryption session needs its own encryptor instance.  The
+    encryptor encrypts the volume at /dev/sdf once, based on the user
+    data that it boots with, and its root volume becomes the Metavisor
+    root volume of the encrypted AMI.
+
+    :param launch_data the value returned by _prepare_encryptor_launch().
+        If specified, the caller owns the temporary security group and
+        is responsible for deleting it.
+    :param encrypted_volume_type the EBS volume type of the volume at
+        /dev/sdg, which the encryptor writes the encrypted root to
+    :param encrypted_volume_iops provisioned IOPS for an io1 volume
+    :param fast_snapshot_restore if True, enable fast snapshot restore for
+        the guest root snapshot before launching the encryptor, so that
+        the encryptor doesn't wait for blocks to be loaded from S3
+    :return a tuple of (encryptor instance, temporary security group id)
+    """
     bdm = BlockDeviceMapping()
 
-    if instance_config is None:
-        instance_config = InstanceConfig()
-
     # Use gp2 for fast burst I/O copying root drive
     guest_unencrypted_root = EBSBlockDeviceType(
         volume_type='gp2',
@@ -341,11 +604,14 @@ def _run_encryptor_instance(
     # Use gp2 for fast burst I/O copying root drive
     log.info('Launching encryptor instance with snapshot %s', snapshot)
     # They are creating an encrypted AMI instead of updating it
-    # Use gp2 for fast burst I/O copying root drive
+    encrypted_size = 2 * root_size + 1
+    volume_type, iops = get_encrypted_volume_type(
+        encrypted_volume_type, encrypted_volume_iops, encrypted_size)
     guest_encrypted_root = EBSBlockDeviceType(
-        volume_type='gp2',
+        volume_type=volume_type,
+        iops=iops,
         delete_on_termination=True)
-    guest_encrypted_root.size = 2 * root_size + 1
+    guest_encrypted_root.size = encrypted_size
 
     # Use 'sd' names even though AWS maps these to 'xvd'
     # The AWS GUI only exposes 'sd' names, and won't allow
@@ -354,23 +620,34 @@ def _run_encryptor_instance(
     bdm['/dev/sdf'] = guest_unencrypted_root
     bdm['/dev/sdg'] = guest_encrypted_root
 
-    # If security groups were not specified, create a temporary security
-    # group that allows us to poll the metavisor for encryption progress.
-    temp_sg_id = None
+    owns_temp_sg = launch_data is None
+    if launch_data is None:
+        launch_data = _prepare_encryptor_launch(
+            aws_svc,
+            instance_config=instance_config,
+            security_group_ids=security_group_ids,
+            subnet_id=subnet_id,
+            status_port=status_port
+        )
+    compressed_user_data, security_group_ids, temp_sg_id = launch_data
     instance = None
+    disable_fsr = False
 
     try:
-        run_instance = aws_svc.run_instance
-
-        if not security_group_ids:
-            vpc_id = None
-            if subnet_id:
-                subnet = aws_svc.get_subnet(subnet_id)
-                vpc_id = subnet.vpc_id
-            temp_sg_id = create_encryptor_security_group(
-                aws_svc, vpc_id=vpc_id, status_port=status_port).id
-            security_group_ids = [temp_sg_id]
+        if fast_snapshot_restore and not zone and subnet_id:
+            zone = aws_svc.get_subnet(subnet_id).availability_zone
+        if fast_snapshot_restore and zone:
+            disable_fsr = _enable_fast_snapshot_restore(
+                aws_svc, snapshot, zone)
+            _wait_for_fast_snapshot_restore(aws_svc, snapshot, zone)
+        elif fast_snapshot_restore:
+            log.warn(
+                'Not using fast snapshot restore, because the availability '
+                'zone of the encryptor instance is not known.  Specify '
+                '--subnet to use fast snapshot restore.')
 
+        run_instance = aws_svc.run_instance
+        if temp_sg_id:
             # Wrap with a retry, to handle eventual consistency issues with
             # the newly-created group.
             run_instance = aws_svc.retry(
@@ -378,9 +655,6 @@ def _run_encryptor_instance(
                 error_code_regexp='InvalidGroup\.NotFound'
             )
 
-        user_data = instance_config.make_userdata()
-        compressed_user_data = gzip_user_data(user_data)
-
         instance = run_instance(
             encryptor_image_id,
             security_group_ids=security_group_ids,
@@ -408,7 +682,7 @@ def _run_encryptor_instance(
         cleanup_sg_ids = []
         if instance:
             cleanup_instance_ids = [instance.id]
-        if temp_sg_id:
+        if temp_sg_id and owns_temp_sg:
             cleanup_sg_ids = [temp_sg_id]
         clean_up(
             aws_svc,
@@ -416,6 +690,9 @@ def _run_encryptor_instance(
             security_group_ids=cleanup_sg_ids
         )
         raise
+    finally:
+        if disable_fsr:
+            _disable_fast_snapshot_restore(aws_svc, snapshot, zone)
 
     return instance, temp_sg_id
 
@@ -444,9 +721,11 @@ def run_guest_instance(aws_svc, image_id, subnet_id=None,
     return instance
 
 
-def _snapshot_root_volume(aws_svc, instance, image_id):
+def _snapshot_root_volume(aws_svc, instance, image_id, snapshot=True):
     """ Snapshot the root volume of the given AMI.
 
+    :param snapshot if False, only detach and delete the root volume.  The
+        returned snapshot id is None.
     :except SnapshotError if the snapshot goes into an error state
     """
     log.info(
@@ -469,18 +748,21 @@ def _snapshot_root_volume(aws_svc, instance, image_id):
         name=NAME_ORIGINAL_VOLUME % {'image_id': image_id}
     )
 
-    snapshot = aws_svc.create_snapshot(
-        vol.id,
-        name=NAME_ORIGINAL_SNAPSHOT,
-        description=DESCRIPTION_ORIGINAL_SNAPSHOT % {'image_id': image_id}
-    )
-    log.info(
-        'Creating snapshot %s of root volume for instance %s',
-        snapshot.id, instance.id
-    )
+    snapshot_id = None
+    if snapshot:
+        snapshot_id = aws_svc.create_snapshot(
+            vol.id,
+            name=NAME_ORIGINAL_SNAPSHOT,
+            description=DESCRIPTION_ORIGINAL_SNAPSHOT % {'image_id': image_id}
+        ).id
+        log.info(
+            'Creating snapshot %s of root volume for instance %s',
+            snapshot_id, instance.id
+        )
 
     try:
-        wait_for_snapshots(aws_svc, snapshot.id)
+        if snapshot_id:
+            wait_for_snapshots(aws_svc, snapshot_id)
 
         # Now try to detach the root volume.
         log.info('Detaching root volume %s from %s',
@@ -495,7 +777,8 @@ def _snapshot_root_volume(aws_svc, instance, image_id):
         log.info('Deleting root volume %s', root_vol.volume_id)
         aws_svc.delete_volume(root_vol.volume_id)
     except:
-        clean_up(aws_svc, snapshot_ids=[snapshot.id])
+        if snapshot_id:
+            clean_up(aws_svc, snapshot_ids=[snapshot_id])
         raise
 
     iops = None
@@ -503,7 +786,7 @@ def _snapshot_root_volume(aws_svc, instance, image_id):
         iops = vol.iops
 
     ret_values = (
-        snapshot.id, root_dev, vol.size, vol.type, iops)
+        snapshot_id, root_dev, vol.size, vol.type, iops)
     log.debug('Returning %s', str(ret_values))
     return ret_values
 
@@ -533,72 +816,115 @@ def terminate_instance(aws_svc, id, name, terminated_instance_ids):
         log.warn('Could not terminate %s instance: %s', name, e)
 
 
+def _wait_for_terminated(aws_svc, instance_id):
+    log.info('Waiting for instance %s to terminate.', instance_id)
+    wait_for_instance(aws_svc, instance_id, state='terminated')
+
+
+def _delete_snapshot(aws_svc, snapshot_id):
+    log.info('Deleting snapshot %s', snapshot_id)
+    aws_svc.delete_snapshot(snapshot_id)
+
+
+def _delete_volume(aws_svc, volume_id, instance_futures):
+    """ Delete the volume.  If it's attached to an instance that is being
+    terminated, wait for the instance to terminate first.
+    """
+    try:
+        volume = aws_svc.poller.get_volume(volume_id)
+    except EC2ResponseError as e:
+        if e.error_code == 'InvalidVolume.NotFound':
+            log.debug('Volume %s was already deleted', volume_id)
+            return
+        raise
+    attach_data = getattr(volume, 'attach_data', None)
+    instance_id = attach_data and attach_data.instance_id
+    if instance_id in instance_futures:
+        instance_futures[instance_id].wait()
+    log.info('Deleting volume %s', volume_id)
+    aws_svc.delete_volume(volume_id)
+
+
+def _delete_security_group(aws_svc, sg_id, instance_futures):
+    """ Delete the security group after the instances that may be using it
+    have terminated.  The network interfaces of a terminated instance are
+    released asynchronously, so retry on dependency errors.
+    """
+    for future in instance_futures.values():
+        future.wait()
+    log.info('Deleting security group %s', sg_id)
+    delete_security_group = aws_svc.retry(
+        aws_svc.delete_security_group,
+        r'InvalidGroup\.InUse|DependencyViolation',
+        timeout=SECURITY_GROUP_DELETE_TIMEOUT
+    )
+    delete_security_group(sg_id)
+
+
 def clean_up(aws_svc, instance_ids=None, volume_ids=None,
               snapshot_ids=None, security_group_ids=None):
     """ Clean up any resources that were created by the encryption process.
     Handle and log exceptions, to ensure that the script doesn't exit during
     cleanup.
+
+    All instances are terminated with one API call.  Snapshots are deleted
+    right away.  A volume is deleted once the instance it's attached to has
+    terminated, and a security group once all instances have terminated.
+    These steps run concurrently.
+
+    :return a dictionary that maps each resource id to None if it was
+        cleaned up successfully, or to the exception that was raised
     """
     instance_ids = instance_ids or []
     volume_ids = volume_ids or []
     snapshot_ids = snapshot_ids or []
     security_group_ids = security_group_ids or []
+    outcomes = {}
 
-    # Delete instances and snapshots.
-    terminated_instance_ids = set()
-    for instance_id in instance_ids:
+    terminated_instance_ids = []
+    if instance_ids:
         try:
-            log.info('Terminating instance %s', instance_id)
-            aws_svc.terminate_instance(instance_id)
-            terminated_instance_ids.add(instance_id)
-        except EC2ResponseError as e:
-            log.warn('Unable to terminate instance %s: %s', instance_id, e)
-        except:
-            log.exception('Unable to terminate instance %s', instance_id)
-
+            log.info('Terminating instances %s', ', '.join(instance_ids))
+            aws_svc.terminate_instances(*instance_ids)
+            terminated_instance_ids = list(instance_ids)
+        except Exception as e:
+            # One bad id fails the whole call.  Terminate the instances
+            # one at a time, so that we know which one failed.
+            log.debug('Unable to terminate %s: %s', instance_ids, e)
+            for instance_id in instance_ids:
+                try:
+                    aws_svc.terminate_instance(instance_id)
+                    terminated_instance_ids.append(instance_id)
+                except Exception as e:
+                    outcomes[instance_id] = e
+
+    instance_futures = dict(
+        (id, util.run_async(_wait_for_terminated, aws_svc, id))
+        for id in terminated_instance_ids
+    )
+    futures = dict(instance_futures)
     for snapshot_id in snapshot_ids:
-        try:
-            log.info('Deleting snapshot %s', snapshot_id)
-            aws_svc.delete_snapshot(snapshot_id)
-        except EC2ResponseError as e:
-            log.warn('Unable to delete snapshot %s: %s', snapshot_id, e)
-        except:
-            log.exception('Unable to delete snapshot %s', snapshot_id)
-
-    # Wait for instances to terminate before deleting security groups and
-    # volumes, to avoid dependency errors.
-    for id in terminated_instance_ids:
-        log.info('Waiting for instance %s to terminate.', id)
-        try:
-            wait_for_instance(aws_svc, id, state='terminated')
-        except (EC2ResponseError, InstanceError) as e:
-            log.warn(
-                'An error occurred while waiting for instance to '
-                'terminate: %s', e)
-        except:
-            log.exception(
-                'An error occurred while waiting for instance '
-                'to terminate'
-            )
-
-    # Delete volumes and security groups.
+        futures[snapshot_id] = util.run_async(
+            _delete_snapshot, aws_svc, snapshot_id)
     for volume_id in volume_ids:
-        try:
-            log.info('Deleting volume %s', volume_id)
-            aws_svc.delete_volume(volume_id)
-        except EC2ResponseError as e:
-            log.warn('Unable to delete volume %s: %s', volume_id, e)
-        except:
-            log.exception('Unable to delete volume %s', volume_id)
-
+        futures[volume_id] = util.run_async(
+            _delete_volume, aws_svc, volume_id, instance_futures)
     for sg_id in security_group_ids:
-        try:
-            log.info('Deleting security group %s', sg_id)
-            aws_svc.delete_security_group(sg_id)
-        except EC2ResponseError as e:
-            log.warn('Unable to delete security group %s: %s', sg_id, e)
-        except:
-            log.exception('Unable to delete security group %s', sg_id)
+        futures[sg_id] = util.run_async(
+            _delete_security_group, aws_svc, sg_id, instance_futures)
+
+    for resource_id, future in futures.iteritems():
+        outcomes[resource_id] = future.exception()
+
+    for resource_id, e in sorted(outcomes.iteritems()):
+        if e is None:
+            continue
+        if isinstance(e, (EC2ResponseError, InstanceError)):
+            log.warn('Unable to clean up %s: %s', resource_id, e)
+        else:
+            log.error(
+                'Unable to clean up %s: %s', resource_id, e, exc_info=1)
+    return outcomes
 
 
 def log_exception_console(aws_svc, e, id):
@@ -659,11 +985,13 @@ def snapshot_log_volume(aws_svc, instance_id):
     return snapshot
 
 
-def snapshot_encrypted_instance(aws_svc, enc_svc_cls, encryptor_instance,
-                       encryptor_image, image_id=None, vol_type='', iops=None,
-                       legacy=False, save_encryptor_logs=True,
-                       status_port=encryptor_service.ENCRYPTOR_STATUS_PORT):
-    # First wait for encryption to complete
+def _wait_for_encryption(aws_svc, enc_svc_cls, encryptor_instance,
+                         save_encryptor_logs=True,
+                         status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
+                         encryptor_monitor=None):
+    """ Wait for the encryptor to finish encrypting the guest root volume.
+    On failure, save the console output and encryptor logs.
+    """
     host_ips = []
     if encryptor_instance.ip_address:
         host_ips.append(encryptor_instance.ip_address)
@@ -683,7 +1011,12 @@ def snapshot_encrypted_instance(aws_svc, enc_svc_cls, encryptor_instance,
              encryptor_instance.id, enc_svc.port, ', '.join(host_ips))
         encryptor_service.wait_for_encryptor_up(enc_svc, Deadline(600))
         log.info('Creating encrypted root drive.')
-        encryptor_service.wait_for_encryption(enc_svc)
+        encryptor_service.wait_for_encryption(
+            enc_svc, monitor=encryptor_monitor)
+    except util.CancelledError:
+        # The caller stopped the session.  This isn't an encryption
+        # failure, so there are no logs to save.
+        raise
     except (BracketError, encryptor_service.EncryptionError) as e:
         # Stop the encryptor instance, to make the console log available.
         stop_and_wait(aws_svc, encryptor_instance.id)
@@ -700,6 +1033,40 @@ def snapshot_encrypted_instance(aws_svc, enc_svc_cls, encryptor_instance,
                       'region': aws_svc.region})
         raise
 
+
+def _detach_mv_root(aws_svc, encryptor_instance_id, mv_root_id):
+    log.info("Detaching new guest root %s" % (mv_root_id,))
+    aws_svc.detach_volume(
+        mv_root_id,
+        instance_id=encryptor_instance_id,
+        force=True
+    )
+    aws_service.wait_for_volume(aws_svc, mv_root_id)
+    aws_svc.create_tags(
+        mv_root_id, name=NAME_METAVISOR_ROOT_VOLUME)
+
+
+def snapshot_encrypted_instance(aws_svc, enc_svc_cls, encryptor_instance,
+                       encryptor_image, image_id=None, vol_type='', iops=None,
+                       legacy=False, save_encryptor_logs=True,
+                       status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
+                       journal=None, encryptor_monitor=None):
+    # First wait for encryption to complete, unless a resumed session
+    # already got that far.
+    if journal and journal.completed(PHASE_ENCRYPTED):
+        log.info(
+            'Encryption already completed on %s', encryptor_instance.id)
+    else:
+        with trace.span('wait_for_encryption'):
+            _wait_for_encryption(
+                aws_svc, enc_svc_cls, encryptor_instance,
+                save_encryptor_logs=save_encryptor_logs,
+                status_port=status_port,
+                encryptor_monitor=encryptor_monitor
+            )
+        if journal:
+            journal.record(PHASE_ENCRYPTED)
+
     log.info('Encrypted root drive is ready.')
     # The encryptor instance may modify its volume attachments while running,
     # so we update the encryptor instance's local attributes before reading
@@ -720,37 +1087,71 @@ def snapshot_encrypted_instance(aws_svc, enc_svc_cls, encryptor_instance,
     if not vol_type or vol_type == '':
         vol_type = 'gp2'
 
+    # A resumed session may have already detached the Metavisor root
+    # volume and started the snapshot of the encrypted root volume.
+    mv_root_id = None
+    snapshot_id = None
+    mv_root_detached = False
+    if journal:
+        mv_root_id = journal.get('mv_root_id')
+        snapshot_id = journal.get('encrypted_snapshot_id')
+        mv_root_detached = journal.get('mv_root_detached', False)
+    if not mv_root_id:
+        mv_root_id = encryptor_bdm['/dev/sda1'].volume_id
+        if journal:
+            journal.save(mv_root_id=mv_root_id)
+
+    # Detach the Metavisor root volume while the encrypted root volume is
+    # being snapshotted.  The two volumes are independent.
+    detach_future = None
+    if not legacy and not mv_root_detached:
+        detach_future = util.run_async(
+            _detach_mv_root, aws_svc, encryptor_instance.id, mv_root_id)
+
     # Snapshot volumes.
-    snap_guest = aws_svc.create_snapshot(
-        encryptor_bdm['/dev/sdg'].volume_id,
-        name=NAME_ENCRYPTED_ROOT_SNAPSHOT,
-        description=description
-    )
-    log.info(
-        'Creating snapshots for the new encrypted AMI: %s' % (
-                snap_guest.id)
-    )
-    wait_for_snapshots(aws_svc, snap_guest.id)
+    try:
+        try:
+            with trace.span('snapshot_encrypted_root'):
+                if snapshot_id:
+                    log.info(
+                        'Using snapshot %s of the encrypted root volume',
+                        snapshot_id)
+                else:
+                    snapshot_id = aws_svc.create_snapshot(
+                        encryptor_bdm['/dev/sdg'].volume_id,
+                        name=NAME_ENCRYPTED_ROOT_SNAPSHOT,
+                        description=description
+                    ).id
+                    if journal:
+                        journal.save(encrypted_snapshot_id=snapshot_id)
+                    log.info(
+                        'Creating snapshots for the new encrypted AMI: %s' % (
+                                snapshot_id)
+                    )
+                wait_for_snapshots(aws_svc, snapshot_id)
+        finally:
+            # Don't leave the detach running in the background if the
+            # snapshot failed.
+            if detach_future:
+                detach_future.wait()
+        if detach_future:
+            detach_future.result()
+            if journal:
+                journal.save(mv_root_detached=True)
+    except:
+        # A resumed session reuses the snapshot.
+        if snapshot_id and not keep_resources(journal, sys.exc_info()[1]):
+            clean_up(aws_svc, snapshot_ids=[snapshot_id])
+        raise
+
     dev_guest_root = EBSBlockDeviceType(
         volume_type=vol_type,
-        snapshot_id=snap_guest.id,
+        snapshot_id=snapshot_id,
         iops=iops,
         delete_on_termination=True
     )
-    mv_root_id = encryptor_bdm['/dev/sda1'].volume_id
     new_bdm['/dev/sdf'] = dev_guest_root
 
-    if not legacy:
-        log.info("Detaching new guest root %s" % (mv_root_id,))
-        aws_svc.detach_volume(
-            mv_root_id,
-            instance_id=encryptor_instance.id,
-            force=True
-        )
-        aws_service.wait_for_volume(aws_svc, mv_root_id)
-        aws_svc.create_tags(
-            mv_root_id, name=NAME_METAVISOR_ROOT_VOLUME)
-
     if image_id:
         log.debug('Getting image %s', image_id)
         guest_image = aws_svc.get_image(image_id)
@@ -781,35 +1182,49 @@ def wait_for_volume_attached(aws_svc, instance_id, device):
         instance_id
     )
 
-    found = False
-    instance = None
-
-    for _ in xrange(20):
-        instance = aws_svc.get_instance(instance_id)
+    def _check():
+        instance = aws_svc.poller.get_instance(instance_id)
         bdm = instance.block_device_mapping
         log.debug('Found devices: %s', bdm.keys())
         if device in bdm:
-            found = True
-            break
-        else:
-            sleep(5)
+            return instance
+        return None
 
-    if not found:
-        raise BracketError(
+    return util.wait_until(
+        _check,
+        aws_service.VOLUME_ATTACH_WAIT_POLICY,
+        timeout_error=lambda: BracketError(
             'Timed out waiting for %s to attach to %s' %
             (device, instance_id)
-        )
-
-    return instance
+        ),
+        description='%s to attach to %s' % (device, instance_id)
+    )
 
 
 def register_ami(aws_svc, encryptor_instance, encryptor_image, name,
                  description, mv_bdm=None, legacy=False, guest_instance=None,
-                 mv_root_id=None):
+                 mv_root_id=None, tags=None, wait=True, journal=None):
+    """ Create the encrypted AMI.
+
+    :param tags additional tags for the AMI, such as lineage tags
+    :param journal if specified, record the root volume attachment and
+        the AMI id, and skip the steps that already finished when
+        resuming an interrupted session
+    :param wait if False, return as soon as the AMI is registered.  The
+        rest of the work runs in the background.
+    :return a dictionary with the AMI id, root snapshot name and volume
+        details, or a util.Future that holds the dictionary if wait is
+        False
+    """
     if not mv_bdm:
         mv_bdm = BlockDeviceMapping()
-    # Register the new AMI.
-    if legacy:
+    ami = None
+    if journal:
+        ami = journal.get('ami_id')
+    if ami:
+        log.info('AMI %s was registered before the session was interrupted',
+                 ami)
+    elif legacy:
         # The encryptor instance may modify its volume attachments while
         # running, so we update the encryptor instance's local attributes
         # before reading them.
@@ -832,33 +1247,42 @@ def register_ami(aws_svc, encryptor_instance, encryptor_image, name,
         guest_id = guest_instance.id
         root_device_name = guest_instance.root_device_name
         # Explicitly attach new mv root to guest instance
-        log.info('Attaching %s to %s', mv_root_id, guest_instance.id)
-        aws_svc.attach_volume(
-            mv_root_id,
-            guest_instance.id,
-            root_device_name,
-        )
+        if journal and journal.get('mv_root_attached'):
+            log.info('%s is already attached to %s',
+                     mv_root_id, guest_instance.id)
+        else:
+            log.info('Attaching %s to %s', mv_root_id, guest_instance.id)
+            aws_svc.attach_volume(
+                mv_root_id,
+                guest_instance.id,
+                root_device_name,
+            )
+            if journal:
+                journal.save(mv_root_attached=True)
         instance = wait_for_volume_attached(
             aws_svc, guest_instance.id, root_device_name)
         bdm = instance.block_device_mapping
         mv_bdm[root_device_name] = bdm[root_device_name]
         mv_bdm[root_device_name].delete_on_termination = True
 
-    # Legacy:
-    #   Create AMI from (stopped) MV instance
-    # Non-legacy:
-    #   Create AMI from original (stopped) guest instance. This
-    #   preserves any billing information found in
-    #   the identity document (i.e. billingProduct)
-    ami = aws_svc.create_image(
-        guest_id,
-        name,
-        description=description,
-        no_reboot=True,
-        block_device_mapping=mv_bdm
-    )
+    if not ami:
+        # Legacy:
+        #   Create AMI from (stopped) MV instance
+        # Non-legacy:
+        #   Create AMI from original (stopped) guest instance. This
+        #   preserves any billing information found in
+        #   the identity document (i.e. billingProduct)
+        ami = aws_svc.create_image(
+            guest_id,
+            name,
+            description=description,
+            no_reboot=True,
+            block_device_mapping=mv_bdm
+        )
+        if journal:
+            journal.save(ami_id=ami)
 
-    if not legacy:
+    if not legacy and not (journal and journal.get('mv_root_deleted')):
         log.info("Deleting volume %s" % (mv_root_id,))
         aws_svc.detach_volume(
             mv_root_id,
@@ -867,32 +1291,69 @@ def register_ami(aws_svc, encryptor_instance, encryptor_image, name,
         )
         aws_service.wait_for_volume(aws_svc, mv_root_id)
         aws_svc.delete_volume(mv_root_id)
+        if journal:
+            journal.save(mv_root_deleted=True)
 
     log.info('Registered AMI %s based on the snapshots.', ami)
-    wait_for_image(aws_svc, ami)
-    image = aws_svc.get_image(ami, retry=True)
+    if not wait:
+        return util.run_async(
+            _finish_registration, aws_svc, ami, description, tags=tags)
+    return _finish_registration(aws_svc, ami, description, tags=tags)
+
+
+def _finish_registration(aws_svc, ami, description, tags=None):
+    """ Wait for the AMI to become available, tag it and its root
+    snapshot, and collect the details of its volumes.  The snapshots are
+    described with a single call while the tags are being created.
+
+    :return the ami_info dictionary returned by register_ami()
+    """
+    image = wait_for_image(aws_svc, ami)
     name = NAME_METAVISOR_ROOT_SNAPSHOT
-    snap = image.block_device_mapping[image.root_device_name]
-    aws_svc.create_tags(
-        snap.snapshot_id,
-        name=name,
-        description=description
-    )
-    aws_svc.create_tags(ami)
+    root_snapshot_id = \
+        image.block_device_mapping[image.root_device_name].snapshot_id
+
+    def _tag():
+        aws_svc.create_tags(
+            root_snapshot_id,
+            name=name,
+            description=description
+        )
+        aws_svc.create_tags(ami, tags=tags)
+
+    tag_future = util.run_async(_tag)
+
+    # Several devices may share a snapshot.  Keep the device order of the
+    # image, and describe each snapshot once.
+    attach_points = [
+        (attach_point, bdt.snapshot_id)
+        for attach_point, bdt in image.block_device_mapping.iteritems()
+        if bdt.snapshot_id
+    ]
+    snapshots = {}
+    if attach_points:
+        snapshot_ids = set(snapshot_id for _, snapshot_id in attach_points)
+        for snapshot in aws_svc.get_snapshots(*snapshot_ids):
+            snapshots[snapshot.id] = snapshot
 
     ami_info = {}
     ami_info['volume_device_map'] = []
-    result_image = aws_svc.get_image(ami, retry=True)
-    for attach_point, bdt in result_image.block_device_mapping.iteritems():
-        if bdt.snapshot_id:
-            bdt_snapshot = aws_svc.get_snapshot(bdt.snapshot_id)
-            device_details = {
-                'attach_point': attach_point,
-                'description': bdt_snapshot.tags.get('Name', ''),
-                'size': bdt_snapshot.volume_size
-            }
-            ami_info['volume_device_map'].append(device_details)
+    for attach_point, snapshot_id in attach_points:
+        snapshot = snapshots[snapshot_id]
+        # The Name tag on the root snapshot may not be visible yet,
+        # because it's being created at the same time.
+        if snapshot.id == root_snapshot_id:
+            snapshot_name = name
+        else:
+            snapshot_name = snapshot.tags.get('Name', '')
+        device_details = {
+            'attach_point': attach_point,
+            'description': snapshot_name,
+            'size': snapshot.volume_size
+        }
+        ami_info['volume_device_map'].append(device_details)
 
+    tag_future.result()
     ami_info['ami'] = ami
     ami_info['name'] = name
     return ami_info
@@ -903,14 +1364,44 @@ def encrypt(aws_svc, enc_svc_cls, image_id, encryptor_ami,
             guest_instance_type='m3.medium', instance_config=None,
             save_encryptor_logs=True,
             status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
-            terminate_encryptor_on_failure=True):
-    log.info('Starting encryptor session %s', aws_svc.session_id)
+            terminate_encryptor_on_failure=True, journal=None,
+            snapshot_cache=None, encryptor_monitor=None,
+            encrypted_volume_type=DEFAULT_ENCRYPTED_VOLUME_TYPE,
+            encrypted_volume_iops=None, fast_snapshot_restore=False):
+    """ Encrypt the given guest AMI.
+
+    :param snapshot_cache a brkt_cli.aws.snapshot_cache.SnapshotCache.  If
+        specified, use a cached snapshot of the guest root volume when one
+        is available, and add new snapshots to the cache.
+    :param journal a brkt_cli.journal.Journal.  If specified, each phase is
+        recorded in the journal as it completes.  If the journal already
+        has completed phases, the session resumes after the last one.
+        brkt_cli.journal.keep_resources() decides whether an interrupted
+        session's resources are kept.
+    :param encryptor_monitor a brkt_cli.encryptor_monitor.EncryptorMonitor.
+        If specified, the monitor polls the encryptor's status, so that
+        concurrent sessions share the polling threads.
+    :param encrypted_volume_type the EBS volume type that the encryptor
+        writes the encrypted root volume to.  A faster volume speeds up
+        encryption of large root volumes.
+    :param encrypted_volume_iops provisioned IOPS, when
+        encrypted_volume_type is io1
+    :param fast_snapshot_restore if True, enable fast snapshot restore for
+        the guest root snapshot while the encryptor instance is launched
+    :return the id of the encrypted AMI
+    """
+    if journal and journal.completed(PHASE_GUEST_INSTANCE):
+        log.info('Resuming encryptor session %s', aws_svc.session_id)
+    else:
+        log.info('Starting encryptor session %s', aws_svc.session_id)
 
     encryptor_instance = None
     ami = None
     snapshot_id = None
+    snapshot_cached = False
     guest_instance = None
     temp_sg_id = None
+    launch_prep = None
     guest_image = aws_svc.get_image(image_id)
     mv_image = aws_svc.get_image(encryptor_ami)
 
@@ -935,107 +1426,275 @@ def encrypt(aws_svc, enc_svc_cls, image_id, encryptor_ami,
                  "preserved because the root disk is attached at %s "
                  "instead of /dev/sda1", guest_image.root_device_name)
         legacy = True
+    interrupted = False
     try:
-        guest_instance = run_guest_instance(aws_svc,
-            image_id, subnet_id=subnet_id, instance_type=guest_instance_type)
-        wait_for_instance(aws_svc, guest_instance.id)
-        snapshot_id, root_dev, size, vol_type, iops = _snapshot_root_volume(
-            aws_svc, guest_instance, image_id
-        )
-
-        if (guest_image.virtualization_type == 'hvm' and
-            'brkt-avatar-freebsd' not in mv_image.name):
-            net_sriov_attr = aws_svc.get_instance_attribute(guest_instance.id,
-                                                            "sriovNetSupport")
-            if net_sriov_attr.get("sriovNetSupport") == "simple":
-                log.warn("Guest Operating System license information will not "
-                         "be preserved because guest has sriovNetSupport "
-                         "enabled and metavisor does not support sriovNet")
-                legacy = True
-
-        encryptor_instance, temp_sg_id = _run_encryptor_instance(
-            aws_svc=aws_svc,
-            encryptor_image_id=encryptor_ami,
-            snapshot=snapshot_id,
-            root_size=size,
-            guest_image_id=image_id,
-            security_group_ids=security_group_ids,
-            subnet_id=subnet_id,
-            zone=guest_instance.placement,
-            instance_config=instance_config,
-            status_port=status_port
-        )
+        if journal and journal.completed(PHASE_GUEST_SNAPSHOT):
+            if journal.get('guest_instance_id'):
+                guest_instance = aws_svc.get_instance(
+                    journal.get('guest_instance_id'))
+            snapshot_id = journal.get('snapshot_id')
+            snapshot_cached = journal.get('snapshot_cached', False)
+            size = journal.get('root_size')
+            vol_type = journal.get('vol_type')
+            iops = journal.get('iops')
+            legacy = journal.get('legacy')
+            log.info(
+                'Using snapshot %s of the guest root volume', snapshot_id)
+        else:
+            with trace.span('guest_snapshot', image_id=image_id):
+                cached = None
+                if snapshot_cache:
+                    cached = snapshot_cache.get(
+                        aws_svc, image_id, root_device_name)
+
+                if cached and legacy:
+                    # The guest instance is only needed to preserve license
+                    # information, which we can't do for this AMI anyway.
+                    snapshot_id = cached.snapshot_id
+                    size = cached.size
+                    vol_type = cached.vol_type
+                    iops = cached.iops
+                    snapshot_cached = True
+                else:
+                    if journal and journal.completed(PHASE_GUEST_INSTANCE):
+                        # We didn't finish snapshotting the guest root volume.
+                        # Start over with a new guest instance.
+                        clean_up(
+                            aws_svc,
+                            instance_ids=[journal.get('guest_instance_id')]
+                        )
+                    guest_instance = run_guest_instance(aws_svc,
+                        image_id, subnet_id=subnet_id,
+                        instance_type=guest_instance_type)
+                    record_phase(
+                        journal, PHASE_GUEST_INSTANCE,
+                        guest_instance_id=guest_instance.id)
+
+                    # Generating user data and creating the temporary security
+                    # group don't depend on the guest root snapshot.  Do that
+                    # work while the guest instance boots and gets snapshotted.
+                    launch_prep = util.run_async(
+                        _prepare_encryptor_launch,
+                        aws_svc,
+                        instance_config=instance_config,
+                        security_group_ids=security_group_ids,
+                        subnet_id=subnet_id,
+                        status_port=status_port
+                    )
+
+                    wait_for_instance(aws_svc, guest_instance.id)
+                    # With a cached snapshot, we still need the stopped guest
+                    # instance as the base for the encrypted AMI, but we skip
+                    # snapshotting its root volume.
+                    snapshot_id, root_dev, size, vol_type, iops = \
+                        _snapshot_root_volume(
+                            aws_svc, guest_instance, image_id,
+                            snapshot=(cached is None)
+                        )
+                    if cached:
+                        snapshot_id = cached.snapshot_id
+                        snapshot_cached = True
+                    elif snapshot_cache:
+                        snapshot_cache.put(
+                            aws_svc, snapshot_id, image_id, root_device_name,
+                            vol_type, iops=iops)
+                        snapshot_cached = True
+
+                    if (guest_image.virtualization_type == 'hvm' and
+                        'brkt-avatar-freebsd' not in mv_image.name):
+                        net_sriov_attr = aws_svc.get_instance_attribute(
+                            guest_instance.id, "sriovNetSupport")
+                        if net_sriov_attr.get("sriovNetSupport") == "simple":
+                            log.warn(
+                                "Guest Operating System license information "
+                                "will not be preserved because guest has "
+                                "sriovNetSupport enabled and metavisor does "
+                                "not support sriovNet")
+                            legacy = True
+
+                record_phase(
+                    journal, PHASE_GUEST_SNAPSHOT,
+                    snapshot_id=snapshot_id, snapshot_cached=snapshot_cached,
+                    root_size=size, vol_type=vol_type, iops=iops,
+                    legacy=legacy)
+
+        if journal and journal.completed(PHASE_ENCRYPTOR_INSTANCE):
+            encryptor_instance = aws_svc.get_instance(
+                journal.get('encryptor_instance_id'))
+            temp_sg_id = journal.get('temp_sg_id')
+            log.info(
+                'Using encryptor instance %s', encryptor_instance.id)
+        else:
+            with trace.span('launch_encryptor', encryptor_ami=encryptor_ami):
+                if not launch_prep:
+                    launch_prep = util.run_async(
+                        _prepare_encryptor_launch,
+                        aws_svc,
+                        instance_config=instance_config,
+                        security_group_ids=security_group_ids,
+                        subnet_id=subnet_id,
+                        status_port=status_port
+                    )
+                launch_data = launch_prep.result()
+                temp_sg_id = launch_data[2]
+                encryptor_instance, _ = _run_encryptor_instance(
+                    aws_svc=aws_svc,
+                    encryptor_image_id=encryptor_ami,
+                    snapshot=snapshot_id,
+                    root_size=size,
+                    guest_image_id=image_id,
+                    subnet_id=subnet_id,
+                    zone=guest_instance.placement if guest_instance else None,
+                    status_port=status_port,
+                    launch_data=launch_data,
+                    encrypted_volume_type=encrypted_volume_type,
+                    encrypted_volume_iops=encrypted_volume_iops,
+                    fast_snapshot_restore=fast_snapshot_restore
+                )
+                record_phase(
+                    journal, PHASE_ENCRYPTOR_INSTANCE,
+                    encryptor_instance_id=encryptor_instance.id,
+                    temp_sg_id=temp_sg_id)
 
-        log.debug('Getting image %s', image_id)
-        image = aws_svc.get_image(image_id)
-        if image is None:
-            raise BracketError("Can't find image %s" % image_id)
+        # The guest image was already fetched above.  Don't make another
+        # round trip to get its name and description.
         if encrypted_ami_name:
             name = encrypted_ami_name
-        elif image_id:
-            name = get_name_from_image(image)
-        description = get_description_from_image(image)
-
-        mv_root_id, mv_bdm = snapshot_encrypted_instance(aws_svc, enc_svc_cls,
-                encryptor_instance, mv_image, image_id=image_id,
-                vol_type=vol_type, iops=iops, legacy=legacy,
-                save_encryptor_logs=save_encryptor_logs, status_port=status_port)
-        ami_info = register_ami(aws_svc, encryptor_instance, mv_image, name,
-                description, legacy=legacy, guest_instance=guest_instance,
-                mv_root_id=mv_root_id,
-                mv_bdm=mv_bdm)
+        else:
+            name = get_name_from_image(guest_image)
+        description = get_description_from_image(guest_image)
+
+        with trace.span('encryption'):
+            mv_root_id, mv_bdm = snapshot_encrypted_instance(
+                    aws_svc, enc_svc_cls,
+                    encryptor_instance, mv_image, image_id=image_id,
+                    vol_type=vol_type, iops=iops, legacy=legacy,
+                    save_encryptor_logs=save_encryptor_logs,
+                    status_port=status_port, journal=journal,
+                    encryptor_monitor=encryptor_monitor)
+        # The guest root snapshot is deleted at the end of the session,
+        # unless it's in the snapshot cache.  Don't point to a snapshot
+        # that won't exist.
+        lineage = {TAG_SOURCE_AMI: image_id}
+        if snapshot_cached:
+            lineage[TAG_SOURCE_SNAPSHOT] = snapshot_id
+        with trace.span('register_ami'):
+            ami_info = register_ami(
+                    aws_svc, encryptor_instance, mv_image, name,
+                    description, legacy=legacy, guest_instance=guest_instance,
+                    mv_root_id=mv_root_id,
+                    mv_bdm=mv_bdm,
+                    tags=lineage,
+                    journal=journal)
         ami = ami_info['ami']
         log.info('Created encrypted AMI %s based on %s', ami, image_id)
+    except (IOError, KeyboardInterrupt) as e:
+        # The user interrupted the session, or we lost our connection to
+        # AWS or the encryptor.  Keep the resources around if the session
+        # can be resumed.
+        interrupted = keep_resources(journal, e)
+        raise
     finally:
-        instance_ids = []
-        if guest_instance:
-            instance_ids.append(guest_instance.id)
-
-        terminate_encryptor = (
-            encryptor_instance and
-            (ami or terminate_encryptor_on_failure)
-        )
-
-        if terminate_encryptor:
-            instance_ids.append(encryptor_instance.id)
-        elif encryptor_instance:
-            log.info('Not terminating encryptor instance %s',
-                     encryptor_instance.id)
-
-        # Delete volumes explicitly.  They should get cleaned up during
-        # instance deletion, but we've gotten reports that occasionally
-        # volumes can get orphaned.
-        #
-        # We can't do this if we're keeping the encryptor instance around,
-        # since its volumes will still be attached.
-        volume_ids = None
-        if terminate_encryptor:
-            try:
-                volumes = aws_svc.get_volumes(
-                    tag_key=TAG_ENCRYPTOR_SESSION_ID,
-                    tag_value=aws_svc.session_id
+        if interrupted:
+            log.error(
+                'Encryptor session %s was interrupted.  Run encrypt with '
+                '--resume %s to continue.',
+                aws_svc.session_id, aws_svc.session_id
+            )
+            # A resumed session creates new copies of the resources that
+            # weren't recorded in the journal.
+            snapshot_ids = []
+            sg_ids = []
+            if (snapshot_id and not snapshot_cached and
+                    not journal.completed(PHASE_GUEST_SNAPSHOT)):
+                snapshot_ids.append(snapshot_id)
+            if (launch_prep and
+                    not journal.completed(PHASE_ENCRYPTOR_INSTANCE) and
+                    not launch_prep.exception() and
+                    launch_prep.result()[2]):
+                sg_ids.append(launch_prep.result()[2])
+            if snapshot_ids or sg_ids:
+                clean_up(
+                    aws_svc,
+                    snapshot_ids=snapshot_ids,
+                    security_group_ids=sg_ids
                 )
-                volume_ids = [v.id for v in volumes]
-            except EC2ResponseError as e:
-                log.warn('Unable to clean up orphaned volumes: %s', e)
-            except:
-                log.exception('Unable to clean up orphaned volumes')
+        else:
+            if launch_prep and not temp_sg_id:
+                # We failed before the encryptor was launched.  Wait for the
+                # temporary security group so that we can clean it up.
+                if not launch_prep.exception():
+                    temp_sg_id = launch_prep.result()[2]
+
+            instance_ids = []
+            if guest_instance:
+                instance_ids.append(guest_instance.id)
+
+            terminate_encryptor = (
+                encryptor_instance and
+                (ami or terminate_encryptor_on_failure)
+            )
 
-        sg_ids = []
-        if temp_sg_id and terminate_encryptor:
-            sg_ids.append(temp_sg_id)
+            if terminate_encryptor:
+                instance_ids.append(encryptor_instance.id)
+            elif encryptor_instance:
+                log.info('Not terminating encryptor instance %s',
+                         encryptor_instance.id)
+
+            # Delete volumes explicitly.  They should get cleaned up during
+            # instance deletion, but we've gotten reports that occasionally
+            # volumes can get orphaned.
+            #
+            # We can't do this if we're keeping the encryptor instance around,
+            # since its volumes will still be attached.
+            volume_ids = None
+            if terminate_encryptor:
+                try:
+                    volumes = aws_svc.get_volumes(
+                        tag_key=TAG_ENCRYPTOR_SESSION_ID,
+                        tag_value=aws_svc.session_id
+                    )
+                    volume_ids = [v.id for v in volumes]
+                except EC2ResponseError as e:
+                    log.warn('Unable to clean up orphaned volumes: %s', e)
+                except:
+                    log.exception('Unable to clean up orphaned volumes')
+
+            # The security group is still in use if we're keeping the encryptor
+            # instance around.
+            sg_ids = []
+            if temp_sg_id and (terminate_encryptor or not encryptor_instance):
+                sg_ids.append(temp_sg_id)
+
+            # Snapshots in the cache outlive the session.
+            snapshot_ids = []
+            if snapshot_id and not snapshot_cached:
+                snapshot_ids.append(snapshot_id)
+
+            with trace.span('clean_up'):
+                clean_up(
+                    aws_svc,
+                    instance_ids=instance_ids,
+                    volume_ids=volume_ids,
+                    snapshot_ids=snapshot_ids,
+                    security_group_ids=sg_ids
+                )
 
-        snapshot_ids = []
-        if snapshot_id:
-            snapshot_ids.append(snapshot_id)
-
-        clean_up(
-            aws_svc,
-            instance_ids=instance_ids,
-            volume_ids=volume_ids,
-            snapshot_ids=snapshot_ids,
-            security_group_ids=sg_ids
-        )
+            if journal:
+                journal.delete()
 
     log.info('Done.')
     return ami
+
+
+def encrypt_async(aws_svc, enc_svc_cls, image_id, encryptor_ami, **kwargs):
+    """ Run encrypt() in the background, so that the caller can manage
+    many encryptions without blocking.  Call cancel() on the returned
+    Future to stop encryption.  The encryptor session's resources are
+    cleaned up, as they would be after an error, and result() raises
+    util.CancelledError.
+
+    :return a util.Future that holds the id of the encrypted AMI
+    """
+    return util.run_async(
+        encrypt, aws_svc, enc_svc_cls, image_id, encryptor_ami, **kwargs)
@@ -14,12 +14,105 @@
 
 import argparse
 
+from brkt_cli import validation
+from brkt_cli.aws import encrypt_ami, encrypt_batch, snapshot_cache
+
+
+def _positive_int(value):
+    return validation.min_int_argument(value, 1)
+
+
+def _io1_iops(value):
+    return validation.range_int_argument(
+        value, encrypt_ami.MIN_IO1_IOPS, encrypt_ami.MAX_IO1_IOPS)
+
 
 def setup_encrypt_ami_args(parser):
     parser.add_argument(
         'ami',
         metavar='ID',
-        help='The guest AMI that will be encrypted'
+        nargs='*',
+        help=(
+            'The guest AMI that will be encrypted.  Specify more than one '
+            'ID to encrypt several AMIs concurrently.'
+        )
+    )
+    parser.add_argument(
+        '--ami-file',
+        metavar='PATH',
+        dest='ami_file',
+        help=(
+            'Read guest AMI IDs from this file, one per line, and encrypt '
+            'them concurrently'
+        )
+    )
+    parser.add_argument(
+        '--max-concurrent-encryptions',
+        metavar='N',
+        type=_positive_int,
+        dest='max_concurrent_encryptions',
+        help='Maximum number of AMIs to encrypt at the same time',
+        default=encrypt_batch.DEFAULT_MAX_CONCURRENT_ENCRYPTIONS
+    )
+    parser.add_argument(
+        '--copy-to-region',
+        metavar='REGION',
+        dest='copy_to_regions',
+        action='append',
+        help=(
+            'Copy the encrypted AMI to this region after encryption '
+            'completes.  May be specified multiple times.'
+        )
+    )
+    parser.add_argument(
+        '--resume',
+        metavar='SESSION',
+        dest='resume',
+        help=(
+            'Resume an interrupted encryption session, starting after '
+            'the last phase that completed'
+        )
+    )
+    parser.add_argument(
+        '--keep-session',
+        dest='keep_session',
+        action='store_true',
+        default=False,
+        help=(
+            'If the session loses its connection to AWS or the encryptor, '
+            'keep its instances and snapshots so that it can be continued '
+            'with --resume.  Sessions that are interrupted with Ctrl-C are '
+            'always kept'
+        )
+    )
+    parser.add_argument(
+        '--snapshot-cache',
+        dest='snapshot_cache',
+        action='store_true',
+        default=False,
+        help=(
+            'Keep the snapshot of the unencrypted guest root volume, and '
+            'reuse it the next time the same AMI is encrypted'
+        )
+    )
+    parser.add_argument(
+        '--snapshot-cache-ttl',
+        metavar='DAYS',
+        type=_positive_int,
+        dest='snapshot_cache_ttl',
+        default=snapshot_cache.DEFAULT_TTL_DAYS,
+        help='Delete cached snapshots that are older than this'
+    )
+    parser.add_argument(
+        '--snapshot-cache-max-size',
+        metavar='GB',
+        type=_positive_int,
+        dest='snapshot_cache_max_size',
+        default=snapshot_cache.DEFAULT_MAX_SIZE_GB,
+        help=(
+            'Delete the oldest cached snapshots when the total size of the '
+            'cache is larger than this'
+        )
     )
     parser.add_argument(
         '--encrypted-ami-name',
@@ -28,6 +121,40 @@ def setup_encrypt_ami_args(parser):
         help='Specify the name of the generated encrypted AMI',
         required=False
     )
+    parser.add_argument(
+        '--encrypted-volume-type',
+        metavar='TYPE',
+        dest='encrypted_volume_type',
+        choices=encrypt_ami.ENCRYPTED_VOLUME_TYPES,
+        default=encrypt_ami.DEFAULT_ENCRYPTED_VOLUME_TYPE,
+        help=(
+            'The EBS volume type that the encryptor writes the encrypted '
+            'root volume to (%s).  io1 and st1 encrypt large root volumes '
+            'faster.' % ', '.join(encrypt_ami.ENCRYPTED_VOLUME_TYPES)
+        )
+    )
+    parser.add_argument(
+        '--encrypted-volume-iops',
+        metavar='N',
+        type=_io1_iops,
+        dest='encrypted_volume_iops',
+        help=(
+            'Provisioned IOPS for the encrypted root volume, when '
+            '--encrypted-volume-type is io1'
+        )
+    )
+    parser.add_argument(
+        '--fast-snapshot-restore',
+        dest='fast_snapshot_restore',
+        action='store_true',
+        default=False,
+        help=(
+            'Enable EBS fast snapshot restore for the guest root snapshot '
+            'while the encryptor instance is launched, so that the '
+            'encryptor reads the volume at full speed.  Fast snapshot '
+            'restore is billed by the hour.'
+        )
+    )
     parser.add_argument(
         '--guest-instance-type',
         metavar='TYPE',
@@ -118,6 +245,14 @@ def setup_encrypt_ami_args(parser):
         help=argparse.SUPPRESS,
         default=0.25
     )
+    # Share the API rate limit with other brkt-cli processes that use the
+    # same file.
+    parser.add_argument(
+        '--rate-limit-file',
+        metavar='PATH',
+        dest='rate_limit_file',
+        help=argparse.SUPPRESS
+    )
 
     parser.add_argument(
         '--save-encryptor-logs',
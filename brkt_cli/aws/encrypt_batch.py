@@ -0,0 +1,194 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Encrypt several AMIs concurrently in one process.
+
+Each guest AMI goes through the same pipeline as encrypt_ami.encrypt(),
+on a bounded pool of worker threads.  All workers share one AWS
+connection, one encryptor AMI and one temporary security group.  Each
+image gets its own encryptor session id, so that resource tags and the
+cleanup of orphaned volumes stay scoped to that image.
+"""
+
+import logging
+
+from brkt_cli import encryptor_service, trace, util
+from brkt_cli.encryptor_monitor import EncryptorMonitor
+from brkt_cli.aws import encrypt_ami
+
+DEFAULT_MAX_CONCURRENT_ENCRYPTIONS = 4
+
+log = logging.getLogger(__name__)
+
+
+class EncryptionResult(object):
+    """ The outcome of encrypting one guest AMI. """
+
+    def __init__(self, image_id, session_id):
+        self.image_id = image_id
+        self.session_id = session_id
+        self.encrypted_image_id = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.encrypted_image_id is not None
+
+
+def _encrypt_one(aws_svc, result, **kwargs):
+    svc = aws_svc.clone(result.session_id)
+    svc.default_tags[encrypt_ami.TAG_ENCRYPTOR_SESSION_ID] = \
+        result.session_id
+    log.info(
+        'Encrypting %s in encryptor session %s',
+        result.image_id, result.session_id)
+    try:
+        with trace.span(
+                'encrypt', image_id=result.image_id,
+                session_id=result.session_id):
+            result.encrypted_image_id = encrypt_ami.encrypt(
+                aws_svc=svc, image_id=result.image_id, **kwargs)
+    except Exception as e:
+        log.debug('', exc_info=1)
+        log.error('Unable to encrypt %s: %s', result.image_id, e)
+        result.error = e
+    return result
+
+
+def encrypt_batch(aws_svc, enc_svc_cls, image_ids, encryptor_ami,
+                  subnet_id=None, security_group_ids=None,
+                  guest_instance_type='m3.medium', instance_config=None,
+                  save_encryptor_logs=True,
+                  status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
+                  terminate_encryptor_on_failure=True,
+                  max_concurrent_encryptions=(
+                      DEFAULT_MAX_CONCURRENT_ENCRYPTIONS),
+                  snapshot_cache=None,
+                  encrypted_volume_type=(
+                      encrypt_ami.DEFAULT_ENCRYPTED_VOLUME_TYPE),
+                  encrypted_volume_iops=None,
+                  fast_snapshot_restore=False):
+    """ Encrypt the given guest AMIs, running up to
+    max_concurrent_encryptions encryption sessions at a time.  A failure
+    to encrypt one image does not affect the others.
+
+    :return a list of EncryptionResult objects, in the same order as
+        image_ids
+    """
+    # Preserve order, but don't encrypt the same image twice.
+    unique_ids = []
+    for image_id in image_ids:
+        if image_id not in unique_ids:
+            unique_ids.append(image_id)
+
+    log.info(
+        'Encrypting %d images, %d at a time',
+        len(unique_ids), max_concurrent_encryptions)
+
+    results = [
+        EncryptionResult(image_id, util.make_nonce())
+        for image_id in unique_ids
+    ]
+    temp_sg_id = None
+    futures = []
+    pool = util.WorkerPool(max_concurrent_encryptions)
+    # Poll the status of all encryptors from a shared set of threads.
+    monitor = EncryptorMonitor()
+
+    try:
+        # Create one temporary security group for all encryptor instances,
+        # instead of one per session.
+        if not security_group_ids:
+            vpc_id = None
+            if subnet_id:
+                subnet = aws_svc.get_subnet(subnet_id)
+                vpc_id = subnet.vpc_id
+            temp_sg_id = encrypt_ami.create_encryptor_security_group(
+                aws_svc, vpc_id=vpc_id, status_port=status_port).id
+            security_group_ids = [temp_sg_id]
+
+        futures = [
+            pool.submit(
+                _encrypt_one,
+                aws_svc,
+                result,
+                enc_svc_cls=enc_svc_cls,
+                encryptor_ami=encryptor_ami,
+                subnet_id=subnet_id,
+                security_group_ids=security_group_ids,
+                guest_instance_type=guest_instance_type,
+                instance_config=instance_config,
+                save_encryptor_logs=save_encryptor_logs,
+                status_port=status_port,
+                terminate_encryptor_on_failure=(
+                    terminate_encryptor_on_failure),
+                snapshot_cache=snapshot_cache,
+                encrypted_volume_type=encrypted_volume_type,
+                encrypted_volume_iops=encrypted_volume_iops,
+                fast_snapshot_restore=fast_snapshot_restore,
+                encryptor_monitor=monitor
+            )
+            for result in results
+        ]
+        for future in futures:
+            future.wait()
+    finally:
+        # If we were interrupted, stop the sessions that are still running
+        # and let them clean up.  Their instances use the temporary
+        # security group, so it can't be deleted until they're gone.
+        pending = [f for f in futures if not f.done()]
+        if pending:
+            log.info('Cancelling %d encryptor sessions', len(pending))
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                future.wait()
+        pool.shutdown(wait=False)
+        monitor.stop()
+
+        # Encryptor instances that were kept around after a failure still
+        # use the security group.
+        keep_sg = (
+            not terminate_encryptor_on_failure and
+            any(not r.succeeded for r in results)
+        )
+        if temp_sg_id and keep_sg:
+            log.info('Not deleting security group %s', temp_sg_id)
+        elif temp_sg_id:
+            encrypt_ami.clean_up(aws_svc, security_group_ids=[temp_sg_id])
+
+    succeeded = len([r for r in results if r.succeeded])
+    log.info(
+        'Encrypted %d of %d images', succeeded, len(results))
+    return results
+
+
+def render_results(results):
+    """ Render the results of encrypt_batch() as a table, with one row per
+    guest AMI.
+    """
+    rows = [['GUEST AMI', 'ENCRYPTED AMI', 'SESSION', 'STATUS']]
+    for r in results:
+        if r.succeeded:
+            status = 'OK'
+        else:
+            status = 'FAILED: %s' % (r.error or 'unknown error')
+        rows.append([
+            r.image_id,
+            r.encrypted_image_id or '-',
+            r.session_id,
+            status
+        ])
+    return util.render_table_rows(rows)
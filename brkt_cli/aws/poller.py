@@ -0,0 +1,194 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Coalesce describe calls from concurrent waiters.
+
+When several threads are waiting on instances, volumes or snapshots at the
+same time, each one would normally make its own DescribeInstances,
+DescribeVolumes or DescribeSnapshots call.  ResourcePoller collects the
+ids that are requested at about the same time and looks them all up with
+one call.  The thread that makes the call is the leader for that batch.
+Requests that arrive while a call is in flight go into the next batch.
+
+A batched describe call fails if any of its resources doesn't exist.
+The poller then looks up the resources one at a time, so the describe
+functions should not retry NotFound errors.
+"""
+
+import logging
+import sys
+import threading
+
+from boto.exception import EC2ResponseError
+
+from brkt_cli import util
+
+# How long the leader waits for other requests to join the batch.
+DEFAULT_GATHER_SECONDS = 0.5
+
+log = logging.getLogger(__name__)
+
+
+def _not_found(error_code, resource_id):
+    e = EC2ResponseError(400, 'Not Found')
+    e.error_code = error_code
+    e.error_message = '%s does not exist' % resource_id
+    return e
+
+
+class _Batcher(object):
+    """ Coalesces lookups of one resource type. """
+
+    def __init__(self, describe, not_found_code, name,
+                 gather_seconds=DEFAULT_GATHER_SECONDS):
+        """
+        :param describe a function that takes a list of ids and returns a
+            list of resource objects
+        :param not_found_code the EC2 error code for a missing resource
+        :param name the resource type, for logging
+        """
+        self.describe = describe
+        self.not_found_code = not_found_code
+        self.name = name
+        self.gather_seconds = gather_seconds
+        self.num_calls = 0
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._num_waiters = 0
+        self._in_flight = False
+
+    def get(self, resource_ids):
+        """ Look up the given resources, batching with concurrent
+        requests from other threads.
+
+        :return a list of resource objects, in the same order as
+            resource_ids
+        :raise EC2ResponseError if a resource does not exist or the
+            describe call fails
+        """
+        futures = []
+        with self._cond:
+            for resource_id in resource_ids:
+                future = util.Future()
+                self._pending.setdefault(resource_id, []).append(future)
+                futures.append(future)
+            self._num_waiters += 1
+            lead = False
+            while not all(f.done() for f in futures):
+                if not self._in_flight:
+                    self._in_flight = True
+                    lead = True
+                    break
+                # Wait with a timeout, so that Ctrl-C works in Python 2.
+                self._cond.wait(1.0)
+
+        if lead:
+            try:
+                # If other waiters are already queued, give more of them a
+                # chance to join this batch.  Don't delay a lone waiter.
+                with self._cond:
+                    gather = self._num_waiters > 1
+                if gather:
+                    util.sleep(self.gather_seconds)
+                with self._cond:
+                    batch = self._pending
+                    self._pending = {}
+                    self._num_waiters = 0
+                self._fetch(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = False
+                    self._cond.notify_all()
+
+        return [f.result() for f in futures]
+
+    def _fetch(self, batch):
+        """ Look up all resources in the batch and complete their futures.
+        """
+        ids = batch.keys()
+        self.num_calls += 1
+        log.debug('Describing %d %s: %s', len(ids), self.name, ids)
+        try:
+            resources = self.describe(ids)
+        except EC2ResponseError as e:
+            if e.error_code == self.not_found_code and len(ids) > 1:
+                # One missing resource fails the whole call.  Look them up
+                # one at a time, so that the error only goes to the waiter
+                # that asked for the missing resource.
+                for resource_id in ids:
+                    self._fetch({resource_id: batch[resource_id]})
+                return
+            self._fail(batch, sys.exc_info())
+            return
+        except:
+            self._fail(batch, sys.exc_info())
+            return
+
+        by_id = dict((r.id, r) for r in resources)
+        for resource_id, futures in batch.iteritems():
+            resource = by_id.get(resource_id)
+            for future in futures:
+                if resource is None:
+                    future.set_exception((
+                        EC2ResponseError,
+                        _not_found(self.not_found_code, resource_id),
+                        None
+                    ))
+                else:
+                    future.set_result(resource)
+
+    def _fail(self, batch, exc_info):
+        for futures in batch.values():
+            for future in futures:
+                future.set_exception(exc_info)
+
+
+class ResourcePoller(object):
+    """ Looks up instances, volumes and snapshots.  Lookups that are
+    requested concurrently by different threads are batched into one
+    describe call per resource type.
+    """
+
+    def __init__(self, aws_svc, gather_seconds=DEFAULT_GATHER_SECONDS):
+        self.instances = _Batcher(
+            lambda ids: aws_svc.get_instances(*ids),
+            'InvalidInstanceID.NotFound',
+            'instances',
+            gather_seconds=gather_seconds
+        )
+        self.volumes = _Batcher(
+            lambda ids: aws_svc.get_volumes(volume_ids=ids),
+            'InvalidVolume.NotFound',
+            'volumes',
+            gather_seconds=gather_seconds
+        )
+        self.snapshots = _Batcher(
+            lambda ids: aws_svc.get_snapshots(*ids),
+            'InvalidSnapshot.NotFound',
+            'snapshots',
+            gather_seconds=gather_seconds
+        )
+
+    def get_instance(self, instance_id):
+        return self.instances.get([instance_id])[0]
+
+    def get_instances(self, *instance_ids):
+        return self.instances.get(instance_ids)
+
+    def get_volume(self, volume_id):
+        return self.volumes.get([volume_id])[0]
+
+    def get_snapshots(self, *snapshot_ids):
+        return self.snapshots.get(snapshot_ids)
@@ -0,0 +1,235 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Limit the rate of AWS API calls.
+
+EC2 throttles API calls per account and region.  When many encryption
+sessions run at the same time, they hit the limit together, and each one
+backs off on its own.  RateLimiter is a token bucket that all threads in
+the process share.  Before each API call, AWSService.retry() takes a
+token from the bucket, waiting if the bucket is empty.
+
+The rate adapts to the account's limit: it is halved when a call is
+throttled and grows back by a small amount after each successful call
+(additive increase, multiplicative decrease).  Throttle errors that
+arrive at about the same time only halve the rate once.
+
+To share the bucket between processes, pass a state file.  The bucket's
+state is stored in the file, which is locked with flock() while it is
+read and updated.  flock() is not available on Windows, where the state
+file is ignored.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from brkt_cli import util
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_MAX_RATE = 20.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_BURST = 20.0
+
+# The rate grows by this many calls per second, for each second's worth of
+# successful calls.
+DEFAULT_INCREASE = 1.0
+DEFAULT_DECREASE_FACTOR = 0.5
+
+# Throttle errors within this many seconds of the last decrease are
+# treated as part of the same event.
+THROTTLE_WINDOW_SECONDS = 1.0
+
+log = logging.getLogger(__name__)
+
+
+class _BucketState(object):
+
+    def __init__(self, rate, tokens, updated, last_throttle=0.0):
+        self.rate = rate
+        self.tokens = tokens
+        self.updated = updated
+        self.last_throttle = last_throttle
+
+    def to_dict(self):
+        return {
+            'rate': self.rate,
+            'tokens': self.tokens,
+            'updated': self.updated,
+            'last_throttle': self.last_throttle
+        }
+
+
+class RateLimiter(object):
+    """ A token bucket whose rate adapts to throttling.  Thread-safe. """
+
+    def __init__(self, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE,
+                 burst=DEFAULT_BURST, increase=DEFAULT_INCREASE,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, state_file=None,
+                 clock=time.time, sleep=util.sleep):
+        """
+        :param max_rate: the starting and maximum number of calls per second
+        :param min_rate: the rate never drops below this value
+        :param burst: the maximum number of tokens in the bucket
+        :param state_file: if specified, share the bucket with other
+            processes that use the same file
+        """
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.clock = clock
+        self.sleep = sleep
+        self.state_file = state_file
+        if state_file and not fcntl:
+            log.warn(
+                'Unable to share the API rate limit with other processes '
+                'on this platform')
+            self.state_file = None
+
+        self._lock = threading.Lock()
+        self._state = _BucketState(max_rate, burst, clock())
+
+    @property
+    def rate(self):
+        with self._locked_state() as state:
+            return state.rate
+
+    def _load(self, f):
+        f.seek(0)
+        content = f.read()
+        if not content:
+            return _BucketState(self.max_rate, self.burst, self.clock())
+        try:
+            d = json.loads(content)
+            return _BucketState(
+                d['rate'], d['tokens'], d['updated'], d['last_throttle'])
+        except (ValueError, KeyError) as e:
+            log.debug('Ignoring invalid state in %s: %s', self.state_file, e)
+            return _BucketState(self.max_rate, self.burst, self.clock())
+
+    def _save(self, f, state):
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(state.to_dict()))
+        f.flush()
+
+    def _locked_state(self):
+        return _LockedState(self)
+
+    def _refill(self, state):
+        now = self.clock()
+        elapsed = max(0.0, now - state.updated)
+        state.tokens = min(self.burst, state.tokens + elapsed * state.rate)
+        state.updated = now
+
+    def acquire(self):
+        """ Take a token from the bucket, waiting until one is available.
+        """
+        while True:
+            with self._locked_state() as state:
+                self._refill(state)
+                if state.tokens >= 1.0:
+                    state.tokens -= 1.0
+                    return
+                wait = (1.0 - state.tokens) / state.rate
+            self.sleep(wait)
+
+    def on_success(self):
+        """ Grow the rate after a successful call. """
+        with self._locked_state() as state:
+            if state.rate < self.max_rate:
+                state.rate = min(
+                    self.max_rate, state.rate + self.increase / state.rate)
+
+    def on_throttle(self):
+        """ Shrink the rate after a call was throttled. """
+        with self._locked_state() as state:
+            now = self.clock()
+            if now - state.last_throttle < THROTTLE_WINDOW_SECONDS:
+                return
+            state.last_throttle = now
+            state.rate = max(
+                self.min_rate, state.rate * self.decrease_factor)
+            # Don't let a full bucket cause another burst right away.
+            state.tokens = min(state.tokens, 1.0)
+            log.debug('API call throttled.  Reducing rate to %.2f/s',
+                      state.rate)
+
+    def wrap(self, function, is_throttle):
+        """ Return a function that calls the given function at the limited
+        rate.
+
+        :param is_throttle: a function that takes an exception and returns
+            True if it indicates that the call was throttled
+        """
+        def _limited(*args, **kwargs):
+            self.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                if is_throttle(e):
+                    self.on_throttle()
+                raise
+            self.on_success()
+            return result
+        _limited.__name__ = getattr(function, '__name__', 'function')
+        return _limited
+
+
+class _LockedState(object):
+    """ Context manager that holds the limiter's locks and yields the
+    bucket state.  With a state file, the state is read from and written
+    back to the file.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.f = None
+        self.state = None
+
+    def __enter__(self):
+        limiter = self.limiter
+        limiter._lock.acquire()
+        if not limiter.state_file:
+            self.state = limiter._state
+            return self.state
+        try:
+            self.f = open(limiter.state_file, 'a+')
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+            self.state = limiter._load(self.f)
+        except:
+            if self.f:
+                self.f.close()
+            limiter._lock.release()
+            raise
+        return self.state
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.f:
+                try:
+                    self.limiter._save(self.f, self.state)
+                finally:
+                    # Closing the file releases the lock.
+                    self.f.close()
+        finally:
+            self.limiter._lock.release()
@@ -0,0 +1,151 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Share an encrypted AMI with other AWS accounts.
+
+The AMI's launch permission and its snapshots' create volume permission
+are granted to all accounts in one call per resource.  Then, for each
+account, brkt-cli assumes an IAM role in that account and tags the
+shared AMI, or copies it so that the account owns its own AMI.  Tags are
+visible only to the account that created them, so each account needs its
+own.  Accounts are processed concurrently on a bounded thread pool.
+"""
+
+import logging
+import re
+
+from brkt_cli import trace, util
+from brkt_cli.aws import copy_ami, encrypt_ami
+
+DEFAULT_MAX_CONCURRENT_ACCOUNTS = 8
+
+ROLE_ARN_REGEXP = r'^arn:aws[\w-]*:iam::(\d{12}):role/.+$'
+
+log = logging.getLogger(__name__)
+
+
+def get_account_id(role_arn):
+    """ Return the AWS account id from an IAM role ARN, or None if the ARN
+    is malformed.
+    """
+    m = re.match(ROLE_ARN_REGEXP, role_arn)
+    if m:
+        return m.group(1)
+    return None
+
+
+class AccountResult(object):
+    """ The outcome of sharing an AMI with one account. """
+
+    def __init__(self, role_arn):
+        self.role_arn = role_arn
+        self.account_id = get_account_id(role_arn)
+        self.image_id = None
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.image_id is not None and self.error is None
+
+
+def _share_with_account(aws_svc, source_image, source_snapshots, copy,
+                        result):
+    svc = aws_svc.clone(aws_svc.session_id)
+    with trace.span('share_ami', account_id=result.account_id):
+        try:
+            svc.connect_as(
+                result.role_arn,
+                aws_svc.region,
+                'brkt-cli-%s' % aws_svc.session_id
+            )
+            if copy:
+                image_id = svc.copy_image(
+                    aws_svc.region,
+                    source_image.id,
+                    name=source_image.name,
+                    description=source_image.description
+                )
+                log.info(
+                    'Copying %s to account %s as %s',
+                    source_image.id, result.account_id, image_id)
+                encrypt_ami.wait_for_image(
+                    svc, image_id, timeout=copy_ami.COPY_IMAGE_TIMEOUT)
+            else:
+                image_id = source_image.id
+            copy_ami.copy_tags(svc, source_image, source_snapshots, image_id)
+            result.image_id = image_id
+            log.info(
+                'Shared %s with account %s', source_image.id,
+                result.account_id)
+        except Exception as e:
+            log.debug('', exc_info=1)
+            log.error(
+                'Unable to share %s with account %s: %s',
+                source_image.id, result.account_id, e)
+            result.error = e
+    return result
+
+
+def share_ami(aws_svc, image_id, role_arns, copy=False,
+              max_concurrent_accounts=DEFAULT_MAX_CONCURRENT_ACCOUNTS):
+    """ Share the given AMI and its snapshots with the accounts that own
+    the given IAM roles.  A failure in one account does not affect the
+    others.
+
+    :param role_arns: ARNs of roles that brkt-cli can assume in the
+        target accounts
+    :param copy: if True, copy the AMI into each account
+    :return a list of AccountResult objects, in the same order as
+        role_arns
+    """
+    source_image = aws_svc.get_image(image_id, retry=True)
+    source_snapshots = copy_ami.get_source_snapshots(aws_svc, source_image)
+    results = [AccountResult(role_arn) for role_arn in role_arns]
+
+    account_ids = sorted(set(r.account_id for r in results))
+    log.info(
+        'Sharing %s with %d accounts', image_id, len(account_ids))
+    aws_svc.share_image(image_id, account_ids)
+
+    pool = util.WorkerPool(min(max_concurrent_accounts, len(results)))
+    try:
+        futures = [
+            pool.submit(
+                _share_with_account,
+                aws_svc, source_image, source_snapshots, copy, r)
+            for r in results
+        ]
+        for future in futures:
+            future.wait()
+    finally:
+        pool.shutdown(wait=False)
+
+    succeeded = len([r for r in results if r.succeeded])
+    log.info(
+        'Shared %s with %d of %d accounts',
+        image_id, succeeded, len(results))
+    return results
+
+
+def render_results(results):
+    """ Render the results as a table, with one row per account. """
+    rows = [['ACCOUNT', 'AMI', 'STATUS']]
+    for r in results:
+        if r.succeeded:
+            status = 'OK'
+        else:
+            status = 'FAILED: %s' % (r.error or 'unknown error')
+        rows.append([r.account_id, r.image_id or '-', status])
+    return util.render_table_rows(rows)
@@ -0,0 +1,105 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+
+from brkt_cli import validation
+from brkt_cli.aws import share_ami
+
+
+def _positive_int(value):
+    return validation.min_int_argument(value, 1)
+
+
+def setup_share_ami_args(parser):
+    parser.add_argument(
+        'ami',
+        metavar='ID',
+        help='The encrypted AMI that will be shared'
+    )
+    parser.add_argument(
+        '--role-arn',
+        metavar='ARN',
+        dest='role_arns',
+        action='append',
+        help=(
+            'Share the AMI with the account that owns this IAM role.  '
+            'brkt-cli assumes the role to tag or copy the AMI in that '
+            'account.  May be specified multiple times.'
+        )
+    )
+    parser.add_argument(
+        '--role-arn-file',
+        metavar='PATH',
+        dest='role_arn_file',
+        help='Read IAM role ARNs from this file, one per line'
+    )
+    parser.add_argument(
+        '--copy',
+        dest='copy',
+        action='store_true',
+        default=False,
+        help=(
+            'Copy the AMI into each account, instead of sharing the '
+            'original AMI'
+        )
+    )
+    parser.add_argument(
+        '--max-concurrent-accounts',
+        metavar='N',
+        type=_positive_int,
+        dest='max_concurrent_accounts',
+        help='Maximum number of accounts to process at the same time',
+        default=share_ami.DEFAULT_MAX_CONCURRENT_ACCOUNTS
+    )
+    parser.add_argument(
+        '--region',
+        metavar='NAME',
+        help='AWS region (e.g. us-west-2)',
+        dest='region',
+        required=True
+    )
+    parser.add_argument(
+        '--tag',
+        metavar='KEY=VALUE',
+        dest='tags',
+        action='append',
+        help=(
+            'Set an AWS tag on the AMI in each account.  May be specified '
+            'multiple times.'
+        )
+    )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        dest='aws_verbose',
+        action='store_true',
+        help='Print status information to the console'
+    )
+    # Optional arguments for changing the behavior of our retry logic.  We
+    # use these options internally, to avoid intermittent AWS service failures
+    # when running concurrent encryption processes in integration tests.
+    parser.add_argument(
+        '--retry-timeout',
+        metavar='SECONDS',
+        type=float,
+        help=argparse.SUPPRESS,
+        default=10.0
+    )
+    parser.add_argument(
+        '--retry-initial-sleep-seconds',
+        metavar='SECONDS',
+        type=float,
+        help=argparse.SUPPRESS,
+        default=0.25
+    )
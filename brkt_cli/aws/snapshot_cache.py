@@ -0,0 +1,196 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache snapshots of unencrypted guest root volumes.
+
+Encrypting an AMI starts by launching a guest instance, stopping it and
+snapshotting its root volume.  When the snapshot cache is enabled, that
+snapshot is kept after encryption and tagged with the source AMI id and
+root device.  Encrypting the same AMI again, for example with a new
+encryptor version, uses the cached snapshot instead of creating a new one.
+
+Cached snapshots expire after a TTL.  When the total size of the cached
+snapshots exceeds the limit, the oldest ones are deleted.
+
+Other sessions, in this process or another one, may be about to launch
+an encryptor from a cached snapshot.  Eviction never deletes a snapshot
+that is still pending, or that was added to the cache or returned by
+get() within the grace period.
+"""
+
+import logging
+import time
+
+from boto.exception import EC2ResponseError
+
+TAG_SOURCE_IMAGE = 'BrktCacheSourceImage'
+TAG_ROOT_DEVICE = 'BrktCacheRootDevice'
+TAG_CREATED = 'BrktCacheCreated'
+TAG_VOLUME_TYPE = 'BrktCacheVolumeType'
+TAG_IOPS = 'BrktCacheIops'
+TAG_LAST_USED = 'BrktCacheLastUsed'
+
+DEFAULT_TTL_DAYS = 7
+DEFAULT_MAX_SIZE_GB = 1024
+
+# Long enough for a session to launch the encryptor instance from the
+# snapshot that it got from the cache.
+DEFAULT_GRACE_SECONDS = 2 * 60 * 60
+
+log = logging.getLogger(__name__)
+
+
+class CachedSnapshot(object):
+    """ A snapshot of a guest root volume, and the attributes of the
+    volume that it was created from.
+    """
+    def __init__(self, snapshot_id, size, vol_type, iops=None):
+        self.snapshot_id = snapshot_id
+        self.size = size
+        self.vol_type = vol_type
+        self.iops = iops
+
+
+def _get_time_tag(snapshot, key):
+    try:
+        return int(snapshot.tags.get(key))
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_created_time(snapshot):
+    return _get_time_tag(snapshot, TAG_CREATED)
+
+
+class SnapshotCache(object):
+
+    def __init__(self, ttl_days=DEFAULT_TTL_DAYS,
+                 max_size_gb=DEFAULT_MAX_SIZE_GB,
+                 grace_seconds=DEFAULT_GRACE_SECONDS):
+        """
+        :param grace_seconds don't evict snapshots that were added to the
+            cache or used within this many seconds
+        """
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.max_size_gb = max_size_gb
+        self.grace_seconds = grace_seconds
+
+    def _is_expired(self, snapshot, now):
+        created = _get_created_time(snapshot)
+        return created is None or now - created > self.ttl_seconds
+
+    def _in_use(self, snapshot, now):
+        """ Return True if the snapshot may be in use by another session.
+        """
+        if snapshot.status != 'completed':
+            return True
+        for key in (TAG_CREATED, TAG_LAST_USED):
+            t = _get_time_tag(snapshot, key)
+            if t is not None and now - t < self.grace_seconds:
+                return True
+        return False
+
+    def get(self, aws_svc, image_id, root_device):
+        """ Return the newest cached snapshot of the given AMI's root
+        volume, or None if there is no usable snapshot in the cache.
+        """
+        snapshots = aws_svc.find_snapshots({
+            TAG_SOURCE_IMAGE: image_id,
+            TAG_ROOT_DEVICE: root_device
+        })
+        now = time.time()
+        snapshots = [
+            s for s in snapshots
+            if s.status == 'completed' and not self._is_expired(s, now)
+        ]
+        if not snapshots:
+            log.debug('No cached snapshot of %s', image_id)
+            return None
+
+        snapshot = max(snapshots, key=_get_created_time)
+        # Keep other sessions from evicting the snapshot while we launch
+        # the encryptor from it.
+        aws_svc.create_tags(
+            snapshot.id, tags={TAG_LAST_USED: str(int(now))})
+        iops = snapshot.tags.get(TAG_IOPS)
+        if iops:
+            iops = int(iops)
+        log.info(
+            'Using cached snapshot %s of the root volume of %s',
+            snapshot.id, image_id
+        )
+        return CachedSnapshot(
+            snapshot.id,
+            snapshot.volume_size,
+            snapshot.tags.get(TAG_VOLUME_TYPE),
+            iops=iops
+        )
+
+    def put(self, aws_svc, snapshot_id, image_id, root_device, vol_type,
+            iops=None):
+        """ Add the snapshot to the cache, and evict expired snapshots and
+        snapshots that don't fit.
+        """
+        tags = {
+            TAG_SOURCE_IMAGE: image_id,
+            TAG_ROOT_DEVICE: root_device,
+            TAG_CREATED: str(int(time.time())),
+            TAG_VOLUME_TYPE: vol_type
+        }
+        if iops:
+            tags[TAG_IOPS] = str(iops)
+        aws_svc.create_tags(snapshot_id, tags=tags)
+        log.info('Added snapshot %s of %s to the cache', snapshot_id, image_id)
+        self.evict(aws_svc, keep_snapshot_id=snapshot_id)
+
+    def evict(self, aws_svc, keep_snapshot_id=None):
+        """ Delete expired snapshots.  If the cache is still larger than
+        max_size_gb, delete the oldest snapshots until it fits.  Snapshots
+        that may be in use by another session are kept.
+
+        :param keep_snapshot_id never delete this snapshot
+        :return the ids of the deleted snapshots
+        """
+        snapshots = aws_svc.find_snapshots({TAG_SOURCE_IMAGE: None})
+        now = time.time()
+
+        evicted = []
+        total_size = 0
+        # Newest first, so that we keep the most recent snapshots.
+        snapshots.sort(key=lambda s: _get_created_time(s) or 0, reverse=True)
+        for snapshot in snapshots:
+            if (snapshot.id == keep_snapshot_id or
+                    self._in_use(snapshot, now)):
+                total_size += snapshot.volume_size or 0
+                continue
+            if self._is_expired(snapshot, now):
+                evicted.append(snapshot)
+                continue
+            if total_size + (snapshot.volume_size or 0) > self.max_size_gb:
+                evicted.append(snapshot)
+                continue
+            total_size += snapshot.volume_size or 0
+
+        for snapshot in evicted:
+            log.info(
+                'Evicting snapshot %s of %s from the cache',
+                snapshot.id, snapshot.tags.get(TAG_SOURCE_IMAGE)
+            )
+            try:
+                aws_svc.delete_snapshot(snapshot.id)
+            except EC2ResponseError as e:
+                log.warn('Unable to delete snapshot %s: %s', snapshot.id, e)
+
+        return [s.id for s in evicted]
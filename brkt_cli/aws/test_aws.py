@@ -12,6 +12,7 @@
 # License for the specific language governing permissions and
 # limitations under the License.
 import inspect
+import tempfile
 import unittest
 
 from boto.ec2.blockdevicemapping import BlockDeviceType, BlockDeviceMapping
@@ -38,6 +39,7 @@ class DummyValues(object):
         self.security_group_ids = []
         self.validate = True
         self.ami = None
+        self.ami_file = None
         self.encryptor_ami = None
         self.proxies = []
         self.proxy_config_file = None
@@ -247,6 +249,35 @@ class TestValidation(unittest.TestCase):
             brkt_cli.aws._get_updated_image_name('x' * 128, '123')
         )
 
+    def test_get_guest_image_ids(self):
+        """ Test reading guest AMI IDs from the command line and from
+        the file specified by --ami-file.
+        """
+        values = DummyValues()
+        values.ami = ['ami-1', 'ami-2']
+        self.assertEqual(
+            ['ami-1', 'ami-2'], brkt_cli.aws._get_guest_image_ids(values))
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write('ami-3\n\n# Comment\n  ami-4  \n')
+            f.flush()
+            values.ami_file = f.name
+            self.assertEqual(
+                ['ami-1', 'ami-2', 'ami-3', 'ami-4'],
+                brkt_cli.aws._get_guest_image_ids(values)
+            )
+
+        # No AMIs.
+        values.ami = []
+        values.ami_file = None
+        with self.assertRaises(ValidationError):
+            brkt_cli.aws._get_guest_image_ids(values)
+
+        # Unreadable file.
+        values.ami_file = 'nothing_here.txt'
+        with self.assertRaises(ValidationError):
+            brkt_cli.aws._get_guest_image_ids(values)
+
     def test_validate_region(self):
         aws_svc = test_aws_service.DummyAWSService()
 
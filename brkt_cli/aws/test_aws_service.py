@@ -51,6 +51,7 @@ class RunInstanceArgs(object):
         self.security_group_ids = None
         self.subnet_id = None
         self.user_data = None
+        self.block_device_map = None
         self.instance = None
 
 
@@ -68,6 +69,10 @@ class DummyAWSService(aws_service.BaseAWSService):
         self.tagged_volumes = []
         self.subnets = {}
         self.security_groups = {}
+        self.create_tags_calls = 0
+        # Fast snapshot restore state, keyed by (snapshot id, zone).
+        self.fast_snapshot_restores = {}
+        self.fast_snapshot_restore_supported = True
         self.region = 'us-west-2'
         self.regions = [
             RegionInfo(name='us-west-2'),
@@ -93,6 +98,9 @@ class DummyAWSService(aws_service.BaseAWSService):
         self.create_tags_callback = None
         self.terminate_instance_callback = None
         self.delete_security_group_callback = None
+        self.copy_image_callback = None
+        self.connect_as_callback = None
+        self.share_image_callback = None
 
     def get_regions(self):
         return self.regions
@@ -100,6 +108,11 @@ class DummyAWSService(aws_service.BaseAWSService):
     def connect(self, region, key_name=None):
         self.region = region
 
+    def connect_as(self, role, region, session_name):
+        self.region = region
+        if self.connect_as_callback:
+            self.connect_as_callback(role, region, session_name)
+
     def run_instance(self,
                      image_id,
                      security_group_ids=None,
@@ -141,6 +154,7 @@ class DummyAWSService(aws_service.BaseAWSService):
             args.security_group_ids = security_group_ids
             args.subnet_id = subnet_id
             args.user_data = user_data
+            args.block_device_map = block_device_map
             args.instance = instance
             self.run_instance_callback(args)
 
@@ -163,10 +177,20 @@ class DummyAWSService(aws_service.BaseAWSService):
                 self.transition_to_running[instance_id] = True
         return instance
 
-    def create_tags(self, resource_id, name=None, description=None):
-        if self.create_tags_callback:
-            self.create_tags_callback(resource_id, name, description)
-        pass
+    def create_tags(self, resource_id, name=None, description=None,
+                    tags=None):
+        self.create_tags_calls += 1
+        resource_ids = resource_id
+        if not isinstance(resource_id, list):
+            resource_ids = [resource_id]
+        for resource_id in resource_ids:
+            if self.create_tags_callback:
+                self.create_tags_callback(resource_id, name, description)
+            resource = (
+                self.snapshots.get(resource_id) or
+                self.images.get(resource_id))
+            if resource and tags:
+                resource.tags.update(tags)
 
     def stop_instance(self, instance_id):
         instance = self.instances[instance_id]
@@ -195,7 +219,12 @@ class DummyAWSService(aws_service.BaseAWSService):
             self.get_volume_callback(volume)
         return volume
 
-    def get_volumes(self, tag_key=None, tag_value=None):
+    def get_instances(self, *instance_ids):
+        return [self.get_instance(id) for id in instance_ids]
+
+    def get_volumes(self, tag_key=None, tag_value=None, volume_ids=None):
+        if volume_ids:
+            return [self.get_volume(id) for id in volume_ids]
         if tag_key and tag_value:
             return self.tagged_volumes
         else:
@@ -222,10 +251,25 @@ class DummyAWSService(aws_service.BaseAWSService):
 
         return snapshot
 
+    def find_snapshots(self, tags):
+        snapshots = []
+        for snapshot in self.snapshots.values():
+            for key, value in tags.iteritems():
+                if key not in snapshot.tags:
+                    break
+                if value is not None and snapshot.tags[key] != value:
+                    break
+            else:
+                snapshots.append(snapshot)
+        return snapshots
+
     def create_snapshot(self, volume_id, name=None, description=None):
         snapshot = Snapshot()
         snapshot.id = new_id()
         snapshot.status = 'pending'
+        volume = self.volumes.get(volume_id)
+        if volume:
+            snapshot.volume_size = volume.size
         self.snapshots[snapshot.id] = snapshot
 
         if self.create_snapshot_callback:
@@ -255,6 +299,34 @@ class DummyAWSService(aws_service.BaseAWSService):
         self.images[image.id] = image
         return image.id
 
+    def copy_image(self, source_region, source_image_id, name=None,
+                   description=None):
+        source = self.get_image(source_image_id)
+        image = Image()
+        image.id = 'ami-' + new_id()
+        image.block_device_mapping = BlockDeviceMapping()
+        for device, bdt in source.block_device_mapping.iteritems():
+            snapshot = Snapshot()
+            snapshot.id = 'snap-' + new_id()
+            snapshot.status = 'completed'
+            self.snapshots[snapshot.id] = snapshot
+            image.block_device_mapping[device] = BlockDeviceType(
+                snapshot_id=snapshot.id, size=bdt.size)
+        image.state = 'available'
+        image.name = name
+        image.description = description
+        image.virtualization_type = source.virtualization_type
+        image.root_device_name = source.root_device_name
+        self.images[image.id] = image
+        if self.copy_image_callback:
+            self.copy_image_callback(source_region, source_image_id, image)
+        return image.id
+
+    def share_image(self, image_id, account_ids):
+        self.get_image(image_id)
+        if self.share_image_callback:
+            self.share_image_callback(image_id, account_ids)
+
     def create_volume(self, size, zone, **kwargs):
         volume = Volume()
         volume.id = 'vol-' + new_id()
@@ -355,6 +427,25 @@ class DummyAWSService(aws_service.BaseAWSService):
             return dict()
         return None
 
+    def enable_fast_snapshot_restore(self, snapshot_id, zone):
+        if not self.fast_snapshot_restore_supported:
+            return None
+        self.fast_snapshot_restores[(snapshot_id, zone)] = \
+            aws_service.FSR_ENABLING
+        return aws_service.FSR_ENABLING
+
+    def get_fast_snapshot_restore_state(self, snapshot_id, zone):
+        key = (snapshot_id, zone)
+        state = self.fast_snapshot_restores.get(key)
+        if state == aws_service.FSR_ENABLING:
+            # Finish enabling the next time the state is checked.
+            self.fast_snapshot_restores[key] = aws_service.FSR_ENABLED
+        return state
+
+    def disable_fast_snapshot_restore(self, snapshot_id, zone):
+        self.fast_snapshot_restores.pop((snapshot_id, zone), None)
+        return aws_service.FSR_DISABLING
+
     def retry(self, function, error_code_regexp=None, timeout=None):
         return aws_service.retry_boto(
             function,
@@ -489,6 +580,71 @@ class TestInstance(unittest.TestCase):
             self.assertTrue('unexpectedly terminated' in e.message)
 
 
+    def test_wait_for_instance_timeout(self):
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        instance = aws_svc.run_instance(guest_image.id)
+        with self.assertRaises(encrypt_ami.InstanceError):
+            encrypt_ami.wait_for_instance(
+                aws_svc, instance.id, state='stopped', timeout=0)
+
+
+class TestWaiters(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        self.num_calls = 0
+
+    def test_wait_for_snapshots_not_found(self):
+        """ Test that we keep waiting when AWS hasn't propagated the
+        snapshot yet.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        instance = aws_svc.run_instance(guest_image.id)
+        volume_id = instance.block_device_mapping['/dev/sda1'].volume_id
+        snapshot = aws_svc.create_snapshot(volume_id, 'test')
+
+        def get_snapshot_callback(s):
+            self.num_calls += 1
+            if self.num_calls < 3:
+                e = EC2ResponseError(None, None)
+                e.error_code = 'InvalidSnapshot.NotFound'
+                raise e
+
+        aws_svc.get_snapshot_callback = get_snapshot_callback
+        encrypt_ami.wait_for_snapshots(aws_svc, snapshot.id)
+        self.assertEqual('completed', snapshot.status)
+        self.assertTrue(self.num_calls >= 3)
+
+    def test_wait_for_image_not_found(self):
+        """ Test that we keep waiting when the image is not found or AWS
+        returns an unexpected error.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        original_get_image = aws_svc.get_image
+
+        def get_image(image_id, retry=False):
+            self.num_calls += 1
+            if self.num_calls < 3:
+                e = EC2ResponseError(None, None)
+                if self.num_calls == 1:
+                    e.error_code = 'InvalidAMIID.NotFound'
+                else:
+                    e.error_code = 'InternalError'
+                raise e
+            return original_get_image(image_id)
+
+        aws_svc.get_image = get_image
+        image = encrypt_ami.wait_for_image(aws_svc, guest_image.id)
+        self.assertEqual(guest_image, image)
+        self.assertEqual(3, self.num_calls)
+
+    def test_wait_for_image_failed(self):
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        guest_image.state = 'failed'
+        with self.assertRaises(brkt_cli.util.BracketError):
+            encrypt_ami.wait_for_image(aws_svc, guest_image.id)
+
+
 class TestCustomTags(unittest.TestCase):
 
     def test_tag_validation(self):
@@ -508,6 +664,41 @@ class TestCustomTags(unittest.TestCase):
         with self.assertRaises(ValidationError):
             aws_service.validate_tag_value('aws:foobar')
 
+    def test_tag_batch(self):
+        """ Test that TagBatch tags resources that get the same tags with
+        one call.
+        """
+        aws_svc, _, _ = build_aws_service()
+        snapshots = [Snapshot(), Snapshot(), Snapshot()]
+        for snapshot in snapshots:
+            snapshot.id = 'snap-' + new_id()
+            aws_svc.snapshots[snapshot.id] = snapshot
+
+        with aws_service.TagBatch(aws_svc) as batch:
+            batch.add(snapshots[0].id, tags={'a': '1'})
+            batch.add(snapshots[1].id, tags={'a': '1'})
+            batch.add(snapshots[2].id, tags={'a': '2'})
+            self.assertEqual(0, aws_svc.create_tags_calls)
+
+        self.assertEqual(2, aws_svc.create_tags_calls)
+        self.assertEqual(
+            ['1', '1', '2'], [s.tags['a'] for s in snapshots])
+
+    def test_tag_batch_exception(self):
+        """ Test that collected tags are applied when the block raises
+        an exception, and that the exception isn't hidden.
+        """
+        aws_svc, _, _ = build_aws_service()
+        snapshot = Snapshot()
+        snapshot.id = 'snap-' + new_id()
+        aws_svc.snapshots[snapshot.id] = snapshot
+
+        with self.assertRaises(TestException):
+            with aws_service.TagBatch(aws_svc) as batch:
+                batch.add(snapshot.id, tags={'a': '1'})
+                raise TestException()
+        self.assertEqual('1', snapshot.tags['a'])
+
 
 class TestVolume(unittest.TestCase):
 
@@ -536,3 +727,159 @@ class TestVolume(unittest.TestCase):
         aws_svc.get_volume_callback = transition_to_available
         result = aws_service.wait_for_volume(aws_svc, volume.id)
         self.assertEqual(volume, result)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self.reason = 'Test'
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class FakeQueryConnection(object):
+    """ Returns canned responses to EC2 query API calls. """
+
+    ResponseError = EC2ResponseError
+
+    def __init__(self, status, body):
+        self.response = FakeResponse(status, body)
+        self.requests = []
+
+    def make_request(self, action, params, verb='GET'):
+        self.requests.append((action, params))
+        return self.response
+
+
+FSR_XML = (
+    '<%(action)sResponse '
+    'xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">'
+    '<requestId>1</requestId>%(body)s</%(action)sResponse>'
+)
+
+
+class TestFastSnapshotRestore(unittest.TestCase):
+
+    def _aws_svc(self, status, action, body):
+        aws_svc = aws_service.AWSService('test')
+        aws_svc.region = 'us-west-2'
+        self.conn = FakeQueryConnection(
+            status, FSR_XML % {'action': action, 'body': body})
+        aws_svc._query_connection = lambda: self.conn
+        return aws_svc
+
+    def test_enable(self):
+        aws_svc = self._aws_svc(200, 'EnableFastSnapshotRestores', (
+            '<successful><item><snapshotId>snap-1</snapshotId>'
+            '<availabilityZone>us-west-2a</availabilityZone>'
+            '<state>enabling</state></item></successful>'
+            '<unsuccessful/>'
+        ))
+        self.assertEqual(
+            aws_service.FSR_ENABLING,
+            aws_svc.enable_fast_snapshot_restore('snap-1', 'us-west-2a'))
+        action, params = self.conn.requests[0]
+        self.assertEqual('EnableFastSnapshotRestores', action)
+        self.assertEqual('snap-1', params['SourceSnapshotId.1'])
+        self.assertEqual('us-west-2a', params['AvailabilityZone.1'])
+
+    def test_enable_unsuccessful(self):
+        aws_svc = self._aws_svc(200, 'EnableFastSnapshotRestores', (
+            '<successful/><unsuccessful><item>'
+            '<snapshotId>snap-1</snapshotId>'
+            '<fastSnapshotRestoreStateErrorSet><item>'
+            '<availabilityZone>us-west-2a</availabilityZone>'
+            '<error><code>InvalidParameterValue</code>'
+            '<message>Not supported</message></error>'
+            '</item></fastSnapshotRestoreStateErrorSet>'
+            '</item></unsuccessful>'
+        ))
+        self.assertIsNone(
+            aws_svc.enable_fast_snapshot_restore('snap-1', 'us-west-2a'))
+
+    def test_describe(self):
+        aws_svc = self._aws_svc(200, 'DescribeFastSnapshotRestores', (
+            '<fastSnapshotRestoreSet><item>'
+            '<snapshotId>snap-1</snapshotId>'
+            '<availabilityZone>us-west-2a</availabilityZone>'
+            '<state>enabled</state>'
+            '</item></fastSnapshotRestoreSet>'
+        ))
+        self.assertEqual(
+            aws_service.FSR_ENABLED,
+            aws_svc.get_fast_snapshot_restore_state('snap-1', 'us-west-2a'))
+        _, params = self.conn.requests[0]
+        self.assertEqual('snapshot-id', params['Filter.1.Name'])
+        self.assertEqual('snap-1', params['Filter.1.Value.1'])
+        self.assertEqual('us-west-2a', params['Filter.2.Value.1'])
+
+    def test_describe_not_enabled(self):
+        aws_svc = self._aws_svc(
+            200, 'DescribeFastSnapshotRestores', '<fastSnapshotRestoreSet/>')
+        self.assertIsNone(
+            aws_svc.get_fast_snapshot_restore_state('snap-1', 'us-west-2a'))
+
+    def test_error(self):
+        aws_svc = aws_service.AWSService('test')
+        aws_svc.region = 'us-west-2'
+        self.conn = FakeQueryConnection(403, (
+            '<Response><Errors><Error>'
+            '<Code>UnauthorizedOperation</Code>'
+            '<Message>Not authorized</Message>'
+            '</Error></Errors><RequestID>1</RequestID></Response>'
+        ))
+        aws_svc._query_connection = lambda: self.conn
+        with self.assertRaises(EC2ResponseError) as cm:
+            aws_svc.disable_fast_snapshot_restore('snap-1', 'us-west-2a')
+        self.assertEqual('UnauthorizedOperation', cm.exception.error_code)
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.num_connections = 0
+
+    def _connect_to_region(self, region, **kwargs):
+        self.num_connections += 1
+        if region == 'invalid':
+            return None
+        return (region, kwargs.get('aws_access_key_id'))
+
+    def test_reuse(self):
+        """ Test that there is one connection per region and set of
+        credentials.
+        """
+        connections = aws_service.ConnectionManager()
+        c1 = connections.get(self._connect_to_region, 'us-west-2')
+        c2 = connections.get(self._connect_to_region, 'us-west-2')
+        self.assertIs(c1, c2)
+        self.assertEqual(1, self.num_connections)
+
+        c3 = connections.get(self._connect_to_region, 'us-east-1')
+        c4 = connections.get(
+            self._connect_to_region, 'us-west-2', aws_access_key_id='key')
+        self.assertEqual(('us-east-1', None), c3)
+        self.assertEqual(('us-west-2', 'key'), c4)
+        self.assertEqual(3, self.num_connections)
+
+    def test_threads(self):
+        """ Test that concurrent callers share one connection. """
+        connections = aws_service.ConnectionManager()
+        pool = brkt_cli.util.WorkerPool(8)
+        futures = [
+            pool.submit(
+                connections.get, self._connect_to_region, 'us-west-2')
+            for _ in range(32)
+        ]
+        results = [f.result(timeout=10) for f in futures]
+        pool.shutdown()
+        self.assertEqual(1, self.num_connections)
+        self.assertEqual(1, len(set(id(r) for r in results)))
+
+    def test_unknown_region(self):
+        connections = aws_service.ConnectionManager()
+        with self.assertRaises(ValidationError):
+            connections.get(self._connect_to_region, 'invalid')
@@ -0,0 +1,122 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest
+
+import brkt_cli.util
+from brkt_cli.aws import copy_ami, encrypt_ami, rate_limiter
+from brkt_cli.aws.test_aws_service import build_aws_service
+from brkt_cli.test_encryptor_service import DummyEncryptorService
+
+
+class TestCopyAMI(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def _encrypt(self):
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encrypted_image_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        return aws_svc, encrypted_image_id
+
+    def test_copy_to_regions(self):
+        """ Test that the encrypted AMI is copied to each region, and that
+        its tags and snapshot tags are copied.
+        """
+        aws_svc, image_id = self._encrypt()
+        self.copies = []
+
+        def copy_image_callback(source_region, source_image_id, image):
+            self.assertEqual(aws_svc.region, source_region)
+            self.assertEqual(image_id, source_image_id)
+            self.copies.append(image.id)
+
+        aws_svc.copy_image_callback = copy_image_callback
+
+        results = copy_ami.copy_to_regions(
+            aws_svc, image_id, ['us-west-1', 'eu-west-1'])
+        self.assertEqual(['us-west-1', 'eu-west-1'],
+                         [r.region for r in results])
+        self.assertTrue(all(r.succeeded for r in results))
+        self.assertEqual(
+            sorted(self.copies), sorted(r.image_id for r in results))
+
+        source = aws_svc.get_image(image_id)
+        for r in results:
+            copy = aws_svc.get_image(r.image_id)
+            self.assertEqual(source.name, copy.name)
+            self.assertEqual(
+                source.tags[encrypt_ami.TAG_SOURCE_AMI],
+                copy.tags[encrypt_ami.TAG_SOURCE_AMI])
+            for device, bdt in source.block_device_mapping.iteritems():
+                if not bdt.snapshot_id:
+                    continue
+                source_snapshot = aws_svc.get_snapshot(bdt.snapshot_id)
+                snapshot = aws_svc.get_snapshot(
+                    copy.block_device_mapping[device].snapshot_id)
+                self.assertEqual(source_snapshot.tags, snapshot.tags)
+
+        self.assertIn('us-west-1', copy_ami.render_results(
+            aws_svc.region, image_id, results))
+
+    def test_limiter_per_region(self):
+        """ Test that the copy in each region has its own rate limiter. """
+        aws_svc, image_id = self._encrypt()
+        aws_svc.limiter = rate_limiter.RateLimiter()
+        clone = aws_svc.clone
+        clones = []
+
+        def _clone(session_id):
+            svc = clone(session_id)
+            clones.append(svc)
+            return svc
+        aws_svc.clone = _clone
+
+        copy_ami.copy_to_regions(
+            aws_svc, image_id, ['us-west-1', 'eu-west-1'])
+        limiters = set(id(svc.limiter) for svc in clones)
+        self.assertEqual(2, len(limiters))
+        self.assertNotIn(id(aws_svc.limiter), limiters)
+
+    def test_copy_failure(self):
+        """ Test that a failure to copy to one region is reported and
+        doesn't affect the other regions.
+        """
+        aws_svc, image_id = self._encrypt()
+
+        lock = threading.Lock()
+        self.fail_next = True
+
+        def copy_image_callback(source_region, source_image_id, image):
+            with lock:
+                fail, self.fail_next = self.fail_next, False
+            if fail:
+                raise Exception('Copy failed')
+
+        aws_svc.copy_image_callback = copy_image_callback
+
+        results = copy_ami.copy_to_regions(
+            aws_svc, image_id, ['us-west-1', 'eu-west-1'])
+        failed = [r for r in results if not r.succeeded]
+        self.assertEqual(1, len(failed))
+        self.assertIn('Copy failed', str(failed[0].error))
+        self.assertEqual(1, len([r for r in results if r.succeeded]))
+
+        output = copy_ami.render_results(aws_svc.region, image_id, results)
+        self.assertIn('FAILED: Copy failed', output)
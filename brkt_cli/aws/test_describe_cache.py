@@ -0,0 +1,117 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest
+
+from boto.ec2.blockdevicemapping import (
+    BlockDeviceMapping,
+    BlockDeviceType
+)
+from boto.ec2.image import Image
+from boto.ec2.instance import Instance
+from boto.ec2.snapshot import Snapshot
+
+from brkt_cli.aws import describe_cache
+from brkt_cli.aws.test_aws_service import new_id
+
+
+def _image(state):
+    image = Image()
+    image.id = 'ami-' + new_id()
+    image.state = state
+    return image
+
+
+def _snapshot(status):
+    snapshot = Snapshot()
+    snapshot.id = 'snap-' + new_id()
+    snapshot.status = status
+    return snapshot
+
+
+class TestDescribeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = describe_cache.DescribeCache(clock=lambda: self.now)
+
+    def test_stable_resources(self):
+        """ Test that available images and completed snapshots are cached
+        until their TTL expires.
+        """
+        image = _image('available')
+        snapshot = _snapshot('completed')
+        self.cache.put(image, snapshot)
+        self.assertEqual(image.id, self.cache.get(image.id).id)
+        self.assertEqual(snapshot.id, self.cache.get(snapshot.id).id)
+        self.assertEqual(2, self.cache.hits)
+
+        self.now += describe_cache.STABLE_TTL_SECONDS
+        self.assertIsNone(self.cache.get(image.id))
+        self.assertIsNone(self.cache.get(snapshot.id))
+        self.assertEqual(2, self.cache.misses)
+
+    def test_transitional_resources(self):
+        """ Test that instances and pending snapshots expire quickly, and
+        that pending images aren't cached.
+        """
+        instance = Instance()
+        instance.id = 'i-' + new_id()
+        snapshot = _snapshot('pending')
+        image = _image('pending')
+        self.cache.put(instance, snapshot, image)
+        self.assertEqual(instance.id, self.cache.get(instance.id).id)
+        self.assertEqual(snapshot.id, self.cache.get(snapshot.id).id)
+        self.assertIsNone(self.cache.get(image.id))
+
+        self.now += describe_cache.TRANSITIONAL_TTL_SECONDS
+        self.assertIsNone(self.cache.get(instance.id))
+        self.assertIsNone(self.cache.get(snapshot.id))
+
+    def test_state_change(self):
+        """ Test that a newer describe result replaces the cached one, and
+        that an uncacheable state removes it.
+        """
+        image = _image('available')
+        self.cache.put(image)
+        updated = _image('failed')
+        updated.id = image.id
+        self.cache.put(updated)
+        self.assertIsNone(self.cache.get(image.id))
+
+    def test_copies(self):
+        """ Test that changes to a resource that was put in the cache, or
+        returned by it, don't change the cached copy.
+        """
+        instance = Instance(connection=threading.Lock())
+        instance.id = 'i-' + new_id()
+        bdm = BlockDeviceMapping()
+        bdm['/dev/sda1'] = BlockDeviceType(volume_id='vol-1')
+        instance.block_device_mapping = bdm
+        self.cache.put(instance)
+        instance.block_device_mapping['/dev/sda1'].volume_type = 'io1'
+
+        cached = self.cache.get(instance.id)
+        self.assertIsNone(cached.block_device_mapping['/dev/sda1'].volume_type)
+        # The connection is shared.
+        self.assertIs(instance.connection, cached.connection)
+        del cached.block_device_mapping['/dev/sda1']
+        self.assertIn(
+            '/dev/sda1', self.cache.get(instance.id).block_device_mapping)
+
+    def test_invalidate(self):
+        image = _image('available')
+        self.cache.put(image)
+        self.cache.invalidate(image.id, 'snap-unknown')
+        self.assertIsNone(self.cache.get(image.id))
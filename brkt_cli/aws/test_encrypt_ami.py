@@ -14,18 +14,25 @@
 import email
 import json
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 import zlib
 
+from boto.ec2.blockdevicemapping import (
+    BlockDeviceMapping,
+    BlockDeviceType
+)
 from boto.ec2.snapshot import Snapshot
-from boto.ec2.volume import Volume
+from boto.ec2.volume import AttachmentSet, Volume
 from boto.exception import EC2ResponseError
 from boto.vpc import Subnet
 
 import brkt_cli
 import brkt_cli.aws
 import brkt_cli.util
-from brkt_cli import ValidationError, encryptor_service
+from brkt_cli import ValidationError, encryptor_service, journal, trace
 from brkt_cli.aws import aws_service, encrypt_ami, update_ami
 from brkt_cli.aws import test_aws_service
 from brkt_cli.aws.test_aws_service import build_aws_service
@@ -310,6 +317,199 @@ class TestRunEncryption(unittest.TestCase):
             guest_instance_type='t2.micro'
         )
 
+    def test_encrypted_volume_type(self):
+        """ Test that the encrypted root volume is launched with the
+        specified volume type and IOPS.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.bdm = None
+
+        def run_instance_callback(args):
+            if args.image_id == encryptor_image.id:
+                self.bdm = args.block_device_map
+
+        aws_svc.run_instance_callback = run_instance_callback
+        encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id,
+            encrypted_volume_type='io1',
+            encrypted_volume_iops=500
+        )
+        self.assertEqual('io1', self.bdm['/dev/sdg'].volume_type)
+        self.assertEqual(500, self.bdm['/dev/sdg'].iops)
+        self.assertEqual('gp2', self.bdm['/dev/sdf'].volume_type)
+
+    def _run_encryptor_with_fsr(self, aws_svc, encryptor_image,
+                                guest_image):
+        """ Launch the encryptor instance with fast snapshot restore, and
+        return the state of fast snapshot restore when run_instance() was
+        called.
+        """
+        snapshot_id = 'snap-guest'
+        self.fsr_states = []
+
+        def run_instance_callback(args):
+            self.fsr_states.append(
+                aws_svc.fast_snapshot_restores.get(
+                    (snapshot_id, 'us-west-2a')))
+
+        aws_svc.run_instance_callback = run_instance_callback
+        encrypt_ami._run_encryptor_instance(
+            aws_svc, encryptor_image.id, snapshot_id, 8, guest_image.id,
+            security_group_ids=['sg-1'], zone='us-west-2a',
+            fast_snapshot_restore=True
+        )
+        return snapshot_id
+
+    def test_fast_snapshot_restore(self):
+        """ Test that fast snapshot restore is enabled while the encryptor
+        instance is launched, and disabled afterwards.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        snapshot_id = self._run_encryptor_with_fsr(
+            aws_svc, encryptor_image, guest_image)
+        self.assertEqual([aws_service.FSR_ENABLED], self.fsr_states)
+        self.assertNotIn(
+            (snapshot_id, 'us-west-2a'), aws_svc.fast_snapshot_restores)
+
+    def test_fast_snapshot_restore_already_enabled(self):
+        """ Test that we don't disable fast snapshot restore if it was
+        already enabled.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        key = ('snap-guest', 'us-west-2a')
+        aws_svc.fast_snapshot_restores[key] = aws_service.FSR_ENABLED
+        self._run_encryptor_with_fsr(aws_svc, encryptor_image, guest_image)
+        self.assertEqual(
+            aws_service.FSR_ENABLED, aws_svc.fast_snapshot_restores[key])
+
+    def test_fast_snapshot_restore_unavailable(self):
+        """ Test that the encryptor is launched without fast snapshot
+        restore when it can't be enabled.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        aws_svc.fast_snapshot_restore_supported = False
+        self._run_encryptor_with_fsr(aws_svc, encryptor_image, guest_image)
+        self.assertEqual([None], self.fsr_states)
+
+    def test_detach_failure(self):
+        """ Test that the encrypted root snapshot is deleted if the
+        Metavisor root volume can't be detached.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+
+        def _detach_volume(volume_id, **kwargs):
+            raise brkt_cli.util.BracketError('Test')
+
+        aws_svc.detach_volume = _detach_volume
+        encryptor_instance = aws_svc.run_instance(encryptor_image.id)
+        with self.assertRaises(brkt_cli.util.BracketError):
+            encrypt_ami.snapshot_encrypted_instance(
+                aws_svc, DummyEncryptorService, encryptor_instance,
+                encryptor_image, image_id=guest_image.id)
+        self.assertEqual({}, aws_svc.snapshots)
+
+    def test_fast_snapshot_restore_interrupted(self):
+        """ Test that fast snapshot restore is disabled and the temporary
+        security group is deleted if we're interrupted while waiting for
+        fast snapshot restore.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.deleted_sg_ids = []
+
+        def delete_security_group_callback(sg_id):
+            self.deleted_sg_ids.append(sg_id)
+
+        def _get_state(snapshot_id, zone):
+            if aws_svc.fast_snapshot_restores:
+                raise KeyboardInterrupt()
+            return None
+
+        aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+        aws_svc.get_fast_snapshot_restore_state = _get_state
+        with self.assertRaises(KeyboardInterrupt):
+            encrypt_ami._run_encryptor_instance(
+                aws_svc, encryptor_image.id, 'snap-guest', 8,
+                guest_image.id, zone='us-west-2a',
+                fast_snapshot_restore=True
+            )
+        self.assertEqual({}, aws_svc.fast_snapshot_restores)
+        self.assertEqual(1, len(self.deleted_sg_ids))
+        self.assertEqual({}, aws_svc.instances)
+
+    def test_fast_snapshot_restore_timeout(self):
+        """ Test that the encryptor is launched without fast snapshot
+        restore if it isn't enabled in time.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        aws_svc.get_fast_snapshot_restore_state = \
+            lambda snapshot_id, zone: aws_service.FSR_OPTIMIZING
+        self.assertFalse(
+            encrypt_ami._wait_for_fast_snapshot_restore(
+                aws_svc, 'snap-guest', 'us-west-2a', timeout=0)
+        )
+
+    def test_get_encrypted_volume_type(self):
+        """ Test that the volume type and IOPS are adjusted to the EBS
+        limits for the size of the volume.
+        """
+        self.assertEqual(
+            ('gp2', None),
+            encrypt_ami.get_encrypted_volume_type('gp2', None, 17))
+        self.assertEqual(
+            ('gp2', None),
+            encrypt_ami.get_encrypted_volume_type('st1', None, 17))
+        self.assertEqual(
+            ('st1', None),
+            encrypt_ami.get_encrypted_volume_type('st1', None, 501))
+        self.assertEqual(
+            ('io1', 850),
+            encrypt_ami.get_encrypted_volume_type('io1', 1000, 17))
+        self.assertEqual(
+            ('io1', 850),
+            encrypt_ami.get_encrypted_volume_type('io1', None, 17))
+        self.assertEqual(
+            ('io1', 1000),
+            encrypt_ami.get_encrypted_volume_type('io1', 1000, 401))
+        self.assertEqual(
+            ('io1', encrypt_ami.MIN_IO1_IOPS),
+            encrypt_ami.get_encrypted_volume_type('io1', 10, 401))
+
+    def test_detach_during_snapshot(self):
+        """ Test that the Metavisor root volume is detached while the
+        encrypted root volume is being snapshotted.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.events = []
+        get_snapshot = aws_svc.get_snapshot
+
+        def _get_snapshot(snapshot_id):
+            snapshot = get_snapshot(snapshot_id)
+            if snapshot.status == 'pending':
+                self.events.append('snapshot pending')
+            return snapshot
+
+        detach_volume = aws_svc.detach_volume
+
+        def _detach_volume(volume_id, **kwargs):
+            self.events.append('detach')
+            return detach_volume(volume_id, **kwargs)
+
+        aws_svc.get_snapshot = _get_snapshot
+        aws_svc.detach_volume = _detach_volume
+        encryptor_instance = aws_svc.run_instance(encryptor_image.id)
+        mv_root_id, _ = encrypt_ami.snapshot_encrypted_instance(
+            aws_svc, DummyEncryptorService, encryptor_instance,
+            encryptor_image, image_id=guest_image.id)
+        self.assertEqual(
+            encryptor_instance.block_device_mapping['/dev/sda1'].volume_id,
+            mv_root_id)
+        self.assertIn('detach', self.events)
+        self.assertIn('snapshot pending', self.events)
+
     def test_terminate_guest(self):
         """ Test that we terminate the guest instance if an exception is
         raised while waiting for it to come up.
@@ -360,6 +560,74 @@ class TestRunEncryption(unittest.TestCase):
             mv_root_id=mv_root_volume_id
         )
 
+    def test_register_ami_no_wait(self):
+        """ Test that register_ami() returns a future when wait=False, and
+        that the image and its snapshots are each described once.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encryptor_instance = aws_svc.run_instance(encryptor_image.id)
+        guest_instance = aws_svc.run_instance(guest_image.id)
+        mv_bdm = encryptor_instance.block_device_mapping
+        mv_root_volume_id = mv_bdm['/dev/sda1'].volume_id
+
+        get_snapshots = aws_svc.get_snapshots
+        calls = []
+
+        def _get_snapshots(*snapshot_ids):
+            calls.append(snapshot_ids)
+            return get_snapshots(*snapshot_ids)
+        aws_svc.get_snapshots = _get_snapshots
+
+        get_image = aws_svc.get_image
+        image_calls = []
+
+        def _get_image(image_id, retry=False):
+            image_calls.append(image_id)
+            return get_image(image_id, retry=retry)
+        aws_svc.get_image = _get_image
+
+        future = encrypt_ami.register_ami(
+            aws_svc,
+            encryptor_instance,
+            encryptor_image,
+            'Name',
+            'Description',
+            legacy=False,
+            guest_instance=guest_instance,
+            mv_root_id=mv_root_volume_id,
+            wait=False
+        )
+        ami_info = future.result(timeout=10)
+        self.assertIn(ami_info['ami'], aws_svc.images)
+        self.assertEqual(1, image_calls.count(ami_info['ami']))
+        self.assertTrue(len(calls) <= 1)
+        self.assertEqual(
+            sum(len(ids) for ids in calls),
+            len(ami_info['volume_device_map'])
+        )
+
+    def test_volume_device_map_shared_snapshot(self):
+        """ Test that devices that share a snapshot each get an entry in
+        the volume device map, in the device order of the image.
+        """
+        aws_svc, _, _ = build_aws_service()
+        shared = aws_svc.create_snapshot(None, name='Shared')
+        other = aws_svc.create_snapshot(None, name='Other')
+        bdm = BlockDeviceMapping()
+        bdm['/dev/sda1'] = BlockDeviceType(snapshot_id=shared.id)
+        bdm['/dev/sdf'] = BlockDeviceType(snapshot_id=shared.id)
+        bdm['/dev/sdg'] = BlockDeviceType(snapshot_id=other.id)
+        ami = aws_svc.register_image(name='AMI', block_device_map=bdm)
+        image = aws_svc.get_image(ami)
+        image.root_device_name = '/dev/sda1'
+
+        ami_info = encrypt_ami._finish_registration(
+            aws_svc, ami, 'Description')
+        self.assertEqual(
+            image.block_device_mapping.keys(),
+            [d['attach_point'] for d in ami_info['volume_device_map']]
+        )
+
     def test_clean_up_root_snapshot(self):
         """ Test that we clean up the root snapshot if an exception is
         raised while waiting for it to complete.
@@ -466,6 +734,506 @@ class TestRunEncryption(unittest.TestCase):
         self.assertFalse(self.encryptor_terminated)
         self.assertFalse(self.security_group_deleted)
 
+    def test_tag_encryptor_before_running(self):
+        """ Test that the encryptor instance is tagged before we wait for
+        it to start, so that it's identifiable if the session dies while
+        waiting.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.encryptor_instance_id = None
+        events = []
+
+        def run_instance_callback(args):
+            if args.image_id == encryptor_image.id:
+                self.encryptor_instance_id = args.instance.id
+
+        def get_instance_callback(instance):
+            events.append(('get_instance', instance.id))
+
+        def create_tags_callback(resource_id, name, description):
+            events.append(('create_tags', resource_id))
+
+        aws_svc.run_instance_callback = run_instance_callback
+        aws_svc.get_instance_callback = get_instance_callback
+        aws_svc.create_tags_callback = create_tags_callback
+
+        encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        instance_id = self.encryptor_instance_id
+        self.assertLess(
+            events.index(('create_tags', instance_id)),
+            events.index(('get_instance', instance_id))
+        )
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        trace.enable()
+
+    def tearDown(self):
+        trace.disable()
+
+    def test_encrypt_spans(self):
+        """ Test that each phase of encryption is traced. """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        names = set(s['name'] for s in trace._tracer.to_dict()['spans'])
+        for name in ('guest_snapshot', 'launch_encryptor', 'encryption',
+                     'wait_for_encryption', 'register_ami', 'clean_up'):
+            self.assertIn(name, names)
+
+
+class IOErrorEncryptorService(DummyEncryptorService):
+    """ Simulates losing our connection to the encryptor. """
+
+    def __init__(self, hostnames=['test-host'], port=80):
+        raise IOError('Connection reset by peer')
+
+
+class InterruptedEncryptorService(DummyEncryptorService):
+    """ Simulates the user pressing Ctrl-C. """
+
+    def __init__(self, hostnames=['test-host'], port=80):
+        raise KeyboardInterrupt()
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resume_after_io_error(self):
+        """ Test that we keep resources when the session is interrupted,
+        and that resuming the session reuses them.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.launched = []
+        self.terminated = set()
+
+        def run_instance_callback(args):
+            self.launched.append(args.image_id)
+
+        def terminate_instance_callback(instance_id):
+            if isinstance(instance_id, basestring):
+                self.terminated.add(instance_id)
+
+        aws_svc.run_instance_callback = run_instance_callback
+        aws_svc.terminate_instance_callback = terminate_instance_callback
+
+        session_journal = journal.Journal(
+            aws_svc.session_id, 'encrypt', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=IOErrorEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                journal=session_journal
+            )
+        self.assertEqual(
+            [guest_image.id, encryptor_image.id], self.launched)
+        self.assertEqual(set(), self.terminated)
+
+        # Resume the session.  No instances are launched.
+        session_journal = journal.Journal.load(
+            aws_svc.session_id, 'encrypt', directory=self.directory)
+        self.assertTrue(session_journal.completed(
+            encrypt_ami.PHASE_ENCRYPTOR_INSTANCE))
+        self.launched = []
+        ami_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id,
+            journal=session_journal
+        )
+        self.assertIsNotNone(ami_id)
+        self.assertEqual([], self.launched)
+        self.assertEqual(
+            set([
+                session_journal.get('guest_instance_id'),
+                session_journal.get('encryptor_instance_id')
+            ]),
+            self.terminated
+        )
+        self.assertFalse(os.path.exists(session_journal.path))
+
+    def _interrupt(self, enc_svc_cls, exception_class, keep_session):
+        """ Run an encryption session that is interrupted by the given
+        encryptor service.
+
+        :return a tuple of (instances that were terminated, Journal)
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        terminated = set()
+
+        def terminate_instance_callback(instance_id):
+            if isinstance(instance_id, basestring):
+                terminated.add(instance_id)
+
+        aws_svc.terminate_instance_callback = terminate_instance_callback
+        session_journal = journal.Journal(
+            aws_svc.session_id, 'encrypt', directory=self.directory,
+            keep_session=keep_session)
+        with self.assertRaises(exception_class):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=enc_svc_cls,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                journal=session_journal
+            )
+        return terminated, session_journal
+
+    def test_io_error_without_keep_session(self):
+        """ Test that we clean up after an IOError, unless the user asked
+        to keep the session.
+        """
+        terminated, session_journal = self._interrupt(
+            IOErrorEncryptorService, IOError, keep_session=False)
+        self.assertEqual(
+            set([
+                session_journal.get('guest_instance_id'),
+                session_journal.get('encryptor_instance_id')
+            ]),
+            terminated
+        )
+        self.assertFalse(os.path.exists(session_journal.path))
+
+    def test_keyboard_interrupt(self):
+        """ Test that we keep the session's resources when the user
+        interrupts it.
+        """
+        terminated, session_journal = self._interrupt(
+            InterruptedEncryptorService, KeyboardInterrupt,
+            keep_session=False)
+        self.assertEqual(set(), terminated)
+        self.assertTrue(os.path.exists(session_journal.path))
+
+    def test_io_error_before_journal(self):
+        """ Test that resources that weren't recorded in the journal are
+        cleaned up when the session is interrupted.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        deleted_snapshot_ids = []
+        deleted_sg_ids = []
+
+        def get_instance_attribute(instance_id, attribute, dry_run=False):
+            raise IOError('Connection reset by peer')
+
+        aws_svc.get_instance_attribute = get_instance_attribute
+        aws_svc.delete_snapshot_callback = deleted_snapshot_ids.append
+        aws_svc.delete_security_group_callback = deleted_sg_ids.append
+
+        session_journal = journal.Journal(
+            aws_svc.session_id, 'encrypt', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                journal=session_journal
+            )
+        self.assertFalse(
+            session_journal.completed(encrypt_ami.PHASE_GUEST_SNAPSHOT))
+        self.assertEqual(1, len(deleted_snapshot_ids))
+        self.assertEqual(1, len(deleted_sg_ids))
+        self.assertTrue(os.path.exists(session_journal.path))
+
+    def test_resume_after_encryption(self):
+        """ Test that a session that was interrupted after the Metavisor
+        root volume was detached reuses the encrypted root snapshot.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        # Preserve license information, so that the Metavisor root volume
+        # is detached from the encryptor instance.
+        guest_image.root_device_name = '/dev/sda1'
+        snapshots = []
+        detached = []
+        attach_volume = aws_svc.attach_volume
+        detach_volume = aws_svc.detach_volume
+
+        def create_snapshot_callback(volume_id, snapshot):
+            snapshots.append(snapshot.id)
+
+        def interrupted_attach_volume(vol_id, instance_id, device):
+            raise IOError('Connection reset by peer')
+
+        def recording_detach_volume(vol_id, **kwargs):
+            detached.append((vol_id, kwargs.get('instance_id')))
+            return detach_volume(vol_id, **kwargs)
+
+        aws_svc.create_snapshot_callback = create_snapshot_callback
+        aws_svc.attach_volume = interrupted_attach_volume
+        aws_svc.detach_volume = recording_detach_volume
+
+        session_journal = journal.Journal(
+            aws_svc.session_id, 'encrypt', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                journal=session_journal
+            )
+        session_journal = journal.Journal.load(
+            aws_svc.session_id, 'encrypt', directory=self.directory)
+        self.assertTrue(
+            session_journal.completed(encrypt_ami.PHASE_ENCRYPTED))
+        encrypted_snapshot_id = session_journal.get('encrypted_snapshot_id')
+        mv_root_id = session_journal.get('mv_root_id')
+        self.assertIn(encrypted_snapshot_id, aws_svc.snapshots)
+        encryptor_instance = aws_svc.get_instance(
+            session_journal.get('encryptor_instance_id'))
+        self.assertIn((mv_root_id, encryptor_instance.id), detached)
+
+        # The Metavisor root volume is no longer attached to the encryptor
+        # instance.
+        del encryptor_instance.block_device_mapping['/dev/sda1']
+
+        snapshots[:] = []
+        detached[:] = []
+        aws_svc.attach_volume = attach_volume
+        ami_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id,
+            journal=session_journal
+        )
+        self.assertEqual([], snapshots)
+        self.assertNotIn((mv_root_id, encryptor_instance.id), detached)
+        image = aws_svc.get_image(ami_id)
+        self.assertEqual(
+            encrypted_snapshot_id,
+            image.block_device_mapping['/dev/sdf'].snapshot_id
+        )
+
+
+    def test_resume_after_registration(self):
+        """ Test that a session that was interrupted after the encrypted
+        AMI was registered doesn't attach the Metavisor root volume or
+        register the AMI again.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        guest_image.root_device_name = '/dev/sda1'
+        attached = []
+        created = []
+        attach_volume = aws_svc.attach_volume
+        create_image = aws_svc.create_image
+        detach_volume = aws_svc.detach_volume
+
+        def recording_attach_volume(vol_id, instance_id, device):
+            attached.append(vol_id)
+            return attach_volume(vol_id, instance_id, device)
+
+        def recording_create_image(instance_id, name, **kwargs):
+            ami = create_image(instance_id, name, **kwargs)
+            created.append(ami)
+            return ami
+
+        def interrupted_detach_volume(vol_id, **kwargs):
+            if created:
+                raise IOError('Connection reset by peer')
+            return detach_volume(vol_id, **kwargs)
+
+        aws_svc.attach_volume = recording_attach_volume
+        aws_svc.create_image = recording_create_image
+        aws_svc.detach_volume = interrupted_detach_volume
+
+        session_journal = journal.Journal(
+            aws_svc.session_id, 'encrypt', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                journal=session_journal
+            )
+        self.assertEqual(1, len(attached))
+        self.assertEqual(1, len(created))
+        session_journal = journal.Journal.load(
+            aws_svc.session_id, 'encrypt', directory=self.directory)
+        self.assertTrue(session_journal.get('mv_root_attached'))
+        self.assertEqual(created[0], session_journal.get('ami_id'))
+
+        aws_svc.detach_volume = detach_volume
+        ami_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id,
+            journal=session_journal
+        )
+        self.assertEqual(created[0], ami_id)
+        self.assertEqual(1, len(attached))
+        self.assertEqual(1, len(created))
+        self.assertNotIn(session_journal.get('mv_root_id'), aws_svc.volumes)
+
+
+class StalledEncryptorService(DummyEncryptorService):
+    """ Reports the same progress until the test releases it. """
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def get_status(self):
+        StalledEncryptorService.started.set()
+        StalledEncryptorService.release.wait(10)
+        return {
+            'state': encryptor_service.ENCRYPT_ENCRYPTING,
+            'percent_complete': 0
+        }
+
+
+class TestEncryptAsync(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def test_encrypt_async(self):
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        future = encrypt_ami.encrypt_async(
+            aws_svc, DummyEncryptorService, guest_image.id,
+            encryptor_image.id)
+        self.assertIn(future.result(timeout=10), aws_svc.images)
+
+    def test_cancel(self):
+        """ Test that cancelling encryption stops it and cleans up the
+        instances, without saving the encryptor logs.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.terminated = set()
+        snapshot_names = []
+        create_snapshot = aws_svc.create_snapshot
+
+        def _create_snapshot(volume_id, name=None, description=None):
+            snapshot_names.append(name)
+            return create_snapshot(
+                volume_id, name=name, description=description)
+        aws_svc.create_snapshot = _create_snapshot
+
+        def terminate_instance_callback(instance_id):
+            if isinstance(instance_id, basestring):
+                self.terminated.add(instance_id)
+
+        aws_svc.terminate_instance_callback = terminate_instance_callback
+        StalledEncryptorService.started.clear()
+        StalledEncryptorService.release.clear()
+
+        future = encrypt_ami.encrypt_async(
+            aws_svc, StalledEncryptorService, guest_image.id,
+            encryptor_image.id)
+        self.assertTrue(StalledEncryptorService.started.wait(10))
+        self.assertTrue(future.cancel())
+        StalledEncryptorService.release.set()
+
+        with self.assertRaises(brkt_cli.util.CancelledError):
+            future.result(timeout=10)
+        self.assertTrue(future.cancelled())
+        self.assertEqual(2, len(self.terminated))
+        self.assertEqual(set(aws_svc.instances.keys()), self.terminated)
+        self.assertEqual([encrypt_ami.NAME_ORIGINAL_SNAPSHOT], snapshot_names)
+
+
+class TestCleanUp(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def test_outcomes(self):
+        """ Test that clean_up() reports the outcome for each resource, and
+        that one failure doesn't stop the rest of the cleanup.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        instance = aws_svc.run_instance(guest_image.id)
+        volume_id = instance.block_device_mapping['/dev/sda1'].volume_id
+        snapshot = aws_svc.create_snapshot(volume_id, 'test')
+        self.deleted_sg_ids = []
+
+        def delete_security_group_callback(sg_id):
+            self.deleted_sg_ids.append(sg_id)
+
+        aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+
+        outcomes = encrypt_ami.clean_up(
+            aws_svc,
+            instance_ids=[instance.id, 'i-missing'],
+            snapshot_ids=[snapshot.id],
+            security_group_ids=['sg-1']
+        )
+        self.assertEqual(
+            set([instance.id, 'i-missing', snapshot.id, 'sg-1']),
+            set(outcomes.keys())
+        )
+        self.assertIsNone(outcomes[instance.id])
+        self.assertIsNone(outcomes[snapshot.id])
+        self.assertIsNone(outcomes['sg-1'])
+        self.assertIsNotNone(outcomes['i-missing'])
+
+        self.assertEqual('terminated', instance.state)
+        self.assertNotIn(snapshot.id, aws_svc.snapshots)
+        self.assertEqual(['sg-1'], self.deleted_sg_ids)
+
+    def test_volume_waits_for_instance(self):
+        """ Test that we delete an attached volume after its instance
+        has terminated, and an unattached volume right away.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        instance = aws_svc.run_instance(guest_image.id)
+
+        attached = Volume()
+        attached.id = test_aws_service.new_id()
+        attached.attach_data = AttachmentSet()
+        attached.attach_data.instance_id = instance.id
+        aws_svc.volumes[attached.id] = attached
+
+        unattached = Volume()
+        unattached.id = test_aws_service.new_id()
+        aws_svc.volumes[unattached.id] = unattached
+
+        self.instance_state = {}
+        delete_volume = aws_svc.delete_volume
+
+        def _delete_volume(volume_id):
+            self.instance_state[volume_id] = instance.state
+            delete_volume(volume_id)
+
+        aws_svc.delete_volume = _delete_volume
+        outcomes = encrypt_ami.clean_up(
+            aws_svc,
+            instance_ids=[instance.id],
+            volume_ids=[attached.id, unattached.id, 'vol-missing']
+        )
+        self.assertEqual('terminated', self.instance_state[attached.id])
+        self.assertNotIn(attached.id, aws_svc.volumes)
+        self.assertNotIn(unattached.id, aws_svc.volumes)
+        self.assertIsNone(outcomes[attached.id])
+        self.assertIsNone(outcomes[unattached.id])
+
 
 class TestBrktEnv(unittest.TestCase):
 
@@ -668,3 +1436,85 @@ class TestBrktEnv(unittest.TestCase):
             )
 
         self.assertTrue(self.encryptor_terminated)
+
+    def test_security_group_created_during_snapshot(self):
+        """ Test that we create the temporary security group while the
+        guest root volume is being snapshotted.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        sg_created = threading.Event()
+        self.sg_created_before_snapshot = False
+
+        def create_security_group_callback(vpc_id):
+            sg_created.set()
+
+        def create_snapshot_callback(volume_id, snapshot):
+            # The security group is created on another thread.  If the
+            # steps ran in sequence, this would time out.
+            if not self.sg_created_before_snapshot:
+                self.sg_created_before_snapshot = sg_created.wait(5)
+
+        aws_svc.create_security_group_callback = \
+            create_security_group_callback
+        aws_svc.create_snapshot_callback = create_snapshot_callback
+
+        encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        self.assertTrue(self.sg_created_before_snapshot)
+
+    def test_clean_up_security_group_on_snapshot_failure(self):
+        """ Test that we delete the temporary security group if an
+        exception is raised while snapshotting the guest root volume.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.deleted_sg_ids = []
+
+        def get_snapshot_callback(snapshot):
+            raise TestException()
+
+        def delete_security_group_callback(sg_id):
+            self.deleted_sg_ids.append(sg_id)
+
+        aws_svc.get_snapshot_callback = get_snapshot_callback
+        aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+
+        with self.assertRaises(TestException):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id
+            )
+        self.assertEqual(1, len(self.deleted_sg_ids))
+
+    def test_clean_up_security_group_on_launch_failure(self):
+        """ Test that we delete the temporary security group exactly once
+        if the encryptor instance fails to launch.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.deleted_sg_ids = []
+
+        def run_instance_callback(args):
+            if args.image_id == encryptor_image.id:
+                raise TestException()
+
+        def delete_security_group_callback(sg_id):
+            self.deleted_sg_ids.append(sg_id)
+
+        aws_svc.run_instance_callback = run_instance_callback
+        aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+
+        with self.assertRaises(TestException):
+            encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id
+            )
+        self.assertEqual(1, len(self.deleted_sg_ids))
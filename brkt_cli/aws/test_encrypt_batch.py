@@ -0,0 +1,185 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import thread
+import threading
+import unittest
+
+from boto.ec2.blockdevicemapping import BlockDeviceMapping, BlockDeviceType
+
+import brkt_cli.util
+from brkt_cli.aws import encrypt_ami, encrypt_batch
+from brkt_cli import encryptor_service
+from brkt_cli.aws.test_aws_service import build_aws_service
+from brkt_cli.test_encryptor_service import DummyEncryptorService
+
+
+class TestException(Exception):
+    pass
+
+
+class InterruptingEncryptorService(DummyEncryptorService):
+    """ Interrupts the main thread, as if the user pressed Ctrl-C, and
+    never finishes encrypting.
+    """
+
+    interrupted = threading.Event()
+
+    def get_status(self):
+        if not InterruptingEncryptorService.interrupted.is_set():
+            InterruptingEncryptorService.interrupted.set()
+            thread.interrupt_main()
+        return {
+            'state': encryptor_service.ENCRYPT_ENCRYPTING,
+            'percent_complete': 10
+        }
+
+
+def _register_guest_image(aws_svc, name):
+    bdm = BlockDeviceMapping()
+    bdm['/dev/sda1'] = BlockDeviceType()
+    image_id = aws_svc.register_image(name=name, block_device_map=bdm)
+    return aws_svc.get_image(image_id)
+
+
+class TestEncryptBatch(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def test_smoke(self):
+        """ Test that we encrypt every image and share one temporary
+        security group between the encryptor instances.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        guest_image_2 = _register_guest_image(aws_svc, 'Guest image 2')
+
+        self.created_sg_ids = []
+        self.deleted_sg_ids = []
+        self.encryptor_sg_ids = set()
+
+        def create_security_group_callback(vpc_id):
+            self.created_sg_ids.append(vpc_id)
+
+        def delete_security_group_callback(sg_id):
+            self.deleted_sg_ids.append(sg_id)
+
+        def run_instance_callback(args):
+            if args.image_id == encryptor_image.id:
+                self.encryptor_sg_ids.update(args.security_group_ids)
+
+        aws_svc.create_security_group_callback = \
+            create_security_group_callback
+        aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+        aws_svc.run_instance_callback = run_instance_callback
+
+        results = encrypt_batch.encrypt_batch(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_ids=[guest_image.id, guest_image_2.id, guest_image.id],
+            encryptor_ami=encryptor_image.id,
+            max_concurrent_encryptions=2
+        )
+
+        self.assertEqual(
+            [guest_image.id, guest_image_2.id],
+            [r.image_id for r in results]
+        )
+        for r in results:
+            self.assertTrue(r.succeeded)
+            self.assertIsNone(r.error)
+        self.assertNotEqual(results[0].session_id, results[1].session_id)
+
+        self.assertEqual(1, len(self.created_sg_ids))
+        self.assertEqual(1, len(self.encryptor_sg_ids))
+        self.assertEqual(list(self.encryptor_sg_ids), self.deleted_sg_ids)
+
+    def test_one_image_fails(self):
+        """ Test that a failure to encrypt one image doesn't affect the
+        others.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        bad_image = _register_guest_image(aws_svc, 'Bad image')
+
+        def run_instance_callback(args):
+            if args.image_id == bad_image.id:
+                raise TestException('Test')
+
+        aws_svc.run_instance_callback = run_instance_callback
+        results = encrypt_batch.encrypt_batch(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_ids=[bad_image.id, guest_image.id],
+            encryptor_ami=encryptor_image.id
+        )
+
+        self.assertFalse(results[0].succeeded)
+        self.assertIsInstance(results[0].error, TestException)
+        self.assertTrue(results[1].succeeded)
+
+        table = encrypt_batch.render_results(results)
+        lines = table.split('\n')
+        self.assertEqual(3, len(lines))
+        self.assertIn('FAILED: Test', lines[1])
+        self.assertIn(results[1].encrypted_image_id, lines[2])
+
+    def test_interrupted(self):
+        """ Test that the sessions are cancelled and cleaned up before the
+        shared security group is deleted, when the batch is interrupted.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        guest_image_2 = _register_guest_image(aws_svc, 'Guest image 2')
+        self.terminated = set()
+        self.deleted_sg_ids = []
+
+        def terminate_instance_callback(instance_id):
+            if isinstance(instance_id, basestring):
+                self.terminated.add(instance_id)
+
+        def delete_security_group_callback(sg_id):
+            # Every instance is gone by the time the group is deleted.
+            self.assertEqual(
+                set(aws_svc.instances.keys()), self.terminated)
+            self.deleted_sg_ids.append(sg_id)
+
+        aws_svc.terminate_instance_callback = terminate_instance_callback
+        aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+        InterruptingEncryptorService.interrupted.clear()
+
+        with self.assertRaises(KeyboardInterrupt):
+            encrypt_batch.encrypt_batch(
+                aws_svc=aws_svc,
+                enc_svc_cls=InterruptingEncryptorService,
+                image_ids=[guest_image.id, guest_image_2.id],
+                encryptor_ami=encryptor_image.id
+            )
+        self.assertEqual(4, len(self.terminated))
+        self.assertEqual(1, len(self.deleted_sg_ids))
+
+    def test_session_tags(self):
+        """ Test that each session tags resources with its own session id.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        aws_svc.default_tags = encrypt_ami.get_default_tags(
+            aws_svc.session_id, encryptor_image.id)
+
+        clone = aws_svc.clone('abc')
+        clone.default_tags[encrypt_ami.TAG_ENCRYPTOR_SESSION_ID] = 'abc'
+        self.assertEqual('abc', clone.session_id)
+        self.assertEqual(
+            aws_svc.session_id,
+            aws_svc.default_tags[encrypt_ami.TAG_ENCRYPTOR_SESSION_ID]
+        )
+        self.assertIs(aws_svc.instances, clone.instances)
@@ -0,0 +1,139 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import time
+import unittest
+
+from boto.exception import EC2ResponseError
+
+import brkt_cli.util
+from brkt_cli import util
+from brkt_cli.aws import aws_service, encrypt_ami, poller
+from brkt_cli.aws.test_aws_service import build_aws_service
+
+NOT_FOUND = 'InvalidInstanceID.NotFound'
+
+
+class DummyResource(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class TestPoller(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        self.existing_ids = set()
+        self.calls = []
+
+    def _describe(self, ids):
+        self.calls.append(sorted(ids))
+        for id in ids:
+            if id not in self.existing_ids:
+                e = EC2ResponseError(400, 'Not Found')
+                e.error_code = NOT_FOUND
+                raise e
+        return [DummyResource(id) for id in ids]
+
+    def test_coalesce(self):
+        """ Test that requests that arrive while a describe call is in
+        flight are batched into the next call.
+        """
+        self.existing_ids = set(['i-%d' % n for n in range(5)])
+        batcher = poller._Batcher(self._describe, NOT_FOUND, 'instances')
+
+        def _describe_slowly(ids):
+            if not self.calls:
+                # Hold the first call until all other requests are queued.
+                deadline = util.Deadline(5)
+                while len(batcher._pending) + len(ids) < 5 and \
+                        not deadline.is_expired():
+                    time.sleep(0.01)
+            return self._describe(ids)
+
+        batcher.describe = _describe_slowly
+        futures = [
+            util.run_async(batcher.get, [id])
+            for id in sorted(self.existing_ids)
+        ]
+        results = [f.result(timeout=10)[0].id for f in futures]
+
+        self.assertEqual(sorted(self.existing_ids), results)
+        self.assertTrue(len(self.calls) <= 2)
+        self.assertEqual(results, sorted(sum(self.calls, [])))
+
+    def test_not_found(self):
+        """ Test that a missing resource only fails the request that asked
+        for it.
+        """
+        self.existing_ids = set(['i-1'])
+        batcher = poller._Batcher(self._describe, NOT_FOUND, 'instances')
+        found = util.Future()
+        missing = util.Future()
+        batcher._fetch({'i-1': [found], 'i-2': [missing]})
+
+        self.assertEqual('i-1', found.result().id)
+        self.assertEqual(NOT_FOUND, missing.exception().error_code)
+
+    def test_no_gather_for_one_waiter(self):
+        """ Test that a lone waiter doesn't wait for other requests to
+        join its batch.
+        """
+        self.existing_ids = set(['i-1'])
+        batcher = poller._Batcher(self._describe, NOT_FOUND, 'instances')
+        sleeps = []
+        sleep = util.sleep
+        util.sleep = sleeps.append
+        try:
+            self.assertEqual('i-1', batcher.get(['i-1'])[0].id)
+        finally:
+            util.sleep = sleep
+        self.assertEqual([], sleeps)
+
+    def test_empty_response(self):
+        """ Test that we raise NotFound when AWS doesn't return the
+        resource.
+        """
+        batcher = poller._Batcher(lambda ids: [], NOT_FOUND, 'instances')
+        with self.assertRaises(EC2ResponseError) as cm:
+            batcher.get(['i-1'])
+        self.assertEqual(NOT_FOUND, cm.exception.error_code)
+
+    def test_aws_service_not_found(self):
+        """ Test that AWSService doesn't retry NotFound on a batched
+        describe, so that the poller can split the batch right away.
+        """
+        test = self
+        test.existing_ids = set(['i-1'])
+
+        class FakeConnection(object):
+            def get_only_instances(self, instance_ids):
+                return test._describe(instance_ids)
+
+        aws_svc = aws_service.AWSService('test')
+        aws_svc.conn = FakeConnection()
+        found = util.Future()
+        missing = util.Future()
+        aws_svc.poller.instances._fetch({'i-1': [found], 'i-2': [missing]})
+        self.assertEqual(
+            [['i-1'], ['i-1', 'i-2'], ['i-2']], sorted(self.calls))
+        self.assertEqual('i-1', found.result().id)
+        self.assertEqual(NOT_FOUND, missing.exception().error_code)
+
+    def test_clean_up(self):
+        """ Test that clean_up() waits for all instances to terminate. """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        ids = [aws_svc.run_instance(guest_image.id).id for _ in range(3)]
+        encrypt_ami.clean_up(aws_svc, instance_ids=ids)
+        for id in ids:
+            self.assertEqual('terminated', aws_svc.instances[id].state)
@@ -0,0 +1,164 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import unittest
+
+from boto.exception import EC2ResponseError
+
+from brkt_cli.aws import aws_service, rate_limiter
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def _clock(self):
+        return self.now
+
+    def _sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def _limiter(self, **kwargs):
+        return rate_limiter.RateLimiter(
+            clock=self._clock, sleep=self._sleep, **kwargs)
+
+    def test_token_bucket(self):
+        """ Test that calls beyond the burst wait for the bucket to
+        refill.
+        """
+        limiter = self._limiter(max_rate=10.0, burst=5.0)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertEqual([], self.slept)
+
+        limiter.acquire()
+        self.assertEqual(1, len(self.slept))
+        self.assertAlmostEqual(0.1, self.slept[0])
+
+    def test_aimd(self):
+        """ Test that the rate is halved on throttle and recovers after
+        successful calls.
+        """
+        limiter = self._limiter(max_rate=10.0)
+        limiter.on_throttle()
+        self.assertEqual(5.0, limiter.rate)
+
+        # A second throttle error at the same time is the same event.
+        limiter.on_throttle()
+        self.assertEqual(5.0, limiter.rate)
+
+        self.now += rate_limiter.THROTTLE_WINDOW_SECONDS
+        limiter.on_throttle()
+        self.assertEqual(2.5, limiter.rate)
+
+        for _ in range(1000):
+            limiter.on_success()
+        self.assertEqual(10.0, limiter.rate)
+
+    def test_min_rate(self):
+        limiter = self._limiter(max_rate=1.0, min_rate=0.5)
+        for _ in range(5):
+            limiter.on_throttle()
+            self.now += rate_limiter.THROTTLE_WINDOW_SECONDS
+        self.assertEqual(0.5, limiter.rate)
+
+    def test_wrap(self):
+        """ Test that throttle errors from the wrapped function reduce the
+        rate.
+        """
+        limiter = self._limiter(max_rate=10.0)
+
+        def _throttled():
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = 'RequestLimitExceeded'
+            raise e
+
+        with self.assertRaises(EC2ResponseError):
+            limiter.wrap(_throttled, aws_service.is_throttle_error)()
+        self.assertEqual(5.0, limiter.rate)
+
+        def _not_found():
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = 'InvalidAMIID.NotFound'
+            raise e
+
+        self.now += rate_limiter.THROTTLE_WINDOW_SECONDS
+        with self.assertRaises(EC2ResponseError):
+            limiter.wrap(_not_found, aws_service.is_throttle_error)()
+        self.assertEqual(5.0, limiter.rate)
+
+    def test_state_file(self):
+        """ Test that limiters that use the same state file share the
+        bucket.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'rate')
+            l1 = self._limiter(max_rate=10.0, burst=2.0, state_file=path)
+            l2 = self._limiter(max_rate=10.0, burst=2.0, state_file=path)
+            l1.acquire()
+            l2.acquire()
+            self.assertEqual([], self.slept)
+            l1.acquire()
+            self.assertEqual(1, len(self.slept))
+
+            l2.on_throttle()
+            self.assertEqual(5.0, l1.rate)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestAWSServiceLimiter(unittest.TestCase):
+
+    def test_all_calls_limited(self):
+        """ Test that EC2 calls that don't retry NotFound still go
+        through the rate limiter.
+        """
+        wrapped = []
+
+        class FakeLimiter(object):
+            def wrap(self, function, is_throttle_error):
+                wrapped.append(function.__name__)
+                return function
+
+        class FakeConnection(object):
+            def get_image(self, image_id):
+                return None
+
+            def get_console_output(self, instance_id):
+                return 'output'
+
+            def get_all_subnets(self, subnet_ids=None):
+                return ['subnet']
+
+            def get_all_security_groups(self, group_ids=None):
+                return ['sg']
+
+        aws_svc = aws_service.AWSService(
+            'test', cache_describes=False, limiter=FakeLimiter())
+        aws_svc.conn = FakeConnection()
+        aws_svc.get_image('ami-1')
+        aws_svc.get_console_output('i-1')
+        aws_svc.get_subnet('subnet-1')
+        aws_svc.get_security_group('sg-1', retry=False)
+        self.assertEqual(
+            ['get_image', 'get_console_output', 'get_all_subnets',
+             'get_all_security_groups'],
+            wrapped
+        )
@@ -0,0 +1,100 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+import brkt_cli.util
+from brkt_cli.aws import encrypt_ami, share_ami
+from brkt_cli.aws.test_aws_service import build_aws_service
+from brkt_cli.test_encryptor_service import DummyEncryptorService
+
+ROLE_1 = 'arn:aws:iam::111111111111:role/brkt-share'
+ROLE_2 = 'arn:aws:iam::222222222222:role/brkt-share'
+
+
+class TestShareAMI(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        self.aws_svc = aws_svc
+        self.image_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        self.shared = []
+        self.roles = []
+
+        def share_image_callback(image_id, account_ids):
+            self.shared.append((image_id, account_ids))
+
+        def connect_as_callback(role, region, session_name):
+            self.roles.append(role)
+
+        aws_svc.share_image_callback = share_image_callback
+        aws_svc.connect_as_callback = connect_as_callback
+
+    def test_get_account_id(self):
+        self.assertEqual('111111111111', share_ami.get_account_id(ROLE_1))
+        self.assertEqual(
+            '111111111111',
+            share_ami.get_account_id(
+                'arn:aws-us-gov:iam::111111111111:role/path/name'))
+        self.assertIsNone(share_ami.get_account_id('111111111111'))
+        self.assertIsNone(
+            share_ami.get_account_id('arn:aws:iam::1111:role/name'))
+
+    def test_share(self):
+        """ Test that the AMI is shared with all accounts in one call, and
+        each role is assumed.
+        """
+        results = share_ami.share_ami(
+            self.aws_svc, self.image_id, [ROLE_1, ROLE_2])
+        self.assertEqual(
+            [(self.image_id, ['111111111111', '222222222222'])], self.shared)
+        self.assertEqual([ROLE_1, ROLE_2], sorted(self.roles))
+        self.assertTrue(all(r.succeeded for r in results))
+        self.assertEqual(
+            [self.image_id, self.image_id], [r.image_id for r in results])
+
+        output = share_ami.render_results(results)
+        self.assertIn('111111111111', output)
+        self.assertIn('222222222222', output)
+
+    def test_copy(self):
+        """ Test that the AMI is copied into each account, and that a
+        failure in one account doesn't affect the other.
+        """
+        def connect_as_callback(role, region, session_name):
+            self.roles.append(role)
+            if role == ROLE_2:
+                raise Exception('Access denied')
+
+        self.aws_svc.connect_as_callback = connect_as_callback
+
+        results = share_ami.share_ami(
+            self.aws_svc, self.image_id, [ROLE_1, ROLE_2], copy=True)
+        self.assertTrue(results[0].succeeded)
+        self.assertNotEqual(self.image_id, results[0].image_id)
+        copy = self.aws_svc.get_image(results[0].image_id)
+        source = self.aws_svc.get_image(self.image_id)
+        self.assertEqual(
+            source.tags[encrypt_ami.TAG_SOURCE_AMI],
+            copy.tags[encrypt_ami.TAG_SOURCE_AMI])
+
+        self.assertFalse(results[1].succeeded)
+        self.assertIn('Access denied', str(results[1].error))
+        self.assertIn(
+            'FAILED: Access denied', share_ami.render_results(results))
@@ -0,0 +1,163 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import time
+import unittest
+
+from boto.ec2.snapshot import Snapshot
+
+import brkt_cli.util
+from brkt_cli.aws import encrypt_ami, snapshot_cache
+from brkt_cli.aws.test_aws_service import build_aws_service, new_id
+from brkt_cli.test_encryptor_service import DummyEncryptorService
+
+DAY = 24 * 60 * 60
+
+
+def _add_snapshot(aws_svc, size=8):
+    snapshot = Snapshot()
+    snapshot.id = 'snap-' + new_id()
+    snapshot.status = 'completed'
+    snapshot.volume_size = size
+    aws_svc.snapshots[snapshot.id] = snapshot
+    return snapshot
+
+
+class TestSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+
+    def test_put_and_get(self):
+        aws_svc, _, _ = build_aws_service()
+        cache = snapshot_cache.SnapshotCache()
+        snapshot = _add_snapshot(aws_svc)
+
+        self.assertIsNone(cache.get(aws_svc, 'ami-1', '/dev/sda1'))
+        cache.put(aws_svc, snapshot.id, 'ami-1', '/dev/sda1', 'io1', iops=500)
+
+        cached = cache.get(aws_svc, 'ami-1', '/dev/sda1')
+        self.assertEqual(snapshot.id, cached.snapshot_id)
+        self.assertEqual(8, cached.size)
+        self.assertEqual('io1', cached.vol_type)
+        self.assertEqual(500, cached.iops)
+
+        # The key includes the root device.
+        self.assertIsNone(cache.get(aws_svc, 'ami-1', '/dev/xvda'))
+
+    def test_ttl(self):
+        """ Test that expired snapshots are ignored and evicted. """
+        aws_svc, _, _ = build_aws_service()
+        cache = snapshot_cache.SnapshotCache(ttl_days=1)
+        snapshot = _add_snapshot(aws_svc)
+        cache.put(aws_svc, snapshot.id, 'ami-1', '/dev/sda1', 'gp2')
+        snapshot.tags[snapshot_cache.TAG_CREATED] = \
+            str(int(time.time()) - 2 * DAY)
+
+        self.assertIsNone(cache.get(aws_svc, 'ami-1', '/dev/sda1'))
+        self.assertEqual([snapshot.id], cache.evict(aws_svc))
+        self.assertNotIn(snapshot.id, aws_svc.snapshots)
+
+    def test_max_size(self):
+        """ Test that the oldest snapshots are evicted when the cache is
+        too large.
+        """
+        aws_svc, _, _ = build_aws_service()
+        cache = snapshot_cache.SnapshotCache(max_size_gb=20)
+        snapshots = []
+        for i in range(3):
+            snapshot = _add_snapshot(aws_svc)
+            cache.put(aws_svc, snapshot.id, 'ami-%d' % i, '/dev/sda1', 'gp2')
+            snapshot.tags[snapshot_cache.TAG_CREATED] = str(
+                int(time.time()) - (3 - i) * 60 -
+                snapshot_cache.DEFAULT_GRACE_SECONDS)
+            snapshots.append(snapshot)
+
+        # Adding the third snapshot evicted the first one.
+        self.assertNotIn(snapshots[0].id, aws_svc.snapshots)
+        self.assertIsNone(cache.get(aws_svc, 'ami-0', '/dev/sda1'))
+        self.assertIsNotNone(cache.get(aws_svc, 'ami-1', '/dev/sda1'))
+        self.assertIsNotNone(cache.get(aws_svc, 'ami-2', '/dev/sda1'))
+
+    def test_evict_in_use(self):
+        """ Test that eviction keeps snapshots that are pending, recently
+        added, or recently used by another session.
+        """
+        aws_svc, _, _ = build_aws_service()
+        cache = snapshot_cache.SnapshotCache(max_size_gb=1)
+        now = int(time.time())
+        old = str(now - snapshot_cache.DEFAULT_GRACE_SECONDS - 60)
+
+        pending = _add_snapshot(aws_svc)
+        pending.status = 'pending'
+        recent = _add_snapshot(aws_svc)
+        used = _add_snapshot(aws_svc)
+        unused = _add_snapshot(aws_svc)
+        for snapshot, image_id in ((pending, 'ami-1'), (recent, 'ami-2'),
+                                   (used, 'ami-3'), (unused, 'ami-4')):
+            snapshot.tags.update({
+                snapshot_cache.TAG_SOURCE_IMAGE: image_id,
+                snapshot_cache.TAG_ROOT_DEVICE: '/dev/sda1',
+                snapshot_cache.TAG_CREATED: old
+            })
+        recent.tags[snapshot_cache.TAG_CREATED] = str(now)
+
+        # Another session gets the snapshot from the cache.
+        cached = cache.get(aws_svc, 'ami-3', '/dev/sda1')
+        self.assertEqual(used.id, cached.snapshot_id)
+
+        self.assertEqual([unused.id], cache.evict(aws_svc))
+
+    def test_encrypt_uses_cache(self):
+        """ Test that the second encryption of an AMI uses the cached
+        snapshot of its root volume.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        cache = snapshot_cache.SnapshotCache()
+        self.created = []
+        self.deleted = []
+
+        def create_snapshot_callback(volume_id, snapshot):
+            self.created.append(snapshot.id)
+
+        def delete_snapshot_callback(snapshot_id):
+            self.deleted.append(snapshot_id)
+
+        aws_svc.create_snapshot_callback = create_snapshot_callback
+        aws_svc.delete_snapshot_callback = delete_snapshot_callback
+
+        counts = []
+        for _ in range(2):
+            self.created = []
+            ami_id = encrypt_ami.encrypt(
+                aws_svc=aws_svc,
+                enc_svc_cls=DummyEncryptorService,
+                image_id=guest_image.id,
+                encryptor_ami=encryptor_image.id,
+                snapshot_cache=cache
+            )
+            self.assertIsNotNone(ami_id)
+            counts.append(len(self.created))
+
+        # The second run didn't snapshot the guest root volume.  The cached
+        # snapshot is still around.
+        self.assertEqual(counts[0] - 1, counts[1])
+        cached = cache.get(
+            aws_svc, guest_image.id, guest_image.root_device_name)
+        self.assertIsNotNone(cached)
+        self.assertNotIn(cached.snapshot_id, self.deleted)
+
+        # The encrypted AMI points to the cached snapshot.
+        image = aws_svc.get_image(ami_id)
+        self.assertEqual(
+            cached.snapshot_id, image.tags[encrypt_ami.TAG_SOURCE_SNAPSHOT])
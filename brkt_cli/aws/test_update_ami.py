@@ -12,17 +12,21 @@
 # License for the specific language governing permissions and
 # limitations under the License.
 import os
+import shutil
+import tempfile
 import unittest
 
 from boto.exception import EC2ResponseError
 from brkt_cli import encryptor_service
 
-from brkt_cli import util
+from brkt_cli import journal, util
 
 from brkt_cli.aws import (
     encrypt_ami, test_aws_service, update_ami
 )
 from brkt_cli.aws.test_aws_service import build_aws_service
+from brkt_cli.aws.test_encrypt_ami import IOErrorEncryptorService
+from brkt_cli.aws.update_ami import PHASE_INSTANCES
 from brkt_cli.test_encryptor_service import (
     DummyEncryptorService,
     FailedEncryptionService
@@ -65,6 +69,62 @@ class TestRunUpdate(unittest.TestCase):
         self.assertEqual(1, self.call_count)
         self.assertIsNotNone(ami_id)
 
+    def test_lineage_tags(self):
+        """ Test that encrypted and updated AMIs are tagged with the AMI
+        and snapshot that they're based on.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encrypted_ami_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        encrypted_image = aws_svc.get_image(encrypted_ami_id)
+        self.assertEqual(
+            guest_image.id, encrypted_image.tags[encrypt_ami.TAG_SOURCE_AMI])
+        # The guest root snapshot was deleted, because it's not cached.
+        self.assertNotIn(
+            encrypt_ami.TAG_SOURCE_SNAPSHOT, encrypted_image.tags)
+
+        updated_ami_id = update_ami(
+            aws_svc, encrypted_ami_id, encryptor_image.id,
+            'Test updated AMI',
+            enc_svc_class=DummyEncryptorService
+        )
+        updated_image = aws_svc.get_image(updated_ami_id)
+        self.assertEqual(
+            encrypted_ami_id, updated_image.tags[encrypt_ami.TAG_PARENT_AMI])
+        self.assertEqual(
+            guest_image.id, updated_image.tags[encrypt_ami.TAG_SOURCE_AMI])
+        self.assertNotIn(encrypt_ami.TAG_SOURCE_SNAPSHOT, updated_image.tags)
+
+    def test_describe_updated_image_once(self):
+        """ Test that the updated AMI is only described while waiting for
+        it to become available.
+        """
+        aws_svc, encryptor_image, guest_image = build_aws_service()
+        encrypted_ami_id = encrypt_ami.encrypt(
+            aws_svc=aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=encryptor_image.id
+        )
+        get_image = aws_svc.get_image
+        image_calls = []
+
+        def _get_image(image_id, retry=False):
+            image_calls.append(image_id)
+            return get_image(image_id, retry=retry)
+        aws_svc.get_image = _get_image
+
+        updated_ami_id = update_ami(
+            aws_svc, encrypted_ami_id, encryptor_image.id,
+            'Test updated AMI',
+            enc_svc_class=DummyEncryptorService
+        )
+        self.assertEqual(1, image_calls.count(updated_ami_id))
+
     def test_guest_instance_type(self):
         """ Test that the guest instance type is passed through
         to run_instance().
@@ -171,3 +231,153 @@ class TestRunUpdate(unittest.TestCase):
             os.remove(e.console_output_file.name)
 
         self.assertTrue(self.updater_stopped)
+
+
+class TestResumeUpdate(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.directory = tempfile.mkdtemp()
+        self.aws_svc, self.encryptor_image, guest_image = \
+            build_aws_service()
+        self.encrypted_ami_id = encrypt_ami.encrypt(
+            aws_svc=self.aws_svc,
+            enc_svc_cls=DummyEncryptorService,
+            image_id=guest_image.id,
+            encryptor_ami=self.encryptor_image.id
+        )
+        self.launched = []
+        self.terminated = set()
+        self.deleted_sg_ids = []
+
+        def run_instance_callback(args):
+            self.launched.append(args.instance.id)
+
+        def terminate_instance_callback(instance_id):
+            if isinstance(instance_id, basestring):
+                self.terminated.add(instance_id)
+
+        def delete_security_group_callback(sg_id):
+            self.deleted_sg_ids.append(sg_id)
+
+        self.aws_svc.run_instance_callback = run_instance_callback
+        self.aws_svc.terminate_instance_callback = \
+            terminate_instance_callback
+        self.aws_svc.delete_security_group_callback = \
+            delete_security_group_callback
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _update(self, session_journal, enc_svc_class=DummyEncryptorService):
+        return update_ami(
+            self.aws_svc, self.encrypted_ami_id, self.encryptor_image.id,
+            'Test updated AMI',
+            enc_svc_class=enc_svc_class,
+            journal=session_journal
+        )
+
+    def test_io_error_before_journal(self):
+        """ Test that the IOError propagates, and that resources that
+        weren't recorded in the journal are cleaned up.
+        """
+        def run_instance_callback(args):
+            if args.image_id == self.encryptor_image.id:
+                raise IOError('Connection reset by peer')
+            self.launched.append(args.instance.id)
+
+        self.aws_svc.run_instance_callback = run_instance_callback
+        session_journal = journal.Journal(
+            self.aws_svc.session_id, 'update', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            self._update(session_journal)
+        self.assertFalse(session_journal.completed(PHASE_INSTANCES))
+        self.assertEqual(set(self.launched), self.terminated)
+        self.assertEqual(1, len(self.deleted_sg_ids))
+
+    def test_resume_after_io_error(self):
+        """ Test that we keep the instances when the session is
+        interrupted, and that resuming the session reuses them.
+        """
+        session_journal = journal.Journal(
+            self.aws_svc.session_id, 'update', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            self._update(
+                session_journal, enc_svc_class=IOErrorEncryptorService)
+        self.assertEqual(2, len(self.launched))
+        self.assertEqual(set(), self.terminated)
+
+        session_journal = journal.Journal.load(
+            self.aws_svc.session_id, 'update', directory=self.directory)
+        self.assertTrue(session_journal.completed(PHASE_INSTANCES))
+        launched = self.launched
+        self.launched = []
+        ami_id = self._update(session_journal)
+        self.assertIn(ami_id, self.aws_svc.images)
+        self.assertEqual([], self.launched)
+        self.assertEqual(set(launched), self.terminated)
+        self.assertFalse(os.path.exists(session_journal.path))
+
+    def test_io_error_without_keep_session(self):
+        """ Test that we clean up after an IOError, unless the user asked
+        to keep the session.
+        """
+        session_journal = journal.Journal(
+            self.aws_svc.session_id, 'update', directory=self.directory)
+        with self.assertRaises(IOError):
+            self._update(
+                session_journal, enc_svc_class=IOErrorEncryptorService)
+        self.assertEqual(set(self.launched), self.terminated)
+        self.assertEqual(1, len(self.deleted_sg_ids))
+        self.assertFalse(os.path.exists(session_journal.path))
+
+    def test_resume_after_create_image(self):
+        """ Test that a session that was interrupted after the new AMI was
+        created doesn't swap the Metavisor root volume or create the AMI
+        again.
+        """
+        attached = []
+        created = []
+        interrupted = []
+        attach_volume = self.aws_svc.attach_volume
+        create_image = self.aws_svc.create_image
+        get_image = self.aws_svc.get_image
+
+        def recording_attach_volume(vol_id, instance_id, device):
+            attached.append(vol_id)
+            return attach_volume(vol_id, instance_id, device)
+
+        def recording_create_image(instance_id, name, **kwargs):
+            ami = create_image(instance_id, name, **kwargs)
+            created.append(ami)
+            return ami
+
+        def interrupted_get_image(image_id, **kwargs):
+            if created and not interrupted:
+                interrupted.append(image_id)
+                raise IOError('Connection reset by peer')
+            return get_image(image_id, **kwargs)
+
+        self.aws_svc.attach_volume = recording_attach_volume
+        self.aws_svc.create_image = recording_create_image
+        self.aws_svc.get_image = interrupted_get_image
+
+        session_journal = journal.Journal(
+            self.aws_svc.session_id, 'update', directory=self.directory,
+            keep_session=True)
+        with self.assertRaises(IOError):
+            self._update(session_journal)
+        self.assertEqual(1, len(attached))
+        self.assertEqual(1, len(created))
+        self.assertEqual(set(), self.terminated)
+
+        session_journal = journal.Journal.load(
+            self.aws_svc.session_id, 'update', directory=self.directory)
+        self.assertEqual(created[0], session_journal.get('ami_id'))
+        ami_id = self._update(session_journal)
+        self.assertEqual(created[0], ami_id)
+        self.assertEqual(1, len(attached))
+        self.assertEqual(1, len(created))
+        self.assertEqual(set(self.launched), self.terminated)
@@ -26,12 +26,13 @@ import logging
 import os
 
 import encrypt_ami
-from brkt_cli import encryptor_service
+from brkt_cli import encryptor_service, trace, util
 from brkt_cli.encryptor_service import (
     wait_for_encryptor_up,
     wait_for_encryption,
 )
 from brkt_cli.instance_config import InstanceConfig
+from brkt_cli.journal import keep_resources, record_phase
 from brkt_cli.user_data import gzip_user_data
 from brkt_cli.util import Deadline
 from encrypt_ami import (
@@ -46,8 +47,15 @@ from encrypt_ami import (
     NAME_METAVISOR_UPDATER,
     NAME_ENCRYPTED_ROOT_SNAPSHOT,
     NAME_METAVISOR_ROOT_SNAPSHOT,
+    TAG_PARENT_AMI,
+    TAG_SOURCE_AMI,
+    TAG_SOURCE_SNAPSHOT,
 )
 
+# Phases of an update session, recorded in the session journal.
+PHASE_INSTANCES = 'instances'
+PHASE_UPDATED = 'updated'
+
 log = logging.getLogger(__name__)
 
 
@@ -57,7 +65,17 @@ def update_ami(aws_svc, encrypted_ami, updater_ami, encrypted_ami_name,
                guest_instance_type='m3.medium',
                updater_instance_type='m3.medium',
                instance_config=None,
-               status_port=encryptor_service.ENCRYPTOR_STATUS_PORT):
+               status_port=encryptor_service.ENCRYPTOR_STATUS_PORT,
+               journal=None):
+    """ Update the given encrypted AMI with a new metavisor.
+
+    :param journal a brkt_cli.journal.Journal.  If specified, each phase is
+        recorded in the journal as it completes.  If the journal already
+        has completed phases, the session resumes after the last one.
+        brkt_cli.journal.keep_resources() decides whether an interrupted
+        session's resources are kept.
+    :return the id of the updated AMI
+    """
     encrypted_guest = None
     updater = None
     mv_root_id = None
@@ -65,198 +83,290 @@ def update_ami(aws_svc, encrypted_ami, updater_ami, encrypted_ami_name,
     if instance_config is None:
         instance_config = InstanceConfig()
 
+    interrupted = False
     try:
         guest_image = aws_svc.get_image(encrypted_ami)
 
-        # Step 1. Launch encrypted guest AMI
-        # Use 'updater' mode to avoid chain loading the guest
-        # automatically. We just want this AMI/instance up as the
-        # base to create a new AMI and preserve license
-        # information embedded in the guest AMI
-        log.info("Launching encrypted guest/updater")
-
-        instance_config.brkt_config['solo_mode'] = 'updater'
-        instance_config.brkt_config['status_port'] = status_port
-
-        encrypted_guest = aws_svc.run_instance(
-            encrypted_ami,
-            instance_type=guest_instance_type,
-            ebs_optimized=False,
-            subnet_id=subnet_id,
-            user_data=json.dumps(instance_config.brkt_config))
-        aws_svc.create_tags(
-            encrypted_guest.id,
-            name=NAME_GUEST_CREATOR,
-            description=DESCRIPTION_GUEST_CREATOR % {'image_id': encrypted_ami}
-        )
-        # Run updater in same zone as guest so we can swap volumes
-
-        user_data = instance_config.make_userdata()
-        compressed_user_data = gzip_user_data(user_data)
-
-        # If the user didn't specify a security group, create a temporary
-        # security group that allows brkt-cli to get status from the updater.
-        run_instance = aws_svc.run_instance
-        if not security_group_ids:
-            vpc_id = None
-            if subnet_id:
-                subnet = aws_svc.get_subnet(subnet_id)
-                vpc_id = subnet.vpc_id
-            temp_sg_id = create_encryptor_security_group(
-                aws_svc, vpc_id=vpc_id, status_port=status_port).id
-            security_group_ids = [temp_sg_id]
-
-            # Wrap with a retry, to handle eventual consistency issues with
-            # the newly-created group.
-            run_instance = aws_svc.retry(
-                aws_svc.run_instance,
-                error_code_regexp='InvalidGroup\.NotFound'
-            )
+        if journal and journal.completed(PHASE_INSTANCES):
+            log.info('Resuming update session %s', aws_svc.session_id)
+            encrypted_guest = aws_svc.get_instance(
+                journal.get('encrypted_guest_id'))
+            updater = aws_svc.get_instance(journal.get('updater_id'))
+            temp_sg_id = journal.get('temp_sg_id')
+        else:
+            with trace.span('launch_updater', updater_ami=updater_ami):
+                # Step 1. Launch encrypted guest AMI
+                # Use 'updater' mode to avoid chain loading the guest
+                # automatically. We just want this AMI/instance up as the
+                # base to create a new AMI and preserve license
+                # information embedded in the guest AMI
+                log.info("Launching encrypted guest/updater")
 
-        updater = run_instance(
-            updater_ami,
-            instance_type=updater_instance_type,
-            user_data=compressed_user_data,
-            ebs_optimized=False,
-            subnet_id=subnet_id,
-            placement=encrypted_guest.placement,
-            security_group_ids=security_group_ids)
-        aws_svc.create_tags(
-            updater.id,
-            name=NAME_METAVISOR_UPDATER,
-            description=DESCRIPTION_METAVISOR_UPDATER,
-        )
-        wait_for_instance(aws_svc, encrypted_guest.id, state="running")
-        log.info("Launched guest: %s Updater: %s" %
-             (encrypted_guest.id, updater.id)
-        )
-
-        # Step 2. Wait for the updater to finish and stop the instances
-        aws_svc.stop_instance(encrypted_guest.id)
-
-        updater = wait_for_instance(aws_svc, updater.id, state="running")
-        host_ips = []
-        if updater.ip_address:
-            host_ips.append(updater.ip_address)
-        if updater.private_ip_address:
-            host_ips.append(updater.private_ip_address)
-            log.info('Adding %s to NO_PROXY environment variable' %
-                 updater.private_ip_address)
-            if os.environ.get('NO_PROXY'):
-                os.environ['NO_PROXY'] += "," + \
-                    updater.private_ip_address
-            else:
-                os.environ['NO_PROXY'] = updater.private_ip_address
-
-        enc_svc = enc_svc_class(host_ips, port=status_port)
-        log.info('Waiting for updater service on %s (port %s on %s)',
-                 updater.id, enc_svc.port, ', '.join(host_ips))
-        wait_for_encryptor_up(enc_svc, Deadline(600))
-        try:
-            wait_for_encryption(enc_svc)
-        except Exception as e:
-            # Stop the updater instance, to make the console log available.
-            encrypt_ami.stop_and_wait(aws_svc, updater.id)
-
-            log_exception_console(aws_svc, e, updater.id)
-            raise
-
-        aws_svc.stop_instance(updater.id)
-        encrypted_guest = wait_for_instance(
-            aws_svc, encrypted_guest.id, state="stopped")
-        updater = wait_for_instance(aws_svc, updater.id, state="stopped")
-
-        guest_bdm = encrypted_guest.block_device_mapping
-        updater_bdm = updater.block_device_mapping
-
-        # Step 3. Detach old BSD drive(s) and delete from encrypted guest
-        d_list = [encrypted_guest.root_device_name]
-        for d in d_list:
-            log.info("Detaching old metavisor disk: %s from %s" %
-                (guest_bdm[d].volume_id, encrypted_guest.id))
-            aws_svc.detach_volume(guest_bdm[d].volume_id,
-                    instance_id=encrypted_guest.id,
+                instance_config.brkt_config['solo_mode'] = 'updater'
+                instance_config.brkt_config['status_port'] = status_port
+
+                encrypted_guest = aws_svc.run_instance(
+                    encrypted_ami,
+                    instance_type=guest_instance_type,
+                    ebs_optimized=False,
+                    subnet_id=subnet_id,
+                    user_data=json.dumps(instance_config.brkt_config))
+                aws_svc.create_tags(
+                    encrypted_guest.id,
+                    name=NAME_GUEST_CREATOR,
+                    description=(
+                        DESCRIPTION_GUEST_CREATOR % {'image_id': encrypted_ami}
+                    )
+                )
+                # Run updater in same zone as guest so we can swap volumes
+
+                user_data = instance_config.make_userdata()
+                compressed_user_data = gzip_user_data(user_data)
+
+                # If the user didn't specify a security group, create a
+                # temporary security group that allows brkt-cli to get status
+                # from the updater.
+                run_instance = aws_svc.run_instance
+                if not security_group_ids:
+                    vpc_id = None
+                    if subnet_id:
+                        subnet = aws_svc.get_subnet(subnet_id)
+                        vpc_id = subnet.vpc_id
+                    temp_sg_id = create_encryptor_security_group(
+                        aws_svc, vpc_id=vpc_id, status_port=status_port).id
+                    security_group_ids = [temp_sg_id]
+
+                    # Wrap with a retry, to handle eventual consistency issues
+                    # with the newly-created group.
+                    run_instance = aws_svc.retry(
+                        aws_svc.run_instance,
+                        error_code_regexp='InvalidGroup\.NotFound'
+                    )
+
+                updater = run_instance(
+                    updater_ami,
+                    instance_type=updater_instance_type,
+                    user_data=compressed_user_data,
+                    ebs_optimized=False,
+                    subnet_id=subnet_id,
+                    placement=encrypted_guest.placement,
+                    security_group_ids=security_group_ids)
+                aws_svc.create_tags(
+                    updater.id,
+                    name=NAME_METAVISOR_UPDATER,
+                    description=DESCRIPTION_METAVISOR_UPDATER,
+                )
+                wait_for_instance(aws_svc, encrypted_guest.id, state="running")
+                log.info("Launched guest: %s Updater: %s" %
+                     (encrypted_guest.id, updater.id)
+                )
+                record_phase(
+                    journal, PHASE_INSTANCES,
+                    encrypted_guest_id=encrypted_guest.id,
+                    updater_id=updater.id,
+                    temp_sg_id=temp_sg_id
+                )
+
+        if not (journal and journal.completed(PHASE_UPDATED)):
+            with trace.span('wait_for_update'):
+                # Step 2. Wait for the updater to finish and stop the instances
+                aws_svc.stop_instance(encrypted_guest.id)
+
+                updater = wait_for_instance(
+                    aws_svc, updater.id, state="running")
+                host_ips = []
+                if updater.ip_address:
+                    host_ips.append(updater.ip_address)
+                if updater.private_ip_address:
+                    host_ips.append(updater.private_ip_address)
+                    log.info('Adding %s to NO_PROXY environment variable' %
+                         updater.private_ip_address)
+                    if os.environ.get('NO_PROXY'):
+                        os.environ['NO_PROXY'] += "," + \
+                            updater.private_ip_address
+                    else:
+                        os.environ['NO_PROXY'] = updater.private_ip_address
+
+                enc_svc = enc_svc_class(host_ips, port=status_port)
+                log.info('Waiting for updater service on %s (port %s on %s)',
+                         updater.id, enc_svc.port, ', '.join(host_ips))
+                wait_for_encryptor_up(enc_svc, Deadline(600))
+                try:
+                    wait_for_encryption(enc_svc)
+                except util.CancelledError:
+                    raise
+                except Exception as e:
+                    # Stop the updater instance, to make the console log
+                    # available.
+                    encrypt_ami.stop_and_wait(aws_svc, updater.id)
+
+                    log_exception_console(aws_svc, e, updater.id)
+                    raise
+                record_phase(journal, PHASE_UPDATED)
+
+        with trace.span('create_image'):
+            aws_svc.stop_instance(updater.id)
+            encrypted_guest = wait_for_instance(
+                aws_svc, encrypted_guest.id, state="stopped")
+            updater = wait_for_instance(aws_svc, updater.id, state="stopped")
+
+            guest_bdm = encrypted_guest.block_device_mapping
+            updater_bdm = updater.block_device_mapping
+
+            # A resumed session may have already swapped the Metavisor
+            # root volume and created the new AMI.
+            ami = None
+            old_mv_root_deleted = False
+            mv_root_detached = False
+            mv_root_attached = False
+            if journal:
+                ami = journal.get('ami_id')
+                mv_root_id = journal.get('mv_root_id')
+                old_mv_root_deleted = journal.get('old_mv_root_deleted', False)
+                mv_root_detached = journal.get('mv_root_detached', False)
+                mv_root_attached = journal.get('mv_root_attached', False)
+
+            # Step 3. Detach old BSD drive(s) and delete from encrypted guest
+            d_list = [encrypted_guest.root_device_name]
+            if not old_mv_root_deleted:
+                for d in d_list:
+                    log.info("Detaching old metavisor disk: %s from %s" %
+                        (guest_bdm[d].volume_id, encrypted_guest.id))
+                    aws_svc.detach_volume(guest_bdm[d].volume_id,
+                            instance_id=encrypted_guest.id,
+                            force=True
+                    )
+                    aws_svc.delete_volume(guest_bdm[d].volume_id)
+                if journal:
+                    journal.save(old_mv_root_deleted=True)
+
+            # Step 4. Snapshot MV volume(s)
+            log.info("Creating snapshots")
+            # Use guest_instance as base instance for create_image
+            boot_snap_name = NAME_METAVISOR_ROOT_SNAPSHOT
+            root_device_name = guest_image.root_device_name
+            guest_root = '/dev/sdf'
+            d_list.append(guest_root)
+
+            # Preserve volume type for any additional attached volumes
+            for d in guest_bdm.keys():
+                if d not in d_list:
+                    log.debug("Preserving volume type for disk %s", d)
+                    vol_id = guest_bdm[d].volume_id
+                    vol = aws_svc.get_volume(vol_id)
+                    guest_bdm[d].volume_type = vol.type
+
+            # Step 5. Move new MV boot disk to base instance
+            if not mv_root_id:
+                mv_root_id = updater_bdm['/dev/sda1'].volume_id
+                if journal:
+                    journal.save(mv_root_id=mv_root_id)
+            if not mv_root_detached:
+                log.info("Detach boot volume from %s" % (updater.id,))
+                aws_svc.detach_volume(mv_root_id,
+                    instance_id=updater.id,
                     force=True
+                )
+                if journal:
+                    journal.save(mv_root_detached=True)
+
+            # Step 6. Attach new boot disk to guest instance
+            if not mv_root_attached:
+                log.info("Attaching new metavisor boot disk: %s to %s" %
+                    (mv_root_id, encrypted_guest.id)
+                )
+                aws_svc.attach_volume(
+                    mv_root_id, encrypted_guest.id, root_device_name)
+                if journal:
+                    journal.save(mv_root_attached=True)
+            encrypted_guest = encrypt_ami.wait_for_volume_attached(
+                aws_svc, encrypted_guest.id, root_device_name)
+            guest_bdm[root_device_name] = \
+                encrypted_guest.block_device_mapping[root_device_name]
+            guest_bdm[root_device_name].delete_on_termination = True
+            guest_bdm[root_device_name].volume_type = 'gp2'
+            guest_root_vol_id = guest_bdm[guest_root].volume_id
+            guest_root_vol = aws_svc.get_volume(guest_root_vol_id)
+            guest_bdm[guest_root].volume_type = guest_root_vol.type
+            if guest_root_vol.type == 'io1':
+                guest_bdm[guest_root].iops = guest_root_vol.iops
+
+            # Step 7. Create new AMI. Preserve billing/license info
+            if ami:
+                log.info('Using AMI %s, created before the session was '
+                         'interrupted', ami)
+            else:
+                log.info("Creating new AMI")
+                ami = aws_svc.create_image(
+                    encrypted_guest.id,
+                    encrypted_ami_name,
+                    description=guest_image.description,
+                    no_reboot=True,
+                    block_device_mapping=guest_bdm
+                )
+                if journal:
+                    journal.save(ami_id=ami)
+            image = wait_for_image(aws_svc, ami)
+            # Carry the lineage of the original AMI forward.
+            lineage = {TAG_PARENT_AMI: encrypted_ami}
+            for key in (TAG_SOURCE_AMI, TAG_SOURCE_SNAPSHOT):
+                if guest_image.tags.get(key):
+                    lineage[key] = guest_image.tags[key]
+            aws_svc.create_tags(
+                image.block_device_mapping[root_device_name].snapshot_id,
+                name=boot_snap_name,
             )
-            aws_svc.delete_volume(guest_bdm[d].volume_id)
-
-        # Step 4. Snapshot MV volume(s)
-        log.info("Creating snapshots")
-        # Use guest_instance as base instance for create_image
-        boot_snap_name = NAME_METAVISOR_ROOT_SNAPSHOT
-        root_device_name = guest_image.root_device_name
-        guest_root = '/dev/sdf'
-        d_list.append(guest_root)
-
-        # Preserve volume type for any additional attached volumes
-        for d in guest_bdm.keys():
-            if d not in d_list:
-                log.debug("Preserving volume type for disk %s", d)
-                vol_id = guest_bdm[d].volume_id
-                vol = aws_svc.get_volume(vol_id)
-                guest_bdm[d].volume_type = vol.type
-
-        # Step 5. Move new MV boot disk to base instance
-        log.info("Detach boot volume from %s" % (updater.id,))
-        mv_root_id = updater_bdm['/dev/sda1'].volume_id
-        aws_svc.detach_volume(mv_root_id,
-            instance_id=updater.id,
-            force=True
-        )
-
-        # Step 6. Attach new boot disk to guest instance
-        log.info("Attaching new metavisor boot disk: %s to %s" %
-            (mv_root_id, encrypted_guest.id)
-        )
-        aws_svc.attach_volume(mv_root_id, encrypted_guest.id, root_device_name)
-        encrypted_guest = encrypt_ami.wait_for_volume_attached(
-            aws_svc, encrypted_guest.id, root_device_name)
-        guest_bdm[root_device_name] = \
-            encrypted_guest.block_device_mapping[root_device_name]
-        guest_bdm[root_device_name].delete_on_termination = True
-        guest_bdm[root_device_name].volume_type = 'gp2'
-        guest_root_vol_id = guest_bdm[guest_root].volume_id
-        guest_root_vol = aws_svc.get_volume(guest_root_vol_id)
-        guest_bdm[guest_root].volume_type = guest_root_vol.type
-        if guest_root_vol.type == 'io1':
-            guest_bdm[guest_root].iops = guest_root_vol.iops
-
-        # Step 7. Create new AMI. Preserve billing/license info
-        log.info("Creating new AMI")
-        ami = aws_svc.create_image(
-            encrypted_guest.id,
-            encrypted_ami_name,
-            description=guest_image.description,
-            no_reboot=True,
-            block_device_mapping=guest_bdm
-        )
-        wait_for_image(aws_svc, ami)
-        image = aws_svc.get_image(ami, retry=True)
-        aws_svc.create_tags(
-            image.block_device_mapping[root_device_name].snapshot_id,
-            name=boot_snap_name,
-        )
-        aws_svc.create_tags(
-            image.block_device_mapping[guest_root].snapshot_id,
-            name=NAME_ENCRYPTED_ROOT_SNAPSHOT,
-        )
-        aws_svc.create_tags(ami)
+            aws_svc.create_tags(
+                image.block_device_mapping[guest_root].snapshot_id,
+                name=NAME_ENCRYPTED_ROOT_SNAPSHOT,
+            )
+            aws_svc.create_tags(ami, tags=lineage)
         return ami
+    except (IOError, KeyboardInterrupt) as e:
+        # The user interrupted the session, or we lost our connection to
+        # AWS or the updater.  Keep the resources around if the session
+        # can be resumed.
+        interrupted = keep_resources(journal, e)
+        raise
     finally:
-        instance_ids = set()
-        volume_ids = set()
-        sg_ids = set()
-
-        if encrypted_guest:
-            instance_ids.add(encrypted_guest.id)
-        if updater:
-            instance_ids.add(updater.id)
-        if mv_root_id:
-            volume_ids.add(mv_root_id)
-        if temp_sg_id:
-            sg_ids.add(temp_sg_id)
-
-        clean_up(aws_svc,
-                 instance_ids=instance_ids,
-                 volume_ids=volume_ids,
-                 security_group_ids=sg_ids)
+        if interrupted:
+            log.error(
+                'Update session %s was interrupted.  Run update with '
+                '--resume %s to continue.',
+                aws_svc.session_id, aws_svc.session_id
+            )
+        # A resumed session only reuses the instances and security group
+        # if they were recorded in the journal.
+        if not (interrupted and journal.completed(PHASE_INSTANCES)):
+            instance_ids = set()
+            volume_ids = set()
+            sg_ids = set()
+
+            if encrypted_guest:
+                instance_ids.add(encrypted_guest.id)
+            if updater:
+                instance_ids.add(updater.id)
+            if mv_root_id:
+                volume_ids.add(mv_root_id)
+            if temp_sg_id:
+                sg_ids.add(temp_sg_id)
+
+            with trace.span('clean_up'):
+                clean_up(aws_svc,
+                         instance_ids=instance_ids,
+                         volume_ids=volume_ids,
+                         security_group_ids=sg_ids)
+            if journal and not interrupted:
+                journal.delete()
+
+
+def update_ami_async(aws_svc, encrypted_ami, updater_ami, encrypted_ami_name,
+                     **kwargs):
+    """ Run update_ami() in the background.  Call cancel() on the returned
+    Future to stop the update and clean up its resources.
+
+    :return a util.Future that holds the id of the updated AMI
+    """
+    return util.run_async(
+        update_ami, aws_svc, encrypted_ami, updater_ami, encrypted_ami_name,
+        **kwargs)
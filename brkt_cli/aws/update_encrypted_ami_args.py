@@ -21,6 +21,27 @@ def setup_update_encrypted_ami(parser):
         metavar='ID',
         help='The encrypted AMI that will be updated'
     )
+    parser.add_argument(
+        '--resume',
+        metavar='SESSION',
+        dest='resume',
+        help=(
+            'Resume an interrupted update session, starting after '
+            'the last phase that completed'
+        )
+    )
+    parser.add_argument(
+        '--keep-session',
+        dest='keep_session',
+        action='store_true',
+        default=False,
+        help=(
+            'If the session loses its connection to AWS or the encryptor, '
+            'keep its instances and snapshots so that it can be continued '
+            'with --resume.  Sessions that are interrupted with Ctrl-C are '
+            'always kept'
+        )
+    )
     parser.add_argument(
         '--encrypted-ami-name',
         metavar='NAME',
@@ -129,3 +150,11 @@ def setup_update_encrypted_ami(parser):
         help=argparse.SUPPRESS,
         default=0.25
     )
+    # Share the API rate limit with other brkt-cli processes that use the
+    # same file.
+    parser.add_argument(
+        '--rate-limit-file',
+        metavar='PATH',
+        dest='rate_limit_file',
+        help=argparse.SUPPRESS
+    )
@@ -0,0 +1,193 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Poll many encryptors with a fixed number of threads.
+
+encryptor_service.wait_for_encryption() normally polls one encryptor from
+the calling thread.  When many encryptions run at once, an
+EncryptorMonitor polls all of them instead.  One scheduler thread keeps
+the targets in a heap ordered by the time of their next poll, and hands
+due polls to a small pool of worker threads.  The number of threads
+doesn't depend on the number of encryptors, so the monitor works the
+same for AWS, GCE and ESX encryptors.
+
+Each call to watch() returns a util.Future that completes when
+encryption finishes or fails.  Cancelling the Future stops polling that
+encryptor.  Optional callbacks are called when the encryptor changes
+state.
+"""
+
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+
+from brkt_cli import encryptor_service, util
+
+DEFAULT_MAX_WORKERS = 8
+
+log = logging.getLogger(__name__)
+
+
+class _Target(object):
+
+    def __init__(self, enc_svc, watcher, future, on_state_change,
+                 poll_interval):
+        self.enc_svc = enc_svc
+        self.watcher = watcher
+        self.future = future
+        self.on_state_change = on_state_change
+        self.poll_interval = poll_interval
+        self.state = None
+
+
+class EncryptorMonitor(object):
+    """ Polls the status of many encryptors.  Thread-safe. """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS,
+                 poll_interval=encryptor_service.STATUS_POLL_INTERVAL,
+                 clock=time.time):
+        """
+        :param max_workers: the maximum number of status requests that are
+            in flight at the same time
+        :param poll_interval: the default number of seconds between polls
+            of each encryptor
+        """
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pool = util.WorkerPool(max_workers)
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, enc_svc, on_state_change=None,
+              progress_timeout=encryptor_service.ENCRYPTION_PROGRESS_TIMEOUT,
+              poll_interval=None):
+        """ Start polling the given encryptor.
+
+        :param enc_svc: a BaseEncryptorService
+        :param on_state_change: called with (enc_svc, old_state, status)
+            on the first status and whenever the state changes.  old_state
+            is None for the first status.
+        :param poll_interval: overrides the monitor's poll interval for
+            this encryptor
+        :return a util.Future that holds the final status, or raises
+            EncryptionError if encryption fails
+        """
+        watcher = encryptor_service.EncryptionWatcher(
+            enc_svc, progress_timeout=progress_timeout)
+        target = _Target(
+            enc_svc, watcher, util.Future(), on_state_change,
+            poll_interval or self.poll_interval)
+        with self._condition:
+            if self._stopped:
+                raise util.BracketError('Encryptor monitor has been stopped')
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        self._schedule(target, self.clock())
+        return target.future
+
+    def _schedule(self, target, when):
+        with self._condition:
+            if not self._stopped:
+                heapq.heappush(
+                    self._heap, (when, next(self._sequence), target))
+                self._condition.notify()
+                return
+        _fail(target, util.BracketError('Encryptor monitor was stopped'))
+
+    def _reschedule(self, target):
+        interval = target.poll_interval
+        if not util.SLEEP_ENABLED:
+            # Unit tests don't wait between polls.
+            interval = 0
+        self._schedule(target, self.clock() + interval)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                if not self._heap:
+                    # Wait in short intervals, so that stop() is noticed.
+                    self._condition.wait(1.0)
+                    continue
+                delay = self._heap[0][0] - self.clock()
+                if delay > 0:
+                    self._condition.wait(min(delay, 1.0))
+                    continue
+                _, _, target = heapq.heappop(self._heap)
+            try:
+                self._pool.submit(self._poll, target)
+            except util.BracketError as e:
+                # The monitor was stopped.
+                _fail(target, e)
+
+    def _poll(self, target):
+        if target.future.cancel_requested():
+            _fail(target, util.CancelledError('Cancelled'))
+            return
+        try:
+            try:
+                status = target.enc_svc.get_status()
+            except Exception as e:
+                target.watcher.on_error(e)
+                self._reschedule(target)
+                return
+
+            old_state = target.state
+            target.state = status['state']
+            if target.on_state_change and old_state != target.state:
+                try:
+                    target.on_state_change(target.enc_svc, old_state, status)
+                except Exception:
+                    log.exception('State change callback failed')
+
+            if target.watcher.on_status(status):
+                target.future.set_result(status)
+                return
+        except:
+            target.future.set_exception(sys.exc_info())
+            return
+        self._reschedule(target)
+
+    def stop(self):
+        """ Stop polling.  Futures for encryptors that are still being
+        watched raise BracketError.
+        """
+        with self._condition:
+            self._stopped = True
+            targets = [t for _, _, t in self._heap]
+            self._heap = []
+            self._condition.notify()
+            thread = self._thread
+        if thread and thread is not threading.current_thread():
+            thread.join(5.0)
+        self._pool.shutdown(wait=False)
+        for target in targets:
+            _fail(target, util.BracketError('Encryptor monitor was stopped'))
+
+
+def _fail(target, e):
+    try:
+        raise e
+    except:
+        target.future.set_exception(sys.exc_info())
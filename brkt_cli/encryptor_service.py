@@ -13,12 +13,16 @@
 # limitations under the License.
 
 import abc
+import httplib
 import json
 import logging
+import Queue
+import threading
 import time
-import urllib2
+import urllib
+import urlparse
 
-from brkt_cli import validation
+from brkt_cli import progress, util, validation
 from brkt_cli.util import (
     BracketError,
     Deadline,
@@ -34,6 +38,15 @@ ENCRYPT_FAILED = 'failed'
 ENCRYPT_ENCRYPTING = 'encrypting'
 ENCRYPTOR_STATUS_PORT = 80
 
+# Ask the status server to push updates as server-sent events.
+CONTENT_TYPE_EVENT_STREAM = 'text/event-stream'
+
+# Close the status stream if nothing arrives for this many seconds.
+STREAM_IDLE_TIMEOUT = 60
+
+# Stop trying to stream status after this many failures in a row.
+MAX_STREAM_FAILURES = 3
+
 FAILURE_CODE_AWS_PERMISSIONS = 'insufficient_aws_permissions'
 FAILURE_CODE_GET_YETI_CONFIG = 'failed_get_yeti_config'
 FAILURE_CODE_INVALID_NTP_SERVERS = 'invalid_ntp_servers'
@@ -73,6 +86,20 @@ class BaseEncryptorService(object):
     def get_status(self):
         pass
 
+    def wait_for_update(self, timeout):
+        """ Wait up to timeout seconds for the encryptor to push a new
+        status.  Services that don't support push just sleep.
+
+        :return the new status, or None if there was no update and the
+            caller should call get_status()
+        """
+        sleep(timeout)
+        return None
+
+    def close(self):
+        """ Release any connections to the encryptor. """
+        pass
+
 
 class EncryptorConnectionError(Exception):
 
@@ -89,7 +116,181 @@ class EncryptorConnectionError(Exception):
         super(EncryptorConnectionError, self).__init__(msg)
 
 
+def _parse_status(data):
+    info = json.loads(data)
+    info['percent_complete'] = 0
+    bytes_total = info.get('bytes_total')
+    if info['state'] == ENCRYPT_SUCCESSFUL:
+        info['percent_complete'] = 100
+    elif ((bytes_total is not None) and
+          (bytes_total > 0)):
+        ratio = float(info['bytes_written']) / info['bytes_total']
+        info['percent_complete'] = int(100 * ratio)
+    return info
+
+
+class _StatusConnection(object):
+    """ An HTTP connection to the status server on one host.  The
+    connection is kept open between requests.  If an HTTP proxy is
+    configured for the host, the connection goes through the proxy.
+    """
+
+    def __init__(self, hostname, port, timeout):
+        self.hostname = hostname
+        self.path = '/'
+        connect_host, connect_port = hostname, port
+        proxy = urllib.getproxies().get('http')
+        if proxy and not urllib.proxy_bypass(hostname):
+            parsed = urlparse.urlparse(proxy)
+            connect_host, connect_port = parsed.hostname, parsed.port or 80
+            self.path = 'http://%s:%d/' % (hostname, port)
+        self.conn = httplib.HTTPConnection(
+            connect_host, connect_port, timeout=timeout)
+
+    def get(self):
+        """ Return the body of the status response.
+
+        :raise IOError if the request fails
+        """
+        try:
+            self.conn.request('GET', self.path)
+            r = self.conn.getresponse()
+            data = r.read()
+        except httplib.HTTPException as e:
+            raise IOError('HTTP error: %r' % e)
+        if r.status != 200:
+            raise IOError('HTTP status %d' % r.status)
+        return data
+
+    def close(self):
+        self.conn.close()
+
+
+class _StreamingNotSupported(Exception):
+    pass
+
+
+def _read_line(response):
+    """ Read one line from an HTTP response, without the line ending.
+
+    :return the line, or None at the end of the response
+    """
+    chars = []
+    while True:
+        # Read one byte at a time, so that we don't block waiting for data
+        # that the server hasn't sent yet.  httplib handles chunked
+        # encoding.
+        c = response.read(1)
+        if not c:
+            return None
+        if c == '\n':
+            return ''.join(chars).rstrip('\r')
+        chars.append(c)
+
+
+class _StatusStream(object):
+    """ Receives status updates that the status server pushes as
+    server-sent events.  A background thread reads the events and queues
+    the data of each one.
+    """
+
+    def __init__(self, hostname, port, idle_timeout):
+        """
+        :param idle_timeout: close the stream if the server sends nothing
+            for this many seconds
+        :raise _StreamingNotSupported if the server responds with a
+            regular status document
+        :raise IOError if the request fails
+        """
+        self.connection = _StatusConnection(hostname, port, idle_timeout)
+        self._updates = Queue.Queue()
+        conn = self.connection.conn
+        try:
+            conn.request(
+                'GET', self.connection.path,
+                headers={'Accept': CONTENT_TYPE_EVENT_STREAM})
+            self.response = conn.getresponse()
+        except httplib.HTTPException as e:
+            self.close()
+            raise IOError('HTTP error: %r' % e)
+        content_type = self.response.getheader('Content-Type', '')
+        if (self.response.status != 200 or
+                not content_type.startswith(CONTENT_TYPE_EVENT_STREAM)):
+            self.close()
+            raise _StreamingNotSupported(
+                'HTTP status %d, Content-Type %s' %
+                (self.response.status, content_type))
+
+        t = threading.Thread(target=self._read_events)
+        t.daemon = True
+        t.start()
+
+    def _read_events(self):
+        data = []
+        try:
+            while True:
+                line = _read_line(self.response)
+                if line is None:
+                    break
+                if line.startswith('data:'):
+                    data.append(line[5:].lstrip())
+                elif not line and data:
+                    self._updates.put('\n'.join(data))
+                    data = []
+            self._updates.put(IOError('Status stream ended'))
+        except (IOError, httplib.HTTPException) as e:
+            self._updates.put(IOError('Status stream failed: %s' % e))
+
+    def get(self, timeout):
+        """ Wait for the next event.
+
+        :return the event data, or None if the timeout expired
+        :raise IOError if the stream has ended
+        """
+        end = time.time() + timeout
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return None
+            try:
+                # Wait in short intervals, so that Ctrl-C and cancellation
+                # work.
+                update = self._updates.get(True, min(1.0, remaining))
+            except Queue.Empty:
+                util.check_cancelled()
+                continue
+            if isinstance(update, IOError):
+                raise update
+            return update
+
+    def close(self):
+        self.connection.close()
+
+
 class EncryptorService(BaseEncryptorService):
+    """ Gets the encryption status from the status server on the
+    encryptor instance.
+
+    The first request is sent to all hostnames at the same time, and the
+    first host that responds is used from then on.  An unreachable
+    hostname, such as a public IP address that isn't routable from here,
+    doesn't delay the polls.  The connection to that host is kept alive
+    between polls, and is reopened if it fails.
+
+    Once a host is known, wait_for_update() asks it to push status
+    updates as server-sent events, so that state changes are seen as soon
+    as they happen.  If the server doesn't support streaming, or the
+    stream fails repeatedly, wait_for_update() falls back to sleeping
+    between polls.
+    """
+
+    def __init__(self, hostnames, port=ENCRYPTOR_STATUS_PORT,
+                 streaming=True):
+        super(EncryptorService, self).__init__(hostnames, port)
+        self._connection = None
+        self._streaming = streaming
+        self._stream = None
+        self._stream_failures = 0
 
     def is_encryptor_up(self):
         try:
@@ -100,42 +301,119 @@ class EncryptorService(BaseEncryptorService):
             log.debug("Couldn't get encryptor status: %s", e)
             return False
 
-    def get_status(self, timeout_secs=2):
-        exceptions_by_host = {}
-        info = None
-        successful_hostname = None
+    def _race(self, timeout_secs):
+        """ Request the status from all hostnames concurrently.
 
-        for hostname in self.hostnames:
-            url = 'http://%s:%d' % (hostname, self.port)
+        :return a tuple of the connection to the first host that
+            responded, and the response body
+        :raise EncryptorConnectionError if no host responded
+        """
+        results = Queue.Queue()
+        lock = threading.Lock()
+        winner = []
+
+        def _connect(hostname):
+            connection = _StatusConnection(hostname, self.port, timeout_secs)
             try:
-                r = urllib2.urlopen(url, timeout=timeout_secs)
-                data = r.read()
+                data = connection.get()
             except IOError as e:
                 log.debug(
                     'Unable to connect to %s:%s - %s',
                     hostname, self.port, e)
+                connection.close()
+                results.put((hostname, None, None, e))
+                return
+            with lock:
+                won = not winner
+                winner.append(hostname)
+            if not won:
+                # Another host responded first.
+                connection.close()
+                connection = None
+            results.put((hostname, connection, data, None))
+
+        for hostname in self.hostnames:
+            util.run_async(_connect, hostname)
+
+        exceptions_by_host = {}
+        for _ in self.hostnames:
+            # Wait in short intervals, so that Ctrl-C works.
+            while True:
+                try:
+                    hostname, connection, data, e = results.get(True, 1.0)
+                    break
+                except Queue.Empty:
+                    pass
+            if connection:
+                return connection, data
+            if e:
                 exceptions_by_host[hostname] = e
-                continue
+        raise EncryptorConnectionError(self.port, exceptions_by_host)
 
-            info = json.loads(data)
-            info['percent_complete'] = 0
-            bytes_total = info.get('bytes_total')
-            if info['state'] == ENCRYPT_SUCCESSFUL:
-                info['percent_complete'] = 100
-            elif ((bytes_total is not None) and
-                  (bytes_total > 0)):
-                ratio = float(info['bytes_written']) / info['bytes_total']
-                info['percent_complete'] = int(100 * ratio)
-            successful_hostname = hostname
-            break
-
-        if info:
-            # Don't try the other hostnames again, now that we have one that
-            # is known to work.
-            self.hostnames = [successful_hostname]
-            return info
-        else:
-            raise EncryptorConnectionError(self.port, exceptions_by_host)
+    def get_status(self, timeout_secs=2):
+        data = None
+        if self._connection:
+            try:
+                data = self._connection.get()
+            except IOError as e:
+                log.debug(
+                    'Lost connection to %s:%s - %s',
+                    self._connection.hostname, self.port, e)
+                self.close()
+
+        if data is None:
+            self._connection, data = self._race(timeout_secs)
+            # Don't try the other hostnames again, now that we have one
+            # that is known to work.
+            self.hostnames = [self._connection.hostname]
+        return _parse_status(data)
+
+    def _stream_failed(self, e):
+        log.debug('Status stream from %s:%s failed: %s',
+                  self.hostnames[0], self.port, e)
+        self._close_stream()
+        self._stream_failures += 1
+        if self._stream_failures >= MAX_STREAM_FAILURES:
+            log.debug('Falling back to polling for encryptor status')
+            self._streaming = False
+
+    def _close_stream(self):
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+    def wait_for_update(self, timeout):
+        if self._streaming and not self._stream and self._connection:
+            try:
+                self._stream = _StatusStream(
+                    self._connection.hostname, self.port,
+                    STREAM_IDLE_TIMEOUT)
+                log.debug('Streaming status from %s:%s',
+                          self._connection.hostname, self.port)
+            except _StreamingNotSupported as e:
+                log.debug('Status streaming is not supported: %s', e)
+                self._streaming = False
+            except IOError as e:
+                self._stream_failed(e)
+
+        if not self._stream:
+            sleep(timeout)
+            return None
+        try:
+            data = self._stream.get(timeout)
+        except IOError as e:
+            self._stream_failed(e)
+            return None
+        if data is None:
+            return None
+        self._stream_failures = 0
+        return _parse_status(data)
+
+    def close(self):
+        self._close_stream()
+        if self._connection:
+            self._connection.close()
+            self._connection = None
 
 
 def wait_for_encryptor_up(enc_svc, deadline):
@@ -198,66 +476,161 @@ def _handle_failure_code(failure_code):
     raise EncryptionError(msg)
 
 
-def wait_for_encryption(enc_svc,
-                        progress_timeout=ENCRYPTION_PROGRESS_TIMEOUT):
-    err_count = 0
-    max_errs = 10
-    start_time = time.time()
-    last_log_time = start_time
-    progress_deadline = Deadline(progress_timeout)
-    last_progress = 0
-    last_state = ''
-
-    while err_count < max_errs:
-        try:
-            status = enc_svc.get_status()
-            err_count = 0
-        except Exception as e:
-            log.warn("Failed getting encryption status: %s", e)
-            log.warn("Retrying. . .")
-            err_count += 1
-            sleep(10)
-            continue
+# Give up after this many consecutive failures to get the status.
+MAX_STATUS_ERRORS = 10
+
+# Seconds between status checks.
+STATUS_POLL_INTERVAL = 10
 
+
+class EncryptionWatcher(object):
+    """ Follows the status of one encryptor: logs progress, makes sure
+    that progress doesn't stall, and decides when encryption is done.
+    The caller gets the status and passes it to on_status(), or passes
+    the exception to on_error() if it couldn't get the status.
+    """
+
+    def __init__(self, enc_svc, progress_timeout=ENCRYPTION_PROGRESS_TIMEOUT,
+                 max_errors=MAX_STATUS_ERRORS):
+        self.enc_svc = enc_svc
+        self.progress_timeout = progress_timeout
+        self.max_errors = max_errors
+        self.err_count = 0
+        self.last_log_time = time.time()
+        self.progress_deadline = Deadline(progress_timeout)
+        self.last_progress = 0
+        self.last_state = ''
+        self.tracker = None
+        self.progress_event = None
+
+    def on_error(self, e):
+        """ Handle a failure to get the status.
+
+        :raise EncryptionError after max_errors consecutive failures
+        """
+        log.warn("Failed getting encryption status: %s", e)
+        self.err_count += 1
+        if self.err_count >= self.max_errors:
+            # Assume that the server has crashed.
+            raise EncryptionError('Encryption service unavailable')
+        log.warn("Retrying. . .")
+
+    def on_status(self, status):
+        """ Handle a status returned by the encryptor.
+
+        :return True if encryption completed successfully
+        :raise EncryptionError if encryption failed or stalled
+        """
+        self.err_count = 0
         state = status['state']
         percent_complete = status['percent_complete']
         log.debug('state=%s, percent_complete=%d', state, percent_complete)
 
+        # Track throughput separately for each state, since the byte
+        # counts start over when the state changes.
+        if state != self.last_state:
+            self.tracker = progress.ProgressTracker(
+                hosts=self.enc_svc.hostnames)
+            self.progress_event = None
+        if status.get('bytes_total'):
+            self.progress_event = self.tracker.update(
+                status.get('bytes_written', 0), status['bytes_total'],
+                state=state, bytes_read=status.get('bytes_read'))
+
         # Make sure that encryption progress hasn't stalled.
-        if progress_deadline.is_expired():
-            raise EncryptionError(
+        if self.progress_deadline.is_expired():
+            msg = (
                 'Waited for encryption progress for longer than %s seconds' %
-                progress_timeout
+                self.progress_timeout
             )
-        if percent_complete > last_progress or state != last_state:
-            last_progress = percent_complete
-            last_state = state
-            progress_deadline = Deadline(progress_timeout)
+            event = self.progress_event
+            if event and event.get('read_mb_per_sec') is not None:
+                msg += (
+                    '.  The encryptor was reading the unencrypted volume '
+                    'at %.1f MB/s' % event['read_mb_per_sec'])
+            raise EncryptionError(msg)
+        if percent_complete > self.last_progress or state != self.last_state:
+            self.last_progress = percent_complete
+            self.last_state = state
+            self.progress_deadline = Deadline(self.progress_timeout)
 
         # Log progress once a minute.
         now = time.time()
-        if now - last_log_time >= 60:
-            if state == ENCRYPT_INITIALIZING:
-                log.info('Encryption process is initializing')
-            else:
-                state_display = 'Encryption'
-                if state == ENCRYPT_DOWNLOADING:
-                    state_display = 'Download from cloud storage'
-                log.info(
-                    '%s is %d%% complete', state_display, percent_complete)
-            last_log_time = now
+        if now - self.last_log_time >= 60:
+            self._log_progress(state, percent_complete)
+            self.last_log_time = now
 
         if state == ENCRYPT_SUCCESSFUL:
             log.info('Encrypted root drive created.')
-            return
+            return True
         elif state == ENCRYPT_FAILED:
             log.error('Encryption status: %s', json.dumps(status))
             _handle_failure_code(status.get('failure_code'))
+        return False
+
+    def _log_progress(self, state, percent_complete):
+        if state == ENCRYPT_INITIALIZING:
+            log.info('Encryption process is initializing')
+            return
+        state_display = 'Encryption'
+        if state == ENCRYPT_DOWNLOADING:
+            state_display = 'Download from cloud storage'
+        msg = '%s is %d%% complete' % (state_display, percent_complete)
+        event = self.progress_event
+        if event and event['mb_per_sec']:
+            msg += ' (%.1f MB/s' % event['mb_per_sec']
+            if event.get('read_mb_per_sec') is not None:
+                msg += ', reading at %.1f MB/s' % event['read_mb_per_sec']
+            if event['eta_seconds'] is not None:
+                msg += ', %s remaining' % progress.format_eta(
+                    event['eta_seconds'])
+            msg += ')'
+        log.info(msg)
+
 
-        sleep(10)
-    # We've failed to get encryption status for _max_errs_ consecutive tries.
-    # Assume that the server has crashed.
-    raise EncryptionError('Encryption service unavailable')
+def wait_for_encryption(enc_svc,
+                        progress_timeout=ENCRYPTION_PROGRESS_TIMEOUT,
+                        monitor=None):
+    """ Wait for the encryptor to finish.
+
+    :param monitor: a brkt_cli.encryptor_monitor.EncryptorMonitor.  If
+        specified, the monitor polls the encryptor, instead of this thread
+    :raise EncryptionError if encryption fails
+    """
+    try:
+        if monitor:
+            future = monitor.watch(enc_svc, progress_timeout=progress_timeout)
+            try:
+                while not future.wait(1.0):
+                    util.check_cancelled()
+            except util.CancelledError:
+                future.cancel()
+                raise
+            future.result()
+        else:
+            _wait_for_encryption(enc_svc, progress_timeout)
+    finally:
+        enc_svc.close()
+
+
+def _wait_for_encryption(enc_svc, progress_timeout):
+    watcher = EncryptionWatcher(enc_svc, progress_timeout=progress_timeout)
+    update = None
+
+    while True:
+        try:
+            if update:
+                status = update
+            else:
+                status = enc_svc.get_status()
+        except Exception as e:
+            watcher.on_error(e)
+            sleep(STATUS_POLL_INTERVAL)
+            continue
+
+        if watcher.on_status(status):
+            return
+        update = enc_svc.wait_for_update(STATUS_POLL_INTERVAL)
 
 
 def status_port(value):
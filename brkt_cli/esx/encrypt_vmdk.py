@@ -27,6 +27,7 @@ Before running brkt encrypt-vmdk, do "pip install pyvmomi".
 """
 
 import logging
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     wait_for_encryptor_up,
     wait_for_encryption,
@@ -76,8 +77,9 @@ def create_ovf_image_from_mv_vm(vc_swc, enc_svc_cls, vm, guest_vmdk,
         # wait for encryption to complete
         host_ips = [ip_addr]
         enc_svc = enc_svc_cls(host_ips, port=status_port)
-        wait_for_encryptor_up(enc_svc, Deadline(600))
-        wait_for_encryption(enc_svc)
+        with trace.span('wait_for_encryption'):
+            wait_for_encryptor_up(enc_svc, Deadline(600))
+            wait_for_encryption(enc_svc)
         # reconnect to vcenter
         try:
             vc_swc.connect()
@@ -92,23 +94,24 @@ def create_ovf_image_from_mv_vm(vc_swc, enc_svc_cls, vm, guest_vmdk,
         # detach serial port
         if serial_port_file_name is not None:
             vc_swc.delete_serial_port_to_file(vm, serial_port_file_name)
-        if ((create_ovf is True) or (create_ova is True)):
-            log.info("Creating images")
-            if target_path is None:
-                raise Exception("Cannot create ova/ovf as target path is None")
-            ovf = vc_swc.export_to_ovf(vm, target_path, ovf_name=image_name)
-            if create_ova is True:
-                if ovftool_path is not None:
-                    ova = vc_swc.convert_ovf_to_ova(ovftool_path, ovf)
-                    print(ova)
+        with trace.span('create_image'):
+            if ((create_ovf is True) or (create_ova is True)):
+                log.info("Creating images")
+                if target_path is None:
+                    raise Exception("Cannot create ova/ovf as target path is None")
+                ovf = vc_swc.export_to_ovf(vm, target_path, ovf_name=image_name)
+                if create_ova is True:
+                    if ovftool_path is not None:
+                        ova = vc_swc.convert_ovf_to_ova(ovftool_path, ovf)
+                        print(ova)
+                else:
+                    print(ovf)
             else:
-                print(ovf)
-        else:
-            # clone the vm to create template
-            if vc_swc.is_esx_host() is False:
-                log.info("Creating the template VM")
-                template_vm = vc_swc.clone_vm(vm, vm_name=vm_name, template=True)
-                print(vc_swc.get_vm_name(template_vm))
+                # clone the vm to create template
+                if vc_swc.is_esx_host() is False:
+                    log.info("Creating the template VM")
+                    template_vm = vc_swc.clone_vm(vm, vm_name=vm_name, template=True)
+                    print(vc_swc.get_vm_name(template_vm))
     except EncryptionError as e:
         log.exception("Failed to encrypt the image with error %s", e)
         try:
@@ -13,6 +13,7 @@
 # limitations under the License.
 import logging
 import os
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     wait_for_encryptor_up,
     wait_for_encryption,
@@ -46,57 +47,59 @@ def update_ovf_image_mv_vm(vc_swc, enc_svc_cls, guest_vm, mv_vm,
         enc_svc = enc_svc_cls(host_ips, port=status_port)
         log.info('Waiting for updater service on port %s on %s',
                  enc_svc.port, ', '.join(host_ips))
-        wait_for_encryptor_up(enc_svc, Deadline(600))
-        try:
-            wait_for_encryption(enc_svc)
-        except Exception as e:
-            log.exception("Update failed with error %s", e)
-            raise
-        # Power off the VMs
-        vc_swc.power_off(guest_vm)
-        vc_swc.power_off(mv_vm)
-        # Detach disks from guest_vm
-        guest_old_disk = vc_swc.detach_disk(guest_vm, unit_number=1)
-        mv_old_disk = vc_swc.detach_disk(guest_vm, unit_number=0)
-        # Get the new MV disk
-        new_disk = vc_swc.get_disk(mv_vm, unit_number=0)
-        # Clone and attach new MV disk to guest VM
-        log.info("Cloning Metavisor disk")
-        u_disk_name = vc_swc.clone_disk(new_disk, dest_disk=mv_old_disk)
-        # Add disks to guest VM
-        vc_swc.add_disk(guest_vm, filename=u_disk_name, unit_number=0)
-        vc_swc.add_disk(guest_vm, filename=vc_swc.get_disk_name(guest_old_disk),
-                        unit_number=1)
-        if ((ovf_name) or (ova_name)):
-            if(ova_name):
-                ovf_name = ova_name
-            log.info("Creating images")
-            if target_path is None:
-                raise Exception("Cannot create ova/ovf as target path is None")
-            if (ova_name):
-                # delete the old mf file
-                os.remove(os.path.join(target_path, ova_name + ".mf"))
-            # import the new OVF
-            ovf = vc_swc.export_to_ovf(guest_vm, target_path, ovf_name=ovf_name)
-            if ova_name:
-                if ovftool_path is not None:
-                    # delete the old ova
-                    os.remove(os.path.join(target_path, ova_name + ".ova"))
-                    ova = vc_swc.convert_ovf_to_ova(ovftool_path, ovf)
-                    print(ova)
+        with trace.span('wait_for_update'):
+            wait_for_encryptor_up(enc_svc, Deadline(600))
+            try:
+                wait_for_encryption(enc_svc)
+            except Exception as e:
+                log.exception("Update failed with error %s", e)
+                raise
+        with trace.span('create_image'):
+            # Power off the VMs
+            vc_swc.power_off(guest_vm)
+            vc_swc.power_off(mv_vm)
+            # Detach disks from guest_vm
+            guest_old_disk = vc_swc.detach_disk(guest_vm, unit_number=1)
+            mv_old_disk = vc_swc.detach_disk(guest_vm, unit_number=0)
+            # Get the new MV disk
+            new_disk = vc_swc.get_disk(mv_vm, unit_number=0)
+            # Clone and attach new MV disk to guest VM
+            log.info("Cloning Metavisor disk")
+            u_disk_name = vc_swc.clone_disk(new_disk, dest_disk=mv_old_disk)
+            # Add disks to guest VM
+            vc_swc.add_disk(guest_vm, filename=u_disk_name, unit_number=0)
+            vc_swc.add_disk(guest_vm, filename=vc_swc.get_disk_name(guest_old_disk),
+                            unit_number=1)
+            if ((ovf_name) or (ova_name)):
+                if(ova_name):
+                    ovf_name = ova_name
+                log.info("Creating images")
+                if target_path is None:
+                    raise Exception("Cannot create ova/ovf as target path is None")
+                if (ova_name):
+                    # delete the old mf file
+                    os.remove(os.path.join(target_path, ova_name + ".mf"))
+                # import the new OVF
+                ovf = vc_swc.export_to_ovf(guest_vm, target_path, ovf_name=ovf_name)
+                if ova_name:
+                    if ovftool_path is not None:
+                        # delete the old ova
+                        os.remove(os.path.join(target_path, ova_name + ".ova"))
+                        ova = vc_swc.convert_ovf_to_ova(ovftool_path, ovf)
+                        print(ova)
+                else:
+                    print(ovf)
             else:
-                print(ovf)
-        else:
-            # delete the old vm template
-            log.info("Deleting the old template")
-            template_vm = vc_swc.find_vm(template_vm_name)
-            if (template_vm):
-                vc_swc.destroy_vm(template_vm)
-            # clone the vm to create template
-            log.info("Creating the template VM")
-            template_vm = vc_swc.clone_vm(guest_vm, vm_name=template_vm_name,
-                                          template=True)
-            print(vc_swc.get_vm_name(template_vm))
+                # delete the old vm template
+                log.info("Deleting the old template")
+                template_vm = vc_swc.find_vm(template_vm_name)
+                if (template_vm):
+                    vc_swc.destroy_vm(template_vm)
+                # clone the vm to create template
+                log.info("Creating the template VM")
+                template_vm = vc_swc.clone_vm(guest_vm, vm_name=template_vm_name,
+                                              template=True)
+                print(vc_swc.get_vm_name(template_vm))
     except Exception as e:
         log.exception("Failed to update the image with error %s", e)
         raise
@@ -4,6 +4,7 @@ import httplib
 import logging
 import socket
 
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     ENCRYPTOR_STATUS_PORT,
     wait_for_encryption,
@@ -137,17 +138,20 @@ def encrypt(gce_svc, enc_svc_cls, image_id, encryptor_image,
         encrypted_image_disk = 'encrypted-image-' + gce_svc.get_session_id()
 
         # create guest root disk and blank disk to dd to
-        setup_encryption(gce_svc, image_id, encrypted_image_disk,
-                         instance_name, zone, image_project)
+        with trace.span('setup_encryption', image_id=image_id):
+            setup_encryption(gce_svc, image_id, encrypted_image_disk,
+                             instance_name, zone, image_project)
 
         # run encryptor instance with avatar_creator as root,
         # customer image and blank disk
-        do_encryption(gce_svc, enc_svc_cls, zone, encryptor, encryptor_image,
-                      instance_name, instance_config, encrypted_image_disk,
-                      network, subnetwork, status_port=status_port)
+        with trace.span('encryption'):
+            do_encryption(gce_svc, enc_svc_cls, zone, encryptor, encryptor_image,
+                          instance_name, instance_config, encrypted_image_disk,
+                          network, subnetwork, status_port=status_port)
 
         # create image
-        create_image(gce_svc, zone, encrypted_image_disk, encrypted_image_name, encryptor)
+        with trace.span('create_image'):
+            create_image(gce_svc, zone, encrypted_image_disk, encrypted_image_name, encryptor)
 
         return encrypted_image_name
     except errors.HttpError as e:
@@ -157,4 +161,5 @@ def encrypt(gce_svc, enc_svc_cls, image_id, encryptor_image,
             log.info("Not cleaning up")
             return
         log.info("Cleaning up")
-        gce_svc.cleanup(zone, encryptor_image, keep_encryptor)
+        with trace.span('clean_up'):
+            gce_svc.cleanup(zone, encryptor_image, keep_encryptor)
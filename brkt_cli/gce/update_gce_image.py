@@ -14,6 +14,7 @@
 
 import logging
 
+from brkt_cli import trace
 from brkt_cli.encryptor_service import (
     ENCRYPTOR_STATUS_PORT,
     wait_for_encryption,
@@ -55,52 +56,56 @@ def update_gce_image(gce_svc, enc_svc_cls, image_id, encryptor_image,
         # Create disk from encrypted guest snapshot. This disk
         # won't be altered. It will be re-snapshotted and paired
         # with the new encryptor image.
-        gce_svc.disk_from_snapshot(zone, image_id, encrypted_image_disk)
-        gce_svc.wait_for_disk(zone, encrypted_image_disk)
-        log.info("Creating snapshot of encrypted image disk")
-        gce_svc.create_snapshot(zone, encrypted_image_disk, encrypted_image_name)
-        snap_created = True
+        with trace.span('snapshot_guest', image_id=image_id):
+            gce_svc.disk_from_snapshot(zone, image_id, encrypted_image_disk)
+            gce_svc.wait_for_disk(zone, encrypted_image_disk)
+            log.info("Creating snapshot of encrypted image disk")
+            gce_svc.create_snapshot(zone, encrypted_image_disk, encrypted_image_name)
+            snap_created = True
 
-        log.info("Launching encrypted updater")
-        instance_config.brkt_config['solo_mode'] = 'updater'
-        user_data = gce_metadata_from_userdata(instance_config.make_userdata())
-        gce_svc.run_instance(zone,
-                             updater,
-                             encryptor_image,
-                             network=network,
-                             subnet=subnetwork,
-                             disks=[],
-                             delete_boot=False,
-                             metadata=user_data)
-        ip = gce_svc.get_instance_ip(updater, zone)
-        updater_launched = True
+        with trace.span('launch_updater'):
+            log.info("Launching encrypted updater")
+            instance_config.brkt_config['solo_mode'] = 'updater'
+            user_data = gce_metadata_from_userdata(instance_config.make_userdata())
+            gce_svc.run_instance(zone,
+                                 updater,
+                                 encryptor_image,
+                                 network=network,
+                                 subnet=subnetwork,
+                                 disks=[],
+                                 delete_boot=False,
+                                 metadata=user_data)
+            ip = gce_svc.get_instance_ip(updater, zone)
+            updater_launched = True
         enc_svc = enc_svc_cls([ip], port=status_port)
 
-        # wait for updater to finish and guest root disk
-        wait_for_encryptor_up(enc_svc, Deadline(600))
-        log.info(
-            'Waiting for updater service on %s (%s:%s)',
-            updater, ip, enc_svc.port
-        )
-        try:
-            wait_for_encryption(enc_svc)
-        except:
-            raise
+        with trace.span('wait_for_update'):
+            # wait for updater to finish and guest root disk
+            wait_for_encryptor_up(enc_svc, Deadline(600))
+            log.info(
+                'Waiting for updater service on %s (%s:%s)',
+                updater, ip, enc_svc.port
+            )
+            try:
+                wait_for_encryption(enc_svc)
+            except:
+                raise
 
-        # delete updater instance
-        log.info('Deleting updater instance')
-        gce_svc.delete_instance(zone, updater)
-        updater_launched = False
+        with trace.span('create_image'):
+            # delete updater instance
+            log.info('Deleting updater instance')
+            gce_svc.delete_instance(zone, updater)
+            updater_launched = False
 
-        # wait for updater root disk
-        gce_svc.wait_for_detach(zone, updater)
+            # wait for updater root disk
+            gce_svc.wait_for_detach(zone, updater)
 
-        # create image from mv root disk and snapshot
-        # encrypted guest root disk
-        log.info("Creating updated metavisor image")
-        gce_svc.create_gce_image_from_disk(zone, encrypted_image_name, updater)
-        gce_svc.wait_image(encrypted_image_name)
-        gce_svc.wait_snapshot(encrypted_image_name)
+            # create image from mv root disk and snapshot
+            # encrypted guest root disk
+            log.info("Creating updated metavisor image")
+            gce_svc.create_gce_image_from_disk(zone, encrypted_image_name, updater)
+            gce_svc.wait_image(encrypted_image_name)
+            gce_svc.wait_snapshot(encrypted_image_name)
     except:
         if updater_launched:
             f = gce_svc.write_serial_console_file(zone, updater)
@@ -0,0 +1,181 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-disk checkpoints for long-running sessions.
+
+A journal records the phases of an encryption or update session that have
+completed, along with the ids of the resources that were created.  If the
+process dies, the session can be resumed from the last completed phase
+with the --resume option.  Journals are stored as JSON files in
+~/.brkt/sessions, named after the session id.
+
+A session that fails is cleaned up as usual.  Its resources are only kept
+for a later --resume when the user interrupts it with Ctrl-C, or when the
+journal was created with keep_session=True and the session loses its
+connection with an IOError.
+"""
+
+import errno
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from brkt_cli.validation import ValidationError
+
+JOURNAL_DIR = os.path.expanduser(os.path.join('~', '.brkt', 'sessions'))
+
+log = logging.getLogger(__name__)
+
+
+def _get_path(session_id, directory):
+    return os.path.join(directory or JOURNAL_DIR, session_id + '.json')
+
+
+class Journal(object):
+    """ The completed phases of a session, and the values that were
+    recorded when each phase completed.  Every call to record() rewrites
+    the journal file atomically.
+    """
+
+    def __init__(self, session_id, command, directory=None,
+                 keep_session=False):
+        """
+        :param keep_session if True, keep the session's resources when
+            it's interrupted by an IOError, so that it can be resumed
+        """
+        self.session_id = session_id
+        self.command = command
+        self.keep_session = keep_session
+        self.directory = directory or JOURNAL_DIR
+        self.path = _get_path(session_id, self.directory)
+        self.phases = []
+        self.values = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, session_id, command, directory=None, keep_session=False):
+        """ Load the journal for the given session.
+
+        :raise ValidationError if the journal does not exist, can't be
+            read, or was written by a different command
+        """
+        path = _get_path(session_id, directory)
+        try:
+            with open(path) as f:
+                d = json.load(f)
+        except (IOError, ValueError) as e:
+            log.debug('Unable to load %s: %s', path, e)
+            raise ValidationError(
+                'Unable to load the journal for session %s' % session_id)
+
+        if d.get('command') != command:
+            raise ValidationError(
+                'Session %s was started by the %s command' %
+                (session_id, d.get('command')))
+
+        journal = cls(
+            session_id, command, directory=directory,
+            keep_session=keep_session)
+        journal.phases = d.get('phases', [])
+        journal.values = d.get('values', {})
+        return journal
+
+    def completed(self, phase):
+        return phase in self.phases
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def record(self, phase, **values):
+        """ Mark the phase as completed, save the given values, and write
+        the journal to disk.
+        """
+        self._update(phase, values)
+        log.debug('Session %s completed phase %s', self.session_id, phase)
+
+    def save(self, **values):
+        """ Save the ids of resources that were created while a phase is
+        in progress, so that a resumed session can reuse them.
+        """
+        self._update(None, values)
+
+    def _update(self, phase, values):
+        with self._lock:
+            self.values.update(values)
+            if phase and phase not in self.phases:
+                self.phases.append(phase)
+            try:
+                self._write()
+            except (IOError, OSError) as e:
+                # Don't fail the session because we can't checkpoint it.
+                log.warn('Unable to write %s: %s', self.path, e)
+
+    def _write(self):
+        try:
+            os.makedirs(self.directory, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        d = {
+            'session_id': self.session_id,
+            'command': self.command,
+            'phases': self.phases,
+            'values': self.values
+        }
+        f = tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix='.' + self.session_id, delete=False)
+        try:
+            json.dump(d, f, indent=2, sort_keys=True)
+            f.close()
+            os.rename(f.name, self.path)
+        except:
+            f.close()
+            _unlink_noraise(f.name)
+            raise
+
+    def delete(self):
+        """ Delete the journal file, after the session has finished. """
+        _unlink_noraise(self.path)
+
+
+def record_phase(journal, phase, **values):
+    """ Record the phase in the journal, if journaling is enabled for this
+    session.
+    """
+    if journal:
+        journal.record(phase, **values)
+
+
+def keep_resources(journal, exception):
+    """ Return True if the resources of a session that was interrupted by
+    the given exception should be kept, so that the session can be
+    resumed.
+    """
+    if not journal:
+        return False
+    if isinstance(exception, KeyboardInterrupt):
+        return True
+    return journal.keep_session and isinstance(exception, IOError)
+
+
+def _unlink_noraise(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            log.debug('Unable to delete %s: %s', path, e)
@@ -0,0 +1,223 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Report encryption throughput and estimated time to completion.
+
+The encryptor's status server reports how many bytes have been written
+so far.  wait_for_encryption() passes each status to a ProgressTracker,
+which computes the throughput over a moving window and the time that's
+left at that rate.  If the throughput drops to a fraction of its peak,
+for example because a gp2 volume ran out of burst credits, the tracker
+reports a collapse long before the encryptor stops making progress
+entirely.
+
+If the status also reports how many bytes the encryptor has read from
+the unencrypted volume, the event includes the read throughput.  A read
+rate that stays far below the volume's throughput usually means that
+EBS is loading blocks of the snapshot from S3 on first access.
+
+Each update is published as an event: a dictionary with a "type" field.
+Code that embeds brkt-cli can receive events by calling add_listener().
+When the --progress-file option is specified, brkt_cli.main() writes
+events to the file, one JSON document per line.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+EVENT_PROGRESS = 'encryption_progress'
+EVENT_THROUGHPUT_COLLAPSE = 'throughput_collapse'
+
+# Throughput is averaged over this many seconds.
+DEFAULT_WINDOW_SECONDS = 60.0
+
+# Throughput below this fraction of the peak is a collapse.
+DEFAULT_COLLAPSE_RATIO = 0.25
+
+BYTES_PER_MB = 1024 * 1024
+
+log = logging.getLogger(__name__)
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+def add_listener(listener):
+    """ Call listener(event) for each event that is published. """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def publish(event):
+    """ Send the event to all listeners.  Listeners that raise an
+    exception are logged and otherwise ignored.
+    """
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(event)
+        except Exception:
+            log.exception('Unable to publish %s event', event.get('type'))
+
+
+class JSONLinesWriter(object):
+    """ A listener that writes each event to a file object as one line of
+    JSON.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, sort_keys=True)
+        with self._lock:
+            self.f.write(line + '\n')
+            self.f.flush()
+
+
+class ProgressTracker(object):
+    """ Computes throughput and time remaining from a series of
+    (bytes_written, bytes_total) samples.
+    """
+
+    def __init__(self, window_seconds=DEFAULT_WINDOW_SECONDS,
+                 collapse_ratio=DEFAULT_COLLAPSE_RATIO, clock=time.time,
+                 **attributes):
+        """
+        :param attributes: included in every event, for example the id of
+            the encryptor instance
+        """
+        self.window_seconds = window_seconds
+        self.collapse_ratio = collapse_ratio
+        self.clock = clock
+        self.attributes = attributes
+        self.peak_bytes_per_sec = 0.0
+        self.collapsed = False
+        self._samples = collections.deque()
+
+    def _bytes_per_sec(self, index=1):
+        """ Return the average throughput over the window, or None if the
+        samples don't span enough time yet.
+
+        :param index: the index of the byte count in each sample, 1 for
+            bytes written and 2 for bytes read
+        """
+        first = self._samples[0]
+        last = self._samples[-1]
+        elapsed = last[0] - first[0]
+        if elapsed <= 0 or first[index] is None or last[index] is None:
+            return None
+        return max(0.0, float(last[index] - first[index]) / elapsed)
+
+    def update(self, bytes_written, bytes_total, state=None,
+               bytes_read=None):
+        """ Add a sample and publish an encryption_progress event.  If
+        throughput has collapsed since the last update, also publish a
+        throughput_collapse event.
+
+        :param bytes_read: the number of bytes read from the unencrypted
+            volume, if the encryptor reports it
+        :return the progress event
+        """
+        now = self.clock()
+        self._samples.append((now, bytes_written, bytes_read))
+        # Keep one sample at or before the start of the window, so that
+        # the average covers the whole window.
+        while (len(self._samples) > 2 and
+               self._samples[1][0] <= now - self.window_seconds):
+            self._samples.popleft()
+
+        bytes_per_sec = self._bytes_per_sec()
+        eta_seconds = None
+        window_full = (
+            now - self._samples[0][0] >= self.window_seconds / 2)
+
+        if bytes_per_sec is not None and window_full:
+            self.peak_bytes_per_sec = max(
+                self.peak_bytes_per_sec, bytes_per_sec)
+        if bytes_per_sec and bytes_total:
+            eta_seconds = int(
+                max(0, bytes_total - bytes_written) / bytes_per_sec)
+
+        percent_complete = 0
+        if bytes_total:
+            percent_complete = int(100 * float(bytes_written) / bytes_total)
+
+        event = self._event(
+            EVENT_PROGRESS,
+            state=state,
+            bytes_written=bytes_written,
+            bytes_total=bytes_total,
+            percent_complete=percent_complete,
+            mb_per_sec=_to_mb(bytes_per_sec),
+            peak_mb_per_sec=_to_mb(self.peak_bytes_per_sec),
+            eta_seconds=eta_seconds
+        )
+        if bytes_read is not None:
+            event['bytes_read'] = bytes_read
+            event['read_mb_per_sec'] = _to_mb(self._bytes_per_sec(index=2))
+        publish(event)
+
+        if bytes_per_sec is not None and window_full:
+            self._check_collapse(bytes_per_sec, event)
+        return event
+
+    def _check_collapse(self, bytes_per_sec, progress_event):
+        threshold = self.peak_bytes_per_sec * self.collapse_ratio
+        if not self.collapsed and bytes_per_sec < threshold:
+            self.collapsed = True
+            log.warn(
+                'Encryption throughput dropped to %.1f MB/s from a peak of '
+                '%.1f MB/s.  The volume may have run out of burst credits.',
+                _to_mb(bytes_per_sec), _to_mb(self.peak_bytes_per_sec))
+            event = dict(progress_event)
+            event['type'] = EVENT_THROUGHPUT_COLLAPSE
+            publish(event)
+        elif self.collapsed and bytes_per_sec >= threshold:
+            self.collapsed = False
+            log.info(
+                'Encryption throughput recovered to %.1f MB/s',
+                _to_mb(bytes_per_sec))
+
+    def _event(self, event_type, **fields):
+        event = dict(self.attributes)
+        event.update(fields)
+        event['type'] = event_type
+        event['time'] = round(self.clock(), 3)
+        return event
+
+
+def _to_mb(bytes_per_sec):
+    if bytes_per_sec is None:
+        return None
+    return round(bytes_per_sec / BYTES_PER_MB, 2)
+
+
+def format_eta(seconds):
+    """ Format a number of seconds as H:MM:SS. """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
@@ -0,0 +1,100 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from brkt_cli import encryptor_service, util
+from brkt_cli.encryptor_monitor import EncryptorMonitor
+from brkt_cli.test_encryptor_service import (
+    DummyEncryptorService,
+    FailedEncryptionService
+)
+
+
+class StuckEncryptorService(DummyEncryptorService):
+
+    def get_status(self):
+        return {
+            'state': encryptor_service.ENCRYPT_ENCRYPTING,
+            'percent_complete': 10
+        }
+
+
+class TestEncryptorMonitor(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.monitor = EncryptorMonitor(max_workers=2)
+
+    def tearDown(self):
+        self.monitor.stop()
+
+    def test_many_encryptors(self):
+        """ Test that many encryptors are polled with a bounded number of
+        threads, and that state changes are reported.
+        """
+        changes = []
+
+        def _on_state_change(enc_svc, old_state, status):
+            changes.append((enc_svc, old_state, status['state']))
+
+        services = [DummyEncryptorService() for _ in range(50)]
+        futures = [
+            self.monitor.watch(svc, on_state_change=_on_state_change)
+            for svc in services
+        ]
+        for future in futures:
+            status = future.result(timeout=10)
+            self.assertEqual(encryptor_service.ENCRYPT_SUCCESSFUL,
+                             status['state'])
+        self.assertTrue(len(self.monitor._pool._threads) <= 2)
+
+        svc_changes = [c for c in changes if c[0] is services[0]]
+        self.assertEqual(
+            [
+                (None, encryptor_service.ENCRYPT_ENCRYPTING),
+                (encryptor_service.ENCRYPT_ENCRYPTING,
+                 encryptor_service.ENCRYPT_SUCCESSFUL)
+            ],
+            [c[1:] for c in svc_changes]
+        )
+
+    def test_failure(self):
+        future = self.monitor.watch(FailedEncryptionService(['test-host']))
+        with self.assertRaises(encryptor_service.EncryptionError):
+            future.result(timeout=10)
+
+    def test_cancel(self):
+        future = self.monitor.watch(StuckEncryptorService())
+        future.cancel()
+        with self.assertRaises(util.CancelledError):
+            future.result(timeout=10)
+
+    def test_stop(self):
+        future = self.monitor.watch(
+            StuckEncryptorService(), poll_interval=3600)
+        self.monitor.stop()
+        with self.assertRaises(util.BracketError):
+            future.result(timeout=10)
+        with self.assertRaises(util.BracketError):
+            self.monitor.watch(StuckEncryptorService())
+
+    def test_wait_for_encryption(self):
+        """ Test that wait_for_encryption() uses the monitor. """
+        encryptor_service.wait_for_encryption(
+            DummyEncryptorService(), monitor=self.monitor)
+        with self.assertRaises(encryptor_service.EncryptionError):
+            encryptor_service.wait_for_encryption(
+                FailedEncryptionService(['test-host']),
+                monitor=self.monitor
+            )
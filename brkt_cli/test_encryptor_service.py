@@ -11,6 +11,12 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and
 # limitations under the License.
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import threading
+import time
 import unittest
 
 import brkt_cli
@@ -141,3 +147,198 @@ class TestEncryptionService(unittest.TestCase):
         for failure_code in failure_codes:
             with self.assertRaises(encryptor_service.EncryptionError):
                 encryptor_service._handle_failure_code(failure_code)
+
+
+class _FakeMetavisorHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.metavisor.connections += 1
+
+    def do_GET(self):
+        metavisor = self.server.metavisor
+        time.sleep(metavisor.delay)
+        accept = self.headers.get('Accept', '')
+        if (metavisor.streaming and
+                encryptor_service.CONTENT_TYPE_EVENT_STREAM in accept):
+            self._stream()
+            return
+
+        body = json.dumps(metavisor.get_status())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        metavisor = self.server.metavisor
+        metavisor.streams += 1
+        self.send_response(200)
+        self.send_header(
+            'Content-Type', encryptor_service.CONTENT_TYPE_EVENT_STREAM)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = 1
+        version = None
+        while not metavisor.stopped:
+            status, version = metavisor.wait_for_change(version)
+            if status is None:
+                continue
+            self.wfile.write('data: %s\n\n' % json.dumps(status))
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose, for example when they lose a race.
+        pass
+
+
+class FakeMetavisor(object):
+    """ A local status server that behaves like the one on the encryptor
+    instance.  If streaming is True, it pushes status updates to clients
+    that ask for server-sent events.
+    """
+
+    def __init__(self, address='127.0.0.1', port=0, streaming=True,
+                 delay=0):
+        self.streaming = streaming
+        self.delay = delay
+        self.connections = 0
+        self.streams = 0
+        self.stopped = False
+        self._status = {
+            'state': encryptor_service.ENCRYPT_ENCRYPTING,
+            'bytes_written': 25,
+            'bytes_total': 100
+        }
+        self._version = 0
+        self._condition = threading.Condition()
+        self.server = _ThreadingHTTPServer(
+            (address, port), _FakeMetavisorHandler)
+        self.server.metavisor = self
+        self.port = self.server.server_address[1]
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def get_status(self):
+        with self._condition:
+            return dict(self._status)
+
+    def set_status(self, **status):
+        with self._condition:
+            self._status.update(status)
+            self._version += 1
+            self._condition.notify_all()
+
+    def wait_for_change(self, version):
+        """ Return the status and its version once it's newer than the
+        given version, or (None, version) after a short wait.
+        """
+        with self._condition:
+            if self._version == version:
+                self._condition.wait(0.1)
+            if self._version == version:
+                return None, version
+            return dict(self._status), self._version
+
+    def stop(self):
+        self.stopped = True
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestEncryptorServiceConnection(unittest.TestCase):
+
+    def setUp(self):
+        brkt_cli.util.SLEEP_ENABLED = False
+        self.saved_environ = dict(os.environ)
+        for name in ('http_proxy', 'HTTP_PROXY'):
+            os.environ.pop(name, None)
+        self.metavisors = []
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved_environ)
+        for metavisor in self.metavisors:
+            metavisor.stop()
+
+    def _start(self, **kwargs):
+        metavisor = FakeMetavisor(**kwargs)
+        self.metavisors.append(metavisor)
+        return metavisor
+
+    def test_race_and_keep_alive(self):
+        """ Test that the first host to respond is used, and that its
+        connection is reused for later requests.
+        """
+        fast = self._start()
+        self._start(address='127.0.0.2', port=fast.port, delay=1.0)
+
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.2', '127.0.0.1'], port=fast.port)
+        start = time.time()
+        status = svc.get_status()
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(25, status['percent_complete'])
+        self.assertEqual(['127.0.0.1'], svc.hostnames)
+
+        svc.get_status()
+        svc.get_status()
+        self.assertEqual(1, fast.connections)
+        svc.close()
+
+    def test_unreachable(self):
+        """ Test that EncryptorConnectionError is raised when no host
+        responds.
+        """
+        metavisor = self._start()
+        metavisor.stop()
+        self.metavisors.remove(metavisor)
+
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.1'], port=metavisor.port)
+        with self.assertRaises(encryptor_service.EncryptorConnectionError):
+            svc.get_status()
+        self.assertFalse(svc.is_encryptor_up())
+
+    def test_streaming(self):
+        """ Test that completion is seen as soon as the status server
+        pushes it, without waiting for the poll interval.
+        """
+        metavisor = self._start()
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.1'], port=metavisor.port)
+
+        def _finish():
+            time.sleep(0.3)
+            metavisor.set_status(
+                state=encryptor_service.ENCRYPT_SUCCESSFUL,
+                bytes_written=100)
+
+        brkt_cli.util.run_async(_finish)
+        start = time.time()
+        encryptor_service.wait_for_encryption(svc)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(1, metavisor.streams)
+
+    def test_streaming_not_supported(self):
+        """ Test that we fall back to polling when the status server
+        doesn't stream.
+        """
+        metavisor = self._start(streaming=False)
+        svc = encryptor_service.EncryptorService(
+            ['127.0.0.1'], port=metavisor.port)
+        svc.get_status()
+        self.assertIsNone(svc.wait_for_update(10))
+        self.assertFalse(svc._streaming)
+        svc.close()
@@ -0,0 +1,104 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import unittest
+
+from brkt_cli import journal
+from brkt_cli.validation import ValidationError
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_load(self):
+        """ Test that recorded phases and values survive a round trip
+        to disk.
+        """
+        j = journal.Journal('abc', 'encrypt', directory=self.directory)
+        j.record('one', instance_id='i-1')
+        j.record('two', snapshot_id='snap-1')
+
+        loaded = journal.Journal.load(
+            'abc', 'encrypt', directory=self.directory)
+        self.assertTrue(loaded.completed('one'))
+        self.assertTrue(loaded.completed('two'))
+        self.assertFalse(loaded.completed('three'))
+        self.assertEqual('i-1', loaded.get('instance_id'))
+        self.assertEqual('snap-1', loaded.get('snapshot_id'))
+        self.assertIsNone(loaded.get('volume_id'))
+
+        # No temp files are left behind.
+        self.assertEqual(['abc.json'], os.listdir(self.directory))
+
+    def test_save(self):
+        """ Test that save() writes values without completing a phase. """
+        j = journal.Journal('abc', 'encrypt', directory=self.directory)
+        j.save(snapshot_id='snap-1')
+
+        loaded = journal.Journal.load(
+            'abc', 'encrypt', directory=self.directory)
+        self.assertEqual([], loaded.phases)
+        self.assertEqual('snap-1', loaded.get('snapshot_id'))
+
+    def test_load_errors(self):
+        """ Test that we raise ValidationError when the journal is missing
+        or belongs to a different command.
+        """
+        with self.assertRaises(ValidationError):
+            journal.Journal.load('abc', 'encrypt', directory=self.directory)
+
+        j = journal.Journal('abc', 'update', directory=self.directory)
+        j.record('one')
+        with self.assertRaises(ValidationError):
+            journal.Journal.load('abc', 'encrypt', directory=self.directory)
+
+    def test_delete(self):
+        j = journal.Journal('abc', 'encrypt', directory=self.directory)
+        j.record('one')
+        self.assertTrue(os.path.exists(j.path))
+        j.delete()
+        self.assertFalse(os.path.exists(j.path))
+
+        # Deleting twice is harmless.
+        j.delete()
+
+    def test_record_phase(self):
+        """ Test that record_phase() is a no-op when journaling is off. """
+        journal.record_phase(None, 'one', instance_id='i-1')
+
+        j = journal.Journal('abc', 'encrypt', directory=self.directory)
+        journal.record_phase(j, 'one', instance_id='i-1')
+        self.assertTrue(j.completed('one'))
+
+    def test_keep_resources(self):
+        """ Test that resources are kept after Ctrl-C, and after an
+        IOError only if the user asked to keep the session.
+        """
+        self.assertFalse(journal.keep_resources(None, KeyboardInterrupt()))
+
+        j = journal.Journal('abc', 'encrypt', directory=self.directory)
+        self.assertTrue(journal.keep_resources(j, KeyboardInterrupt()))
+        self.assertFalse(journal.keep_resources(j, IOError()))
+        self.assertFalse(journal.keep_resources(j, ValueError()))
+
+        j.keep_session = True
+        self.assertTrue(journal.keep_resources(j, IOError()))
+        self.assertFalse(journal.keep_resources(j, ValueError()))
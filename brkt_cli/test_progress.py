@@ -0,0 +1,155 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import json
+import StringIO
+import unittest
+
+from brkt_cli import encryptor_service, progress, util
+
+MB = progress.BYTES_PER_MB
+
+
+class TestProgressTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.events = []
+        progress.add_listener(self.events.append)
+
+    def tearDown(self):
+        progress.remove_listener(self.events.append)
+
+    def _clock(self):
+        return self.now
+
+    def _tracker(self):
+        return progress.ProgressTracker(
+            window_seconds=60, collapse_ratio=0.25, clock=self._clock,
+            instance_id='i-1')
+
+    def test_throughput_and_eta(self):
+        tracker = self._tracker()
+        event = tracker.update(0, 1000 * MB)
+        self.assertIsNone(event['mb_per_sec'])
+        self.assertIsNone(event['eta_seconds'])
+
+        for i in range(1, 7):
+            self.now += 10
+            event = tracker.update(i * 100 * MB, 1000 * MB)
+        self.assertEqual(10.0, event['mb_per_sec'])
+        self.assertEqual(40, event['eta_seconds'])
+        self.assertEqual(60, event['percent_complete'])
+        self.assertEqual('i-1', event['instance_id'])
+        self.assertEqual(progress.EVENT_PROGRESS, event['type'])
+        self.assertEqual(7, len(self.events))
+
+    def test_collapse(self):
+        """ Test that a drop in throughput is reported once, and that the
+        tracker notices when it recovers.
+        """
+        tracker = self._tracker()
+        written = 0
+        tracker.update(written, 10000 * MB)
+        for _ in range(6):
+            self.now += 10
+            written += 100 * MB
+            tracker.update(written, 10000 * MB)
+
+        # Throughput drops to 1 MB/s.
+        for _ in range(12):
+            self.now += 10
+            written += 10 * MB
+            tracker.update(written, 10000 * MB)
+        collapses = [
+            e for e in self.events
+            if e['type'] == progress.EVENT_THROUGHPUT_COLLAPSE
+        ]
+        self.assertEqual(1, len(collapses))
+        self.assertTrue(tracker.collapsed)
+
+        for _ in range(6):
+            self.now += 10
+            written += 100 * MB
+            tracker.update(written, 10000 * MB)
+        self.assertFalse(tracker.collapsed)
+
+    def test_read_throughput(self):
+        """ Test that read throughput is reported when the encryptor
+        reports the number of bytes read.
+        """
+        tracker = self._tracker()
+        event = tracker.update(0, 1000 * MB)
+        self.assertNotIn('read_mb_per_sec', event)
+
+        tracker = self._tracker()
+        tracker.update(0, 1000 * MB, bytes_read=0)
+        self.now += 10
+        event = tracker.update(100 * MB, 1000 * MB, bytes_read=20 * MB)
+        self.assertEqual(2.0, event['read_mb_per_sec'])
+        self.assertEqual(20 * MB, event['bytes_read'])
+
+    def test_json_lines_writer(self):
+        f = StringIO.StringIO()
+        writer = progress.JSONLinesWriter(f)
+        writer({'type': 'test', 'value': 1})
+        writer({'type': 'test', 'value': 2})
+        lines = f.getvalue().splitlines()
+        self.assertEqual([1, 2], [json.loads(l)['value'] for l in lines])
+
+    def test_format_eta(self):
+        self.assertEqual('0:00:05', progress.format_eta(5))
+        self.assertEqual('1:01:01', progress.format_eta(3661))
+
+
+class ByteCountService(encryptor_service.BaseEncryptorService):
+    """ Reports progress as byte counts. """
+
+    def __init__(self):
+        super(ByteCountService, self).__init__(['test-host'])
+        self.bytes_written = 0
+
+    def is_encryptor_up(self):
+        return True
+
+    def get_status(self):
+        self.bytes_written += 25
+        state = encryptor_service.ENCRYPT_ENCRYPTING
+        if self.bytes_written >= 100:
+            state = encryptor_service.ENCRYPT_SUCCESSFUL
+        return {
+            'state': state,
+            'bytes_written': self.bytes_written,
+            'bytes_total': 100,
+            'percent_complete': self.bytes_written
+        }
+
+
+class TestWaitForEncryption(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.events = []
+        progress.add_listener(self.events.append)
+
+    def tearDown(self):
+        progress.remove_listener(self.events.append)
+
+    def test_events(self):
+        """ Test that wait_for_encryption() publishes progress events. """
+        encryptor_service.wait_for_encryption(ByteCountService())
+        self.assertEqual(
+            [25, 50, 75, 100],
+            [e['bytes_written'] for e in self.events]
+        )
+        self.assertEqual(['test-host'], self.events[0]['hosts'])
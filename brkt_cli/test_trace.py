@@ -0,0 +1,110 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+import json
+import tempfile
+import unittest
+
+from brkt_cli import trace, util
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        trace.enable()
+
+    def tearDown(self):
+        trace.disable()
+
+    def _spans_by_name(self):
+        d = trace._tracer.to_dict()
+        return dict((s['name'], s) for s in d['spans'])
+
+    def test_nested_spans(self):
+        """ Test that counters propagate to enclosing spans. """
+        with trace.span('outer', image_id='ami-1'):
+            trace.count(trace.COUNTER_API_CALLS)
+            with trace.span('inner'):
+                trace.count(trace.COUNTER_API_CALLS, 2)
+                trace.count(trace.COUNTER_RETRIES)
+
+        spans = self._spans_by_name()
+        outer = spans['outer']
+        inner = spans['inner']
+        self.assertEqual(outer['span_id'], inner['parent_span_id'])
+        self.assertIsNone(outer['parent_span_id'])
+        self.assertEqual('ami-1', outer['attributes']['image_id'])
+        self.assertEqual(3, outer['attributes'][trace.COUNTER_API_CALLS])
+        self.assertEqual(1, outer['attributes'][trace.COUNTER_RETRIES])
+        self.assertEqual(2, inner['attributes'][trace.COUNTER_API_CALLS])
+
+    def test_error_status(self):
+        with self.assertRaises(ValueError):
+            with trace.span('failed'):
+                raise ValueError('boom')
+        span = self._spans_by_name()['failed']
+        self.assertEqual(trace.STATUS_ERROR, span['status']['code'])
+        self.assertIn('boom', span['status']['message'])
+
+    def test_retry_counts(self):
+        """ Test that util.retry() counts API calls and retries. """
+        self.attempts = 0
+
+        def _flaky():
+            self.attempts += 1
+            if self.attempts < 3:
+                raise IOError()
+
+        with trace.span('retry'):
+            util.retry(_flaky, on=[IOError])()
+
+        attributes = self._spans_by_name()['retry']['attributes']
+        self.assertEqual(3, attributes[trace.COUNTER_API_CALLS])
+        self.assertEqual(2, attributes[trace.COUNTER_RETRIES])
+
+    def test_run_async(self):
+        """ Test that work on another thread is attributed to the span that
+        submitted it.
+        """
+        def _work():
+            with trace.span('async'):
+                trace.count(trace.COUNTER_API_CALLS)
+
+        with trace.span('parent'):
+            util.run_async(_work).result(timeout=10)
+
+        spans = self._spans_by_name()
+        self.assertEqual(
+            spans['parent']['span_id'], spans['async']['parent_span_id'])
+        self.assertEqual(
+            1, spans['parent']['attributes'][trace.COUNTER_API_CALLS])
+
+    def test_write(self):
+        with trace.span('phase'):
+            pass
+        with tempfile.NamedTemporaryFile() as f:
+            trace.write(f.name)
+            d = json.load(open(f.name))
+        self.assertEqual(1, len(d['spans']))
+        self.assertEqual(d['trace_id'], d['spans'][0]['trace_id'])
+        self.assertTrue(d['spans'][0]['end_time_unix_nano'] >=
+                        d['spans'][0]['start_time_unix_nano'])
+
+    def test_disabled(self):
+        """ Test that spans are no-ops when tracing is disabled. """
+        trace.disable()
+        with trace.span('phase') as s:
+            trace.count(trace.COUNTER_API_CALLS)
+        self.assertIsNone(s)
+        self.assertIsNone(trace.current_span())
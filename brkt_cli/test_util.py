@@ -12,6 +12,7 @@
 # License for the specific language governing permissions and
 # limitations under the License.
 import tempfile
+import threading
 import time
 import unittest
 
@@ -128,6 +129,178 @@ class TestRetry(unittest.TestCase):
         self._get_wrapped(on=[TestException])(5)
         self.assertEqual(6, self.num_calls)
 
+    def test_deadline_per_call(self):
+        """ Test that each call to the wrapper gets the full timeout. """
+        wrapped = self._get_wrapped(timeout=0.1)
+        time.sleep(0.15)
+        wrapped(1)
+        self.assertEqual(2, self.num_calls)
+
+    def test_sleep_seconds(self):
+        """ Test that the sleep interval is bounded by the exponential
+        backoff and the cap.
+        """
+        for attempt in range(1, 50):
+            seconds = util.retry_sleep_seconds(attempt, 0.25, 20.0)
+            self.assertTrue(
+                0 <= seconds <= min(20.0, 0.25 * 2 ** (attempt - 1)))
+        # The cap is never lower than the initial sleep.
+        self.assertTrue(util.retry_sleep_seconds(1, 15.0, 10.0) <= 15.0)
+
+    def test_stats(self):
+        """ Test that calls, retries and failures are counted. """
+        stats = util.retry_stats
+        calls, retries, failures = stats.calls, stats.retries, stats.failures
+        self._get_wrapped()(2)
+        self.assertEqual(calls + 3, stats.calls)
+        self.assertEqual(retries + 2, stats.retries)
+
+        self.num_calls = 0
+        with self.assertRaises(TestException):
+            self._get_wrapped(timeout=0.05)(10, sleep_time=0.02)
+        self.assertEqual(failures + 1, stats.failures)
+
+
+class TestWaitUntil(unittest.TestCase):
+
+    def setUp(self):
+        util.SLEEP_ENABLED = False
+        self.num_calls = 0
+
+    def test_backoff(self):
+        """ Test that the interval grows exponentially up to the maximum,
+        and that jitter stays within bounds.
+        """
+        backoff = util.Backoff(
+            initial_sleep_seconds=1, max_sleep_seconds=5, jitter=0)
+        self.assertEqual([1, 2, 4, 5, 5], [backoff.next() for _ in range(5)])
+
+        backoff = util.Backoff(
+            initial_sleep_seconds=10, max_sleep_seconds=10, jitter=0.2)
+        for _ in range(100):
+            self.assertTrue(8 <= backoff.next() <= 12)
+
+    def test_result(self):
+        def _check():
+            self.num_calls += 1
+            if self.num_calls == 3:
+                return 'done'
+            return None
+
+        policy = util.WaitPolicy(
+            initial_sleep_seconds=1, max_sleep_seconds=1, timeout=10)
+        self.assertEqual('done', util.wait_until(_check, policy))
+        self.assertEqual(3, self.num_calls)
+
+    def test_timeout(self):
+        policy = util.WaitPolicy(
+            initial_sleep_seconds=1, max_sleep_seconds=1, timeout=0)
+        with self.assertRaises(util.BracketError):
+            util.wait_until(lambda: None, policy)
+        with self.assertRaises(TestException):
+            util.wait_until(
+                lambda: None, policy, timeout_error=TestException)
+
+    def test_check_raises(self):
+        """ Test that an exception raised by the check function stops
+        the wait.
+        """
+        def _check():
+            self.num_calls += 1
+            raise TestException()
+
+        policy = util.WaitPolicy(
+            initial_sleep_seconds=1, max_sleep_seconds=1, timeout=10)
+        with self.assertRaises(TestException):
+            util.wait_until(_check, policy)
+        self.assertEqual(1, self.num_calls)
+
+
+class TestFuture(unittest.TestCase):
+
+    def test_result(self):
+        future = util.run_async(lambda x, y: x + y, 1, y=2)
+        self.assertEqual(3, future.result(timeout=5))
+        self.assertTrue(future.done())
+        self.assertIsNone(future.exception())
+
+    def test_exception(self):
+        def _raise():
+            raise TestException()
+
+        future = util.run_async(_raise)
+        self.assertIsInstance(future.exception(timeout=5), TestException)
+        with self.assertRaises(TestException):
+            future.result()
+
+    def test_timeout(self):
+        future = util.run_async(time.sleep, 0.5)
+        self.assertFalse(future.wait(timeout=0.01))
+        with self.assertRaises(util.BracketError):
+            future.result(timeout=0.01)
+        self.assertTrue(future.wait(timeout=5))
+
+
+    def test_cancel(self):
+        """ Test that cancel() interrupts sleep() in the future's thread,
+        and that cleanup code can still sleep afterwards.
+        """
+        started = threading.Event()
+        cleaned_up = []
+
+        def _work():
+            try:
+                started.set()
+                while True:
+                    util.sleep(10)
+            finally:
+                util.sleep(0.01)
+                cleaned_up.append(True)
+
+        future = util.run_async(_work)
+        self.assertTrue(started.wait(5))
+        self.assertTrue(future.cancel())
+        with self.assertRaises(util.CancelledError):
+            future.result(timeout=5)
+        self.assertTrue(future.cancelled())
+        self.assertEqual([True], cleaned_up)
+        self.assertFalse(future.cancel())
+
+    def test_cancel_pending(self):
+        """ Test that a function that was cancelled before it started
+        never runs.
+        """
+        pool = util.WorkerPool(1)
+        release = threading.Event()
+        calls = []
+        pool.submit(release.wait, 5)
+        future = pool.submit(calls.append, 1)
+        future.cancel()
+        release.set()
+        self.assertTrue(future.wait(5))
+        self.assertTrue(future.cancelled())
+        self.assertEqual([], calls)
+        pool.shutdown()
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_map(self):
+        pool = util.WorkerPool(2)
+        futures = pool.map(lambda x: x * 2, range(10))
+        self.assertEqual(
+            [x * 2 for x in range(10)],
+            [f.result(timeout=5) for f in futures]
+        )
+        self.assertTrue(len(pool._threads) <= 2)
+        pool.shutdown()
+        with self.assertRaises(util.BracketError):
+            pool.submit(lambda: None)
+
+    def test_max_workers(self):
+        with self.assertRaises(ValueError):
+            util.WorkerPool(0)
+
 
 # This PEM was generated by openssl, and must only be used for
 # unit testing.
@@ -0,0 +1,225 @@
+# Copyright 2016 Bracket Computing, Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# https://github.com/brkt/brkt-cli/blob/master/LICENSE
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time the phases of long-running commands.
+
+Code that runs a phase of encryption or update wraps it in a span:
+
+    with trace.span('register_ami', image_id=image_id):
+        ...
+
+Spans nest.  Each span counts the API calls and retries that were made
+while it was active, including calls made by nested spans.  Work that
+runs on another thread with util.run_async() or util.WorkerPool is
+attributed to the span that was active when the work was submitted.
+
+Tracing is off by default.  When the --trace-file option is specified,
+brkt_cli.main() calls enable() before running the subcommand and write()
+afterwards.  The output is a JSON document with one entry per span.
+Field names follow the OpenTelemetry span data model.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+COUNTER_API_CALLS = 'api_calls'
+COUNTER_RETRIES = 'retries'
+
+STATUS_OK = 'OK'
+STATUS_ERROR = 'ERROR'
+
+log = logging.getLogger(__name__)
+
+
+def _new_id(num_bytes):
+    return os.urandom(num_bytes).encode('hex')
+
+
+class Span(object):
+    """ A timed phase of a command. """
+
+    def __init__(self, name, trace_id, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.counters = {COUNTER_API_CALLS: 0, COUNTER_RETRIES: 0}
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = STATUS_OK
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        attributes = dict(self.attributes)
+        attributes.update(self.counters)
+        d = {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent.span_id if self.parent else None,
+            'start_time_unix_nano': int(self.start_time * 1e9),
+            'end_time_unix_nano': int(self.end_time * 1e9),
+            'duration_seconds': round(self.end_time - self.start_time, 3),
+            'attributes': attributes,
+            'status': {'code': self.status}
+        }
+        if self.error:
+            d['status']['message'] = self.error
+        return d
+
+
+class Tracer(object):
+    """ Records spans for one run of brkt-cli. """
+
+    def __init__(self):
+        self.trace_id = _new_id(16)
+        self.finished = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_span(self):
+        stack = self._stack()
+        if stack:
+            return stack[-1]
+        return None
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        s = Span(
+            name, self.trace_id, parent=self.current_span(),
+            attributes=attributes)
+        stack = self._stack()
+        stack.append(s)
+        try:
+            yield s
+        except BaseException as e:
+            s.status = STATUS_ERROR
+            s.error = '%s: %s' % (e.__class__.__name__, e)
+            raise
+        finally:
+            stack.pop()
+            s.end_time = time.time()
+            with self._lock:
+                self.finished.append(s)
+            log.debug(
+                'Span %s took %.3f seconds', name, s.end_time - s.start_time)
+
+    @contextlib.contextmanager
+    def activate(self, span):
+        """ Make the given span the parent of spans and counters on this
+        thread.
+        """
+        stack = self._stack()
+        saved = list(stack)
+        if span:
+            # Rebuild the ancestry, so that counters propagate to all
+            # enclosing spans.
+            ancestry = []
+            while span:
+                ancestry.insert(0, span)
+                span = span.parent
+            stack[:] = ancestry
+        try:
+            yield
+        finally:
+            stack[:] = saved
+
+    def count(self, counter, n=1):
+        """ Add n to the given counter on the current span and all of its
+        ancestors.
+        """
+        span = self.current_span()
+        with self._lock:
+            while span:
+                span.counters[counter] = span.counters.get(counter, 0) + n
+                span = span.parent
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.finished, key=lambda s: s.start_time)
+            return {
+                'trace_id': self.trace_id,
+                'spans': [s.to_dict() for s in spans]
+            }
+
+
+# The tracer for this process, or None if tracing is disabled.
+_tracer = None
+
+
+def enable():
+    """ Start recording spans. """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """ Time the enclosed block.  Yields the Span, or None if tracing is
+    disabled.
+    """
+    if not _tracer:
+        yield None
+        return
+    with _tracer.span(name, **attributes) as s:
+        yield s
+
+
+def current_span():
+    if _tracer:
+        return _tracer.current_span()
+    return None
+
+
+@contextlib.contextmanager
+def activate(span):
+    if not _tracer:
+        yield
+        return
+    with _tracer.activate(span):
+        yield
+
+
+def count(counter, n=1):
+    if _tracer:
+        _tracer.count(counter, n)
+
+
+def write(path):
+    """ Write all finished spans to the given file as JSON. """
+    if not _tracer:
+        return
+    with open(path, 'w') as f:
+        json.dump(_tracer.to_dict(), f, indent=2, sort_keys=True)
+    log.debug('Wrote trace to %s', path)
@@ -15,12 +15,17 @@ import abc
 import base64
 import getpass
 import logging
+import Queue
+import random
 import re
+import sys
+import threading
 import time
 import uuid
 
 import brkt_cli
 import brkt_cli.crypto
+from brkt_cli import trace
 from brkt_cli.validation import ValidationError
 
 SLEEP_ENABLED = True
@@ -34,6 +39,11 @@ class BracketError(Exception):
     pass
 
 
+class CancelledError(BracketError):
+    """ Raised in a thread whose Future has been cancelled. """
+    pass
+
+
 class Deadline(object):
     """Convenience class for bounding how long execution takes."""
 
@@ -62,34 +72,121 @@ class RetryExceptionChecker(object):
         pass
 
 
+# Holds the Future that the current thread is running, if any.
+_local = threading.local()
+
+
+def check_cancelled():
+    """ Raise CancelledError if the Future that the current thread is
+    running has been cancelled.  The error is raised only once, so that
+    cleanup code that runs while it propagates can still sleep and retry.
+    """
+    future = getattr(_local, 'future', None)
+    if future and future._cancel_requested.is_set() and \
+            not future._cancel_delivered:
+        future._cancel_delivered = True
+        raise CancelledError('Cancelled')
+
+
 def sleep(seconds):
-    if SLEEP_ENABLED:
+    """ Sleep for the given number of seconds.  If the current thread is
+    running a Future, wake up and raise CancelledError as soon as the
+    Future is cancelled.
+    """
+    check_cancelled()
+    if not SLEEP_ENABLED:
+        return
+    future = getattr(_local, 'future', None)
+    if future and not future._cancel_delivered:
+        future._cancel_requested.wait(seconds)
+        check_cancelled()
+    else:
         time.sleep(seconds)
 
 
+# The longest that retry() sleeps between attempts, unless
+# initial_sleep_seconds is larger.
+DEFAULT_RETRY_MAX_SLEEP_SECONDS = 20.0
+
+
+class RetryStats(object):
+    """ Counts the work done by retry(), across all threads.  failures is
+    the number of calls that gave up because the timeout was exceeded.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.sleep_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, calls=0, retries=0, failures=0, sleep_seconds=0.0):
+        with self._lock:
+            self.calls += calls
+            self.retries += retries
+            self.failures += failures
+            self.sleep_seconds += sleep_seconds
+
+    def __str__(self):
+        return (
+            '%d calls, %d retries, %d failures, slept %.1f seconds' %
+            (self.calls, self.retries, self.failures, self.sleep_seconds)
+        )
+
+
+# Retry statistics for this process.
+retry_stats = RetryStats()
+
+
+def retry_sleep_seconds(attempt, initial_sleep_seconds, max_sleep_seconds):
+    """ Return how long to sleep after the given failed attempt, using
+    capped exponential backoff with full jitter: a random interval between
+    zero and initial_sleep_seconds * 2 ^ (attempt - 1), capped at
+    max_sleep_seconds.  Spreading retries over the whole interval keeps
+    concurrent callers that failed together from retrying together.
+    """
+    cap = max(max_sleep_seconds, initial_sleep_seconds)
+    # Limit the exponent, so that the interval doesn't overflow.
+    interval = initial_sleep_seconds * (2 ** min(attempt - 1, 32))
+    return random.uniform(0, min(cap, interval))
+
+
 def retry(function, on=None, exception_checker=None, timeout=15.0,
-          initial_sleep_seconds=0.25):
-    """ Retry the given function until it completes successfully.  Before
-    retrying, sleep for initial_sleep_seconds. Double the sleep time on each
-    retry.  If the timeout is exceeded or an unexpected exception is raised,
-    raise the underlying exception.
+          initial_sleep_seconds=0.25,
+          max_sleep_seconds=DEFAULT_RETRY_MAX_SLEEP_SECONDS):
+    """ Retry the given function until it completes successfully.  After
+    each failure, sleep as described by retry_sleep_seconds().  If the
+    timeout is exceeded or an unexpected exception is raised, raise the
+    underlying exception.
+
+    The timeout applies to each call of the returned function, so the
+    wrapper can be reused.  Calls, retries and failures are counted in
+    retry_stats and in the current trace span.
 
     :param function the function that will be retried
     :param on a list of expected Exception classes
     :param exception_checker an instance of RetryExceptionChecker that is
         used to determine if the exception is expected
     :param timeout stop retrying if this number of seconds have lapsed
+        since the wrapper was called
     :param initial_sleep_seconds
+    :param max_sleep_seconds
     """
-    start_time = time.time()
-
     def _wrapped(*args, **kwargs):
-        for attempt in xrange(1, 1000):
+        deadline = Deadline(timeout)
+        attempt = 0
+        while True:
+            attempt += 1
+            trace.count(trace.COUNTER_API_CALLS)
+            if attempt > 1:
+                trace.count(trace.COUNTER_RETRIES)
+                retry_stats.record(calls=1, retries=1)
+            else:
+                retry_stats.record(calls=1)
             try:
                 return function(*args, **kwargs)
             except Exception as e:
-                now = time.time()
-
                 expected = False
                 if exception_checker and exception_checker.is_expected(e):
                     expected = True
@@ -98,17 +195,318 @@ def retry(function, on=None, exception_checker=None, timeout=15.0,
 
                 if not expected:
                     raise
-                if now - start_time > timeout:
+                if deadline.is_expired():
+                    retry_stats.record(failures=1)
                     log.error(
                         'Exceeded timeout of %s seconds for %s',
                         timeout,
-                        function.__name__)
+                        getattr(function, '__name__', function))
                     raise
-                else:
-                    sleep(initial_sleep_seconds * float(attempt))
+
+                seconds = min(
+                    retry_sleep_seconds(
+                        attempt, initial_sleep_seconds, max_sleep_seconds),
+                    max(0.0, deadline.deadline - time.time())
+                )
+                log.debug(
+                    'Attempt %d of %s failed with %s.  Retrying in %.2f '
+                    'seconds.',
+                    attempt, getattr(function, '__name__', function),
+                    e.__class__.__name__, seconds)
+                retry_stats.record(sleep_seconds=seconds)
+                sleep(seconds)
     return _wrapped
 
 
+class Backoff(object):
+    """ Generates sleep intervals for polling.  The interval starts at
+    initial_sleep_seconds and is multiplied by multiplier after each call to
+    next(), up to max_sleep_seconds.  Each interval is randomized by up to
+    jitter (a fraction of the interval), so that concurrent pollers don't
+    hit the API at the same time.
+    """
+
+    def __init__(self, initial_sleep_seconds=1.0, max_sleep_seconds=30.0,
+                 multiplier=2.0, jitter=0.2):
+        self.initial_sleep_seconds = initial_sleep_seconds
+        self.max_sleep_seconds = max_sleep_seconds
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self._interval = initial_sleep_seconds
+
+    def next(self):
+        interval = min(self._interval, self.max_sleep_seconds)
+        self._interval = interval * self.multiplier
+        spread = interval * self.jitter
+        return max(0.0, random.uniform(interval - spread, interval + spread))
+
+
+class WaitPolicy(object):
+    """ Describes how to poll for a state change: how long to wait before
+    the first check, how the interval between checks grows, and the
+    latency budget for the whole wait.  A timeout of None means that
+    there is no budget.
+    """
+
+    def __init__(self, initial_sleep_seconds, max_sleep_seconds, timeout,
+                 multiplier=2.0, jitter=0.2, initial_delay_seconds=0):
+        self.initial_sleep_seconds = initial_sleep_seconds
+        self.max_sleep_seconds = max_sleep_seconds
+        self.timeout = timeout
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.initial_delay_seconds = initial_delay_seconds
+
+    def backoff(self):
+        return Backoff(
+            initial_sleep_seconds=self.initial_sleep_seconds,
+            max_sleep_seconds=self.max_sleep_seconds,
+            multiplier=self.multiplier,
+            jitter=self.jitter
+        )
+
+
+def wait_until(check, policy, timeout=None, timeout_error=None,
+               description=None):
+    """ Call check() until it returns a value other than None, sleeping
+    between calls according to the given WaitPolicy.  check() can raise
+    an exception to stop waiting.
+
+    :param check a function that returns None if the wait should continue
+    :param policy a WaitPolicy
+    :param timeout overrides policy.timeout
+    :param timeout_error a function that returns the exception to raise
+        when the timeout expires
+    :param description describes what we're waiting for, for logging
+    :return the value returned by check()
+    :raise the exception returned by timeout_error(), or BracketError
+    """
+    if timeout is None:
+        timeout = policy.timeout
+    description = description or getattr(check, '__name__', 'condition')
+    start_time = time.time()
+    deadline = None
+    if timeout is not None:
+        deadline = start_time + timeout
+
+    backoff = policy.backoff()
+    delay = policy.initial_delay_seconds
+    num_checks = 0
+
+    while True:
+        if delay:
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.time()))
+            sleep(delay)
+
+        result = check()
+        num_checks += 1
+        if result is not None:
+            log.debug(
+                'Done waiting for %s after %.02f seconds and %d checks',
+                description, time.time() - start_time, num_checks)
+            return result
+
+        if deadline is not None and time.time() >= deadline:
+            break
+        delay = backoff.next()
+
+    log.debug(
+        'Timed out waiting for %s after %.02f seconds and %d checks',
+        description, time.time() - start_time, num_checks)
+    if timeout_error:
+        raise timeout_error()
+    raise BracketError(
+        'Timed out after %s seconds waiting for %s' % (timeout, description))
+
+
+class Future(object):
+    """ The eventual result of a function that runs on another thread.
+
+    The function can be cancelled with cancel().  Cancellation is
+    cooperative: the next time the function calls sleep(), directly or
+    through retry() and wait_until(), CancelledError is raised in its
+    thread.  The function's finally blocks then clean up as they would
+    after any other error.  Futures started by the function are not
+    cancelled.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._cancel_requested = threading.Event()
+        self._cancel_delivered = False
+        # Work done by the function is attributed to the span that was
+        # active when the future was created.
+        self._span = trace.current_span()
+
+    def _run(self, function, args, kwargs):
+        previous = getattr(_local, 'future', None)
+        _local.future = self
+        try:
+            # Don't start a function that was cancelled while it was
+            # waiting for a worker thread.
+            check_cancelled()
+            with trace.activate(self._span):
+                self._result = function(*args, **kwargs)
+        except:
+            self._exc_info = sys.exc_info()
+        finally:
+            _local.future = previous
+            self._done.set()
+
+    def cancel(self):
+        """ Ask the function to stop.
+
+        :return False if the function has already completed
+        """
+        if self.done():
+            return False
+        self._cancel_requested.set()
+        return True
+
+    def cancel_requested(self):
+        """ Return True if cancel() has been called. """
+        return self._cancel_requested.is_set()
+
+    def cancelled(self):
+        """ Return True if the function stopped because it was cancelled.
+        """
+        return (
+            self.done() and self._exc_info is not None and
+            isinstance(self._exc_info[1], CancelledError)
+        )
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exc_info):
+        """ Complete the future with the given sys.exc_info() tuple. """
+        self._exc_info = exc_info
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ Wait for the function to complete.
+
+        :return True if the function completed before the timeout
+        """
+        end = None
+        if timeout is not None:
+            end = time.time() + timeout
+        # Wait in short intervals.  Event.wait() without a timeout can't be
+        # interrupted with Ctrl-C in Python 2.
+        while not self._done.is_set():
+            interval = 1.0
+            if end is not None:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return False
+                interval = min(interval, remaining)
+            self._done.wait(interval)
+        return True
+
+    def exception(self, timeout=None):
+        """ Wait for the function to complete.
+
+        :return the exception that the function raised, or None
+        """
+        self.wait(timeout)
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def result(self, timeout=None):
+        """ Wait for the function to complete and return its result.  If the
+        function raised an exception, raise it here with the original
+        traceback.
+
+        :raise BracketError if the timeout expires
+        """
+        if not self.wait(timeout):
+            raise BracketError(
+                'Timed out after %s seconds waiting for result' % timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+def run_async(function, *args, **kwargs):
+    """ Call the function on a new daemon thread.
+
+    :return a Future that holds the result
+    """
+    future = Future()
+    t = threading.Thread(
+        target=future._run, args=(function, args, kwargs))
+    t.daemon = True
+    t.start()
+    return future
+
+
+class WorkerPool(object):
+    """ Run functions on a bounded number of daemon threads.  Threads are
+    started lazily, up to max_workers.
+    """
+
+    def __init__(self, max_workers):
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, function, args, kwargs = item
+            future._run(function, args, kwargs)
+
+    def submit(self, function, *args, **kwargs):
+        """ Schedule the function to run on a worker thread.
+
+        :return a Future that holds the result
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise BracketError('Worker pool has been shut down')
+            self._queue.put((future, function, args, kwargs))
+            if len(self._threads) < self.max_workers:
+                t = threading.Thread(target=self._work)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+        return future
+
+    def map(self, function, items):
+        """ Call the function once per item on the worker threads.
+
+        :return a list of Futures, in the same order as items
+        """
+        return [self.submit(function, item) for item in items]
+
+    def shutdown(self, wait=True):
+        """ Stop the worker threads after all pending work is done. """
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for t in threads:
+                while t.is_alive():
+                    t.join(1.0)
+
+
 def get_domain_from_brkt_env(brkt_env):
     """Return the domain string from the api_host in the brkt_env. """
 